@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+Compares two benchmark result files written by `benchmarks.run`.
+
+    python -m benchmarks.compare before.json after.json
+
+Prints the median time per call of each benchmark in both runs and how much
+it changed. Benchmarks which got slower by more than `--threshold` (10% by
+default), or started making more cache round trips, are flagged, and the
+exit status is 1 if there are any.
+'''
+
+import argparse
+import json
+import sys
+
+
+def compare(before, after, threshold):
+    '''
+    Returns a list of `(name, before_us, after_us, change, regressed)` for
+    the benchmarks in both runs, where `change` is the relative change in
+    median time.
+    '''
+    rows = []
+    for name in sorted(set(before['results']) & set(after['results'])):
+        old, new = before['results'][name], after['results'][name]
+        change = (new['median_us'] - old['median_us']) / old['median_us']
+        regressed = change > threshold or (
+            new.get('round_trips', 0) > old.get('round_trips', 0) + 0.01)
+        rows.append((name, old['median_us'], new['median_us'], change,
+                     regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown counted as a regression.')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before['meta']['backend'] != after['meta']['backend']:
+        print('warning: comparing runs against different backends')
+
+    rows = compare(before, after, args.threshold)
+    print('{:<40} {:>10} {:>10} {:>8}'.format('benchmark', 'before us',
+                                            'after us', 'change'))
+    for (name, old, new, change, regressed) in rows:
+        print('{:<40} {:>10.2f} {:>10.2f} {:>+8.1%}{}'.format(
+            name, old, new, change, '  REGRESSION' if regressed else ''))
+
+    for name in sorted(set(before['results']) ^ set(after['results'])):
+        print('{:<40} only in one run'.format(name))
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+'''
+An in-process stand-in for memcached, for benchmarking.
+
+`FakeMemcachedCache` stores values like Django's locmem backend, but sleeps
+for a fixed latency on every round trip, so that benchmarks reflect how many
+round trips a code path makes. Multi-key operations such as `get_many` count
+as a single round trip, as they do with memcached. Like memcached, it refuses
+values larger than 1 MB, dropping them silently.
+
+Configure it with the `LATENCY` option, in seconds:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'benchmarks.fakememcache.FakeMemcachedCache',
+            'OPTIONS': {'LATENCY': 0.0002},
+        },
+    }
+'''
+
+import pickle
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+
+DEFAULT_LATENCY = 0.0002
+
+# memcached's default item size limit.
+MAX_VALUE_SIZE = 1024 * 1024
+
+
+class FakeMemcachedCache(LocMemCache):
+    def __init__(self, name, params):
+        options = dict(params.get('OPTIONS') or {})
+        self.latency = options.pop('LATENCY', DEFAULT_LATENCY)
+        params = dict(params, OPTIONS=options)
+        super().__init__(name, params)
+        self.round_trips = 0
+        self._local = threading.local()
+
+    def _round_trip(self, method, *args, **kwargs):
+        # Operations the base class implements in terms of others (e.g.
+        # get_many with get) only pay for the outermost one.
+        depth = getattr(self._local, 'depth', 0)
+        if not depth:
+            self.round_trips += 1
+            if self.latency:
+                time.sleep(self.latency)
+        self._local.depth = depth + 1
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._local.depth = depth
+
+    def _too_large(self, value):
+        return len(pickle.dumps(value, self.pickle_protocol)) > MAX_VALUE_SIZE
+
+    def get(self, key, default=None, version=None):
+        return self._round_trip(super().get, key, default, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._too_large(value):
+            return self._round_trip(lambda: None)
+        return self._round_trip(super().set, key, value, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._too_large(value):
+            return self._round_trip(lambda: False)
+        return self._round_trip(super().add, key, value, timeout, version)
+
+    def delete(self, key, version=None):
+        return self._round_trip(super().delete, key, version)
+
+    def incr(self, key, delta=1, version=None):
+        return self._round_trip(super().incr, key, delta, version)
+
+    def get_many(self, keys, version=None):
+        return self._round_trip(super().get_many, keys, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._round_trip(super().set_many, data, timeout, version)
+
+    def delete_many(self, keys, version=None):
+        return self._round_trip(super().delete_many, keys, version)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+'''
+Runs the benchmarks in `benchmarks.suite` and writes their results as JSON.
+
+From the repository root:
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --backend fakememcache --latency 0.0002
+
+Each benchmark is timed with `timeit`: the number of calls per repeat is
+picked so that a repeat takes at least `--min-time` seconds, and the fastest
+and median of `--repeat` repeats are reported in microseconds per call. With
+the `fakememcache` backend, the average number of cache round trips per call
+is reported too.
+
+Compare two runs with `benchmarks.compare`.
+'''
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from django.conf import settings
+
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'fakememcache': 'benchmarks.fakememcache.FakeMemcachedCache',
+}
+
+
+def configure(backend, latency):
+    options = {}
+    if backend == 'fakememcache':
+        options['LATENCY'] = latency
+    settings.configure(
+        INSTALLED_APPS=['cachecow'],
+        CACHES={
+            'default': {
+                'BACKEND': BACKENDS[backend],
+                'LOCATION': 'cachecow-benchmarks',
+                'OPTIONS': options,
+            },
+        },
+    )
+
+    import django
+    django.setup()
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(setup, repeat, min_time):
+    from benchmarks.suite import round_trips
+
+    func = setup()
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_time:
+            break
+        number *= 2
+
+    trips_before = round_trips()
+    times = [t / number * 1e6 for t in timer.repeat(repeat, number)]
+    trips_after = round_trips()
+
+    result = {
+        'min_us': min(times),
+        'median_us': statistics.median(times),
+        'number': number,
+        'repeat': repeat,
+    }
+    if trips_before is not None:
+        result['round_trips'] = \
+            (trips_after - trips_before) / float(number * repeat)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        default='locmem')
+    parser.add_argument('--latency', type=float, default=0.0002,
+                        help='Seconds per round trip for fakememcache.')
+    parser.add_argument('--filter', default='',
+                        help='Only run benchmarks whose names contain this.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='Minimum seconds per repeat.')
+    parser.add_argument('--output', help='File to write results to.')
+    args = parser.parse_args(argv)
+
+    configure(args.backend, args.latency)
+    from benchmarks.suite import BENCHMARKS
+
+    import django
+    results = {
+        'meta': {
+            'backend': args.backend,
+            'latency': args.latency if args.backend == 'fakememcache'
+                       else None,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'revision': _git_revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+
+    for (name, setup) in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        result = run_benchmark(setup, args.repeat, args.min_time)
+        results['results'][name] = result
+        line = '{:<40} {:>10.2f} us'.format(name, result['median_us'])
+        if 'round_trips' in result:
+            line += ' {:>6.2f} round trips'.format(result['round_trips'])
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+'''
+The benchmarks run by `benchmarks.run`.
+
+Each benchmark is a function decorated with `@benchmark(name)`, which does
+any setup and returns the zero-argument callable to time. Settings must be
+configured before this module is imported.
+'''
+
+from itertools import count
+
+from django.core import cache
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from cachecow.cache import (Namespace, invalidate_namespace, key_arg_iterator,
+                            make_key)
+from cachecow.decorators import cached_function, cached_view
+from cachecow.intpacker import pack_int, unpack_int
+from cachecow.localcache import LocalCache
+
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return decorator
+
+
+@benchmark('make_key.short')
+def make_key_short():
+    return lambda: make_key('user_profile')
+
+
+@benchmark('make_key.long')
+def make_key_long():
+    key = ['user_profile', 12345, 'en-us', 'some', 'more', 'args', 3.5, None]
+    return lambda: make_key(key)
+
+
+@benchmark('make_key.hashed')
+def make_key_hashed():
+    # Longer than memcached's key limit, so it gets hashed.
+    key = ['search_results', 'q' * 300]
+    return lambda: make_key(key)
+
+
+@benchmark('make_key.dict')
+def make_key_dict():
+    key = ['filters', {'color': 'red', 'size': [1, 2, 3], 'page': 4}]
+    return lambda: make_key(key)
+
+
+@benchmark('key_arg_iterator')
+def key_arg_iterator_nested():
+    key = ['a', ['b', 'c', ['d']], {'e': 1, 'f': [2, 3]}]
+    return lambda: list(key_arg_iterator(key))
+
+
+@benchmark('intpacker.pack_int')
+def pack_large_int():
+    return lambda: pack_int(2 ** 40 + 12345)
+
+
+@benchmark('intpacker.unpack_int')
+def unpack_large_int():
+    packed = pack_int(2 ** 40 + 12345)
+    return lambda: unpack_int(packed)
+
+
+@benchmark('cached_function.hit')
+def cached_function_hit():
+    @cached_function()
+    def func(a, b, c=None):
+        return a
+
+    func(1, 'x', c=3)
+    return lambda: func(1, 'x', c=3)
+
+
+@benchmark('cached_function.hit_namespace')
+def cached_function_hit_namespace():
+    @cached_function(namespace='bench_ns')
+    def func(a, b, c=None):
+        return a
+
+    func(1, 'x', c=3)
+    return lambda: func(1, 'x', c=3)
+
+
+@benchmark('cached_function.hit_nested_namespace')
+def cached_function_hit_nested_namespace():
+    @cached_function(namespace=Namespace('bench_tenant', 42, 'reports', 2026))
+    def func(a, b, c=None):
+        return a
+
+    func(1, 'x', c=3)
+    return lambda: func(1, 'x', c=3)
+
+
+@benchmark('cached_function.hit_l1')
+def cached_function_hit_l1():
+    @cached_function(local_cache=LocalCache())
+    def func(a, b, c=None):
+        return a
+
+    func(1, 'x', c=3)
+    return lambda: func(1, 'x', c=3)
+
+
+@benchmark('cached_function.miss')
+def cached_function_miss():
+    @cached_function()
+    def func(a):
+        return a
+
+    counter = count()
+    return lambda: func(next(counter))
+
+
+@benchmark('cached_function.miss_namespace')
+def cached_function_miss_namespace():
+    @cached_function(namespace='bench_miss_ns')
+    def func(a):
+        return a
+
+    counter = count()
+    return lambda: func(next(counter))
+
+
+@benchmark('cached_function.miss_write_behind')
+def cached_function_miss_write_behind():
+    @cached_function(write_behind=True)
+    def func(a):
+        return a
+
+    counter = count()
+    return lambda: func(next(counter))
+
+
+@benchmark('invalidate_namespace')
+def invalidate_namespace_only():
+    return lambda: invalidate_namespace('bench_invalidate_ns')
+
+
+@benchmark('cached_view.hit')
+def cached_view_hit():
+    @cached_view()
+    def view(request, slug):
+        return HttpResponse('x' * 1000)
+
+    request = RequestFactory().get('/items/', {'page': 2})
+    view(request, 'slug')
+    return lambda: view(request, 'slug')
+
+
+@benchmark('cached_view.hit_full_response')
+def cached_view_hit_full_response():
+    @cached_view(full_response=True)
+    def view(request, slug):
+        return HttpResponse('x' * 1000)
+
+    request = RequestFactory().get('/items/', {'page': 2})
+    view(request, 'slug')
+    return lambda: view(request, 'slug')
+
+
+@benchmark('cached_view.not_modified')
+def cached_view_not_modified():
+    @cached_view(full_response=True)
+    def view(request, slug):
+        return HttpResponse('x' * 1000)
+
+    etag = view(RequestFactory().get('/items/'), 'slug')['ETag']
+    request = RequestFactory().get('/items/', HTTP_IF_NONE_MATCH=etag)
+    return lambda: view(request, 'slug')
+
+
+def round_trips():
+    '''
+    Returns the round trips made so far if the backend counts them, as
+    `FakeMemcachedCache` does, or None.
+    '''
+    return getattr(cache.cache, 'round_trips', None)
@@ -1,3 +1,4 @@
+from collections import namedtuple
 import hashlib
 from itertools import chain
 import logging
@@ -9,11 +10,16 @@ import django
 from django.conf import settings
 from django.core import cache
 
+from cachecow import localcache, requestcache
 from cachecow.intpacker import pack_int
 
 
 logger = logging.getLogger(__name__)
 
+# Namespace key -> (version, time.monotonic() when seen) for the namespace
+# versions this process has most recently seen.
+_namespace_versions = {}
+
 # A memcached limit.
 MAX_KEY_LENGTH = 250
 
@@ -57,21 +63,29 @@ def key_arg_iterator(key_args, max_depth=1):
         yield key_args
 
 
+class SerializedKey(str):
+    '''
+    A key which has already been serialized as `make_key` would, so that it
+    can be passed to `make_key` again without being reprocessed.
+    '''
+
+
 def _format_key_arg(arg):
     '''
     Selectively formats args passed to `make_key`. Defaults to serializing
     into a Unicode string and then encoding in UTF-8.
     '''
-    to_string = lambda x: str(x)
-
     if arg is None:
         return ''
+    elif type(arg) is int:
+        # Can't contain anything we'd need to strip.
+        return str(arg)
     elif isinstance(arg, dict):
         # `str` is wasteful for dicts for our purposes here, so let's compact.
-        s = ','.join([to_string(key) + ':' + to_string(val)
+        s = ','.join([str(key) + ':' + str(val)
                       for (key, val) in arg.items()])
     else:
-        s = to_string(arg)
+        s = str(arg)
 
     # Strip control characters and spaces (which memcached won't allow).
     return s.translate(_ALL_CHARS_EXCEPT_CONTROL_CODES)
@@ -109,11 +123,132 @@ def make_key(obj, namespace=None, skip_prefix=False):
 
     [2] http://code.sixapart.com/svn/memcached/trunk/server/doc/protocol.txt
     '''
-    key = '.'.join(map(_format_key_arg, key_arg_iterator(obj)))
+    key = _serialize_key(obj)
 
     if namespace is not None:
-        key = '{}:{}'.format(_get_namespace_prefix(namespace), key)
+        key = _namespace_key(_get_namespace_prefix(namespace), key)
+
+    return _finalize_key(key, skip_prefix=skip_prefix)
+
+
+class Namespace(object):
+    '''
+    A namespace nested within others, given by its path from the outermost
+    one: `Namespace('tenant:42', 'reports', 2026)` lies within
+    `Namespace('tenant:42', 'reports')`, which lies within `'tenant:42'`.
+
+    Invalidating a namespace invalidates every namespace nested within it too,
+    still in O(1). The outermost level is the same namespace as the flat one
+    of the same name, so `invalidate_namespace('tenant:42')` invalidates all
+    of the above.
+
+    Each level has its own version, and keys in the namespace are prefixed
+    with all of them. The whole chain is fetched in a single `get_many`.
+    '''
+    def __init__(self, *path):
+        if not path:
+            raise ValueError('A namespace needs at least one level.')
+        self.path = path
+
+    def __repr__(self):
+        return 'Namespace{!r}'.format(self.path)
+
+    def __eq__(self, other):
+        return isinstance(other, Namespace) and self.path == other.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def child(self, *names):
+        '''
+        Returns the namespace nested within this one by `names`.
+        '''
+        return Namespace(*(self.path + names))
+
+    @property
+    def parent(self):
+        if len(self.path) == 1:
+            return None
+        return Namespace(*self.path[:-1])
+
+    @property
+    def keys(self):
+        '''
+        The cache keys holding the version of each level, outermost first.
+        '''
+        return tuple(make_key(list(self.path[:i + 1]))
+                     for i in range(len(self.path)))
+
+    @property
+    def key(self):
+        return make_key(list(self.path))
+
+
+def _namespace_chain(namespace):
+    '''
+    Returns a tuple of the keys of a namespace's versions, outermost first.
+    For flat namespaces, that's just the one.
+    '''
+    if isinstance(namespace, Namespace):
+        return namespace.keys
+    return (make_key(namespace),)
+
+
+def _namespace_own_key(namespace):
+    if isinstance(namespace, Namespace):
+        return namespace.key
+    return make_key(namespace)
+
 
+def _pack_versions(versions):
+    return '.'.join([pack_int(version) for version in versions])
+
+
+def _tag_keys(tags):
+    '''
+    Returns a tuple of the cache keys holding the versions of `tags`, without
+    duplicates.
+    '''
+    keys = []
+    for tag in tags:
+        key = make_key(['cachecow_tag', tag])
+        if key not in keys:
+            keys.append(key)
+    return tuple(keys)
+
+
+class TaggedKey(str):
+    '''
+    A cache key returned by a lookup with tags, which remembers the versions
+    the tags had at the time as a tuple of `(tag key, version)` tuples.
+    `set_cache` stores these along with the value, so that it's only valid
+    until one of its tags is invalidated.
+
+    Taking the versions from before the value was computed means that if a tag
+    is invalidated while the value is being computed, it's stored already
+    invalid rather than outliving the invalidation.
+    '''
+    def __new__(cls, key, tag_versions):
+        obj = str.__new__(cls, key)
+        obj.tag_versions = tag_versions
+        return obj
+
+
+def _serialize_key(obj):
+    if isinstance(obj, SerializedKey):
+        return obj
+    return '.'.join(map(_format_key_arg, key_arg_iterator(obj)))
+
+
+def _namespace_key(ns_prefix, key):
+    return '{}:{}'.format(ns_prefix, key)
+
+
+def _finalize_key(key, skip_prefix=False):
+    '''
+    Adds the global key prefix to a serialized key, and hashes it if it's too
+    long. See `make_key`.
+    '''
     # Use cache.key_prefix if available (Django>=1.3),
     # otherwise CACHE_KEY_PREFIX.
     if (not skip_prefix
@@ -121,11 +256,6 @@ def make_key(obj, namespace=None, skip_prefix=False):
             and getattr(settings, 'CACHE_KEY_PREFIX', None)):
         key = '{}:{}'.format(settings.CACHE_KEY_PREFIX, key)
 
-    try:
-        django_key = cache.cache.make_key(key)
-    except AttributeError:
-        django_key = key
-
     # If the resulting key is too long, hash the part after the prefix, and
     # truncate as needed.
     if len(key) > MAX_KEY_LENGTH:
@@ -142,7 +272,8 @@ def make_key(obj, namespace=None, skip_prefix=False):
         #TODO a further refinement of this would be to hash only the smallest 
         # part necessary to get it under the limit. Don't hash an entire key 
         # just for being 1 char too long. This would improve readability.
-        key = hashlib.md5(key).hexdigest()[:MAX_KEY_LENGTH - len(prefix)]
+        key = hashlib.md5(key.encode('utf-8')).hexdigest()
+        key = key[:MAX_KEY_LENGTH - len(prefix)]
     return key
 
 
@@ -162,40 +293,433 @@ def _make_namespace_prefix():
     return int((time.time() % decade_s) * 1e9)
 
 
+def _remember_namespace_version(ns_key, version):
+    _namespace_versions[ns_key] = (version, time.monotonic())
+    current = requestcache.get_current()
+    if current is not None:
+        current.versions[ns_key] = version
+
+
+def _forget_namespace_version(ns_key):
+    _namespace_versions.pop(ns_key, None)
+    current = requestcache.get_current()
+    if current is not None:
+        current.versions.pop(ns_key, None)
+
+
+def _get_remembered_namespace_version(ns_key):
+    '''
+    Returns a tuple of `(version, fresh)` for the namespace version this
+    process last saw, where `fresh` is True if it was seen within the
+    `CACHECOW_NAMESPACE_VERSION_TTL` setting (in seconds, 0 by default) and
+    can be trusted without asking the cache backend. `version` is None if we
+    haven't seen one.
+
+    Versions seen within the active request cache, if any, are always fresh.
+    '''
+    current = requestcache.get_current()
+    if current is not None and ns_key in current.versions:
+        return current.versions[ns_key], True
+    try:
+        version, seen_at = _namespace_versions[ns_key]
+    except KeyError:
+        return None, False
+    ttl = getattr(settings, 'CACHECOW_NAMESPACE_VERSION_TTL', 0)
+    return version, bool(ttl) and time.monotonic() - seen_at < ttl
+
+
+def _init_version(key):
+    '''
+    Initializes the version held in `key` (of a namespace or tag) when it's
+    missing from the cache. Uses `cache.add` so that if several processes race
+    to initialize it, they all end up agreeing on the winner's version.
+    '''
+    version = _make_namespace_prefix()
+    if not cache.cache.add(key, version):
+        version = cache.cache.get(key) or version
+    return version
+
+
+async def _ainit_version(key):
+    version = _make_namespace_prefix()
+    if not await cache.cache.aadd(key, version):
+        version = await cache.cache.aget(key) or version
+    return version
+
+
+def _init_namespace_version(ns_key):
+    version = _init_version(ns_key)
+    _remember_namespace_version(ns_key, version)
+    return version
+
+
+async def _ainit_namespace_version(ns_key):
+    version = await _ainit_version(ns_key)
+    _remember_namespace_version(ns_key, version)
+    return version
+
+
+def _get_many(keys):
+    # A single key is cheaper to fetch on its own with some backends.
+    if not keys:
+        return {}
+    if len(keys) == 1:
+        val = cache.cache.get(keys[0])
+        return {} if val is None else {keys[0]: val}
+    return cache.cache.get_many(keys)
+
+
+async def _aget_many(keys):
+    if not keys:
+        return {}
+    if len(keys) == 1:
+        val = await cache.cache.aget(keys[0])
+        return {} if val is None else {keys[0]: val}
+    return await cache.cache.aget_many(keys)
+
+
+def _get_namespace_versions(ns_chain):
+    '''
+    Returns a list of the versions of a chain of namespace keys, fetching any
+    that this process can't trust in a single `get_many`.
+    '''
+    versions = {}
+    unverified = []
+    for ns_key in ns_chain:
+        version, fresh = _get_remembered_namespace_version(ns_key)
+        if fresh:
+            versions[ns_key] = version
+        else:
+            unverified.append(ns_key)
+
+    if unverified:
+        fetched = _get_many(unverified)
+        for ns_key in unverified:
+            version = fetched.get(ns_key)
+            if not version:
+                version = _init_namespace_version(ns_key)
+            else:
+                _remember_namespace_version(ns_key, version)
+            versions[ns_key] = version
+    return [versions[ns_key] for ns_key in ns_chain]
+
+
 def _get_namespace_prefix(namespace):
     '''
-    Gets (or sets if uninitialized) the key prefix for the given namespace 
-    string. The return value will prepend any keys that belong to the namespace.
+    Gets (or sets if uninitialized) the key prefix for the given namespace,
+    either a flat one or a `Namespace`. The return value will prepend any keys
+    that belong to the namespace.
     '''
     #TODO Use a special namespace prefix for namespace keys.
-    namespace = make_key(namespace)
-    ns_prefix = cache.cache.get(namespace)
-    if not ns_prefix:
-        ns_prefix = _make_namespace_prefix()
-        cache.cache.set(namespace, ns_prefix)
+    # Compact the versions to save space when using the prefix.
+    return _pack_versions(_get_namespace_versions(_namespace_chain(namespace)))
+
+
+class _Lookup(object):
+    '''
+    The state of a `lookup_cache_many`, kept apart from the calls to the cache
+    backend so that the sync and async versions can share it.
+    '''
+    def __init__(self, items):
+        self.items = []
+        self.item_tags = []
+        for item in items:
+            obj, namespace = item[:2]
+            tags = item[2] if len(item) > 2 else None
+            self.items.append((_serialize_key(obj),
+                               None if namespace is None
+                               else _namespace_chain(namespace)))
+            self.item_tags.append(None if tags is None else _tag_keys(tags))
+
+        # Tag versions are only trusted from the request cache. Otherwise,
+        # they're always fetched along with the values.
+        self.request_cache = requestcache.get_current()
+        self.tag_versions = {}
+        self.tag_keys = set(chain.from_iterable(
+            tags for tags in self.item_tags if tags is not None))
+        if self.request_cache is not None:
+            for tag_key in list(self.tag_keys):
+                version = self.request_cache.versions.get(tag_key)
+                if version is not None:
+                    self.tag_versions[tag_key] = version
+                    self.tag_keys.discard(tag_key)
+
+        # Namespace versions to build keys from, and whether they're trusted.
+        self.versions = {}
+        self.unverified = set()
+        for (_, ns_chain) in self.items:
+            for ns_key in ns_chain or ():
+                if ns_key in self.versions or ns_key in self.unverified:
+                    continue
+                version, fresh = _get_remembered_namespace_version(ns_key)
+                if version is not None:
+                    self.versions[ns_key] = version
+                if not fresh:
+                    self.unverified.add(ns_key)
+        self.changed = set()
+
+        self.keys = [self._make_key(base_key, ns_chain)
+                     for (base_key, ns_chain) in self.items]
+
+    def _make_key(self, base_key, ns_chain):
+        '''
+        Returns the key for an item, or None if we don't know all of its
+        namespace versions yet.
+        '''
+        if ns_chain is None:
+            return _finalize_key(base_key)
+        try:
+            versions = [self.versions[ns_key] for ns_key in ns_chain]
+        except KeyError:
+            return None
+        return _finalize_key(_namespace_key(_pack_versions(versions),
+                                            base_key))
+
+    def _unknown(self, keys):
+        # Values already in the request cache needn't be fetched again.
+        if self.request_cache is None:
+            return keys
+        return [key for key in keys if key not in self.request_cache.values]
+
+    def keys_to_fetch(self):
+        return (list(self.unverified) + list(self.tag_keys)
+                + self._unknown([key for key in self.keys if key is not None]))
+
+    def check_versions(self, vals):
+        '''
+        Checks the versions we guessed at against those fetched in `vals`.
+        Returns a list of the namespace keys which are missing from the
+        cache, and must be initialized with `set_version`.
+        '''
+        missing = []
+        for ns_key in self.unverified:
+            current_version = vals.get(ns_key)
+            if not current_version:
+                missing.append(ns_key)
+                continue
+            _remember_namespace_version(ns_key, current_version)
+            self.set_version(ns_key, current_version)
+        return missing
+
+    def check_tags(self, vals):
+        '''
+        Records the tag versions fetched in `vals`. Returns a list of the tag
+        keys which are missing from the cache, and must be initialized and
+        added to `tag_versions`.
+        '''
+        missing = []
+        for tag_key in self.tag_keys:
+            version = vals.get(tag_key)
+            if not version:
+                missing.append(tag_key)
+            else:
+                self.set_tag_version(tag_key, version)
+        return missing
+
+    def set_tag_version(self, tag_key, version):
+        self.tag_versions[tag_key] = version
+        if self.request_cache is not None:
+            self.request_cache.versions[tag_key] = version
+
+    def set_version(self, ns_key, version):
+        if self.versions.get(ns_key) != version:
+            self.versions[ns_key] = version
+            self.changed.add(ns_key)
+
+    def keys_to_refetch(self):
+        '''
+        Rebuilds the keys of items whose namespace versions turned out to be
+        wrong, and returns them.
+        '''
+        refetch = []
+        for (i, (base_key, ns_chain)) in enumerate(self.items):
+            if ns_chain is not None and self.changed.intersection(ns_chain):
+                self.keys[i] = self._make_key(base_key, ns_chain)
+                refetch.append(self.keys[i])
+        return self._unknown(refetch)
+
+    def results(self, vals):
+        results = []
+        for (key, tags) in zip(self.keys, self.item_tags):
+            val = vals.get(key)
+            if self.request_cache is not None:
+                if val is None:
+                    val = self.request_cache.values.get(key)
+                else:
+                    self.request_cache.values[key] = val
+            if tags is not None:
+                tag_versions = tuple((tag_key, self.tag_versions[tag_key])
+                                     for tag_key in tags)
+                if val is not None and not _tags_match(val, tag_versions):
+                    logger.debug(u'tags invalidated for key: %s', key)
+                    val = None
+                key = TaggedKey(key, tag_versions)
+            results.append((key, val))
+        return results
+
+
+def _tags_match(val, tag_versions):
+    '''
+    Returns True if `val` was stored with the given tag versions.
+    '''
+    if not isinstance(val, CacheEntry) or val.tags is None:
+        return False
+    return dict(val.tags) == dict(tag_versions)
 
-    # Compact the key before returning it to save space when using it.
-    return pack_int(ns_prefix)
+
+def lookup_cache(obj, namespace=None, tags=None):
+    '''
+    Returns a tuple of `(key, value)` for the given key object, as serialized
+    by `make_key`, where `value` is None on a cache miss. Use `key` to set the
+    value after a miss.
+
+    `tags` is a list of tags (anything `make_key` accepts, such as `'user:7'`
+    or `['product', 99]`) that the value depends on. Their current versions
+    are fetched in the same `get_many` as the value, which is a miss if it
+    was stored with older ones, i.e. if any of its tags have been invalidated
+    with `invalidate_tag` since. The returned key is a `TaggedKey`, so that
+    setting the value with it stores their versions along with it.
+
+    When a `namespace` is given, this costs a single round trip to the cache
+    backend in the common case: the namespace version this process last saw
+    is used to build the key, and it is validated by fetching the namespace
+    key together with the value in one `get_many`. Only if the namespace was
+    invalidated in the meantime (or this process has never seen it) does it
+    take a second round trip. The same goes for every level of a nested
+    `Namespace`.
+
+    Set `CACHECOW_NAMESPACE_VERSION_TTL` to trust a namespace version this
+    process has seen within that many seconds without validating it, which
+    saves fetching the namespace key at all, at the cost of noticing other
+    processes' invalidations up to that much later.
+    '''
+    if namespace is None and tags is None:
+        key = make_key(obj)
+        current = requestcache.get_current()
+        if current is None:
+            return key, cache.cache.get(key)
+        val = current.values.get(key)
+        if val is None:
+            val = cache.cache.get(key)
+            if val is not None:
+                current.values[key] = val
+        return key, val
+    return lookup_cache_many([(obj, namespace, tags)])[0]
+
+
+async def alookup_cache(obj, namespace=None, tags=None):
+    '''
+    Async version of `lookup_cache`, using Django's async cache API.
+    '''
+    if namespace is None and tags is None:
+        key = make_key(obj)
+        current = requestcache.get_current()
+        if current is None:
+            return key, await cache.cache.aget(key)
+        val = current.values.get(key)
+        if val is None:
+            val = await cache.cache.aget(key)
+            if val is not None:
+                current.values[key] = val
+        return key, val
+    return (await alookup_cache_many([(obj, namespace, tags)]))[0]
+
+
+def lookup_cache_many(items):
+    '''
+    Like `lookup_cache`, for a list of `(obj, namespace)` or
+    `(obj, namespace, tags)` tuples, where `namespace` and `tags` may be None.
+    Returns a list of `(key, value)` tuples in the same order.
+
+    Every namespace and tag involved is resolved in the same `get_many` as the
+    values themselves, so this usually costs a single round trip to the cache
+    backend, and never more than two (plus one `cache.add` for each namespace
+    or tag which has yet to be initialized).
+    '''
+    lookup = _Lookup(items)
+    vals = _get_many(lookup.keys_to_fetch())
+    for ns_key in lookup.check_versions(vals):
+        lookup.set_version(ns_key, _init_namespace_version(ns_key))
+    for tag_key in lookup.check_tags(vals):
+        lookup.set_tag_version(tag_key, _init_version(tag_key))
+    refetch = lookup.keys_to_refetch()
+    if refetch:
+        vals.update(_get_many(refetch))
+    return lookup.results(vals)
+
+
+async def alookup_cache_many(items):
+    '''
+    Async version of `lookup_cache_many`.
+    '''
+    lookup = _Lookup(items)
+    vals = await _aget_many(lookup.keys_to_fetch())
+    for ns_key in lookup.check_versions(vals):
+        lookup.set_version(ns_key, await _ainit_namespace_version(ns_key))
+    for tag_key in lookup.check_tags(vals):
+        lookup.set_tag_version(tag_key, await _ainit_version(tag_key))
+    refetch = lookup.keys_to_refetch()
+    if refetch:
+        vals.update(await _aget_many(refetch))
+    return lookup.results(vals)
 
 
 def invalidate_namespace(namespace):
     '''
+    Invalidates every key in a namespace, and in any `Namespace` nested within
+    it.
+
     If the namespace is already invalid (i.e. the namespace key has been 
     deleted from the cache), this does nothing.
 
     This operation is atomic as long as the cache backend's `incr` is too.
 
     It is an O(1) operation, independent of the number of keys in a namespace.
+
+    Any entries from the namespace held in this process's local (L1) caches
+    are dropped as well. Other processes' L1 caches only notice once their
+    entries time out.
     '''
-    namespace = make_key(namespace)
+    namespace = _namespace_own_key(namespace)
+
+    logger.debug(u'invalidating namespace: %s', namespace)
 
-    logger.debug('invalidating namespace: {0}'.format(namespace))
+    localcache.delete_namespace(namespace)
 
     try:
-        cache.cache.incr(namespace)
+        version = cache.cache.incr(namespace)
     except ValueError:
         # The namespace is already invalid, since its key is gone.
-        pass
+        _forget_namespace_version(namespace)
+    else:
+        _remember_namespace_version(namespace, version)
+
+
+def invalidate_tag(tag):
+    '''
+    Invalidates every value stored with `tag`, with a single `cache.incr`.
+
+    If the tag's key has been evicted from the cache, this does nothing: it
+    gets a new version when it's next looked up, which invalidates them too.
+
+    Any tagged entries held in this process's local (L1) caches are dropped as
+    well.
+    '''
+    tag_key = _tag_keys([tag])[0]
+
+    logger.debug(u'invalidating tag: %s', tag_key)
+
+    localcache.delete_namespace(tag_key)
+
+    current = requestcache.get_current()
+    try:
+        version = cache.cache.incr(tag_key)
+    except ValueError:
+        if current is not None:
+            current.versions.pop(tag_key, None)
+    else:
+        if current is not None:
+            current.versions[tag_key] = version
 
 
 def timedelta_to_seconds(t):
@@ -210,13 +734,10 @@ def timedelta_to_seconds(t):
         return int(t.microseconds + (t.seconds + t.days * 3600 * 24))
 
 
-def set_cache(key, val, timeout=None, namespace=None, **kwargs):
+def normalize_timeout(timeout):
     '''
-    Wrapper around cache.set to allow either int or timedelta timeouts,
-    and optional namespace support.
-
-    Passes `kwargs` on to `cache.set` for Django 1.3+'s optional `version`
-    parameter.
+    Returns `timeout` in seconds, accepting either an int or a timedelta (or
+    None, which is passed through).
     '''
     try:
         timeout = timedelta_to_seconds(timeout)
@@ -225,9 +746,131 @@ def set_cache(key, val, timeout=None, namespace=None, **kwargs):
 
     if timeout and timeout < 0:
         raise Exception('Cache timeout value must not be negative.')
+    return timeout
+
+
+# Envelope for values stored with metadata, such as a soft timeout.
+# `soft_expiry` and `expiry` are Unix timestamps, `compute_time` is how long
+# the value took to compute in seconds, and `tags` is a tuple of the
+# `(tag key, version)` tuples it was stored with. Any of them may be None.
+CacheEntry = namedtuple('CacheEntry',
+                        ['value', 'soft_expiry', 'expiry', 'compute_time',
+                         'tags'],
+                        defaults=(None, None, None))
+
+
+class _CachedNone(object):
+    '''
+    Stands in for a cached None, since the cache backends return None for a
+    miss. Pickles as a reference to `CACHED_NONE`, so it stays a singleton
+    and costs only a few bytes.
+    '''
+    def __reduce__(self):
+        return 'CACHED_NONE'
+
+    def __repr__(self):
+        return 'CACHED_NONE'
+
+
+CACHED_NONE = _CachedNone()
+
+
+def unpack_entry(val):
+    '''
+    Returns a tuple of `(value, stale)` for a value read from the cache, where
+    `stale` is True if it was stored with a soft timeout that has passed.
+    Values stored without any metadata are passed through as never stale, and
+    `CACHED_NONE` is turned back into None.
+    '''
+    stale = False
+    if isinstance(val, CacheEntry):
+        stale = val.soft_expiry is not None and time.time() >= val.soft_expiry
+        val = val.value
+    if isinstance(val, _CachedNone):
+        val = None
+    return val, stale
+
+
+def set_cache(key, val, timeout=None, namespace=None, soft_timeout=None,
+              compute_time=None, **kwargs):
+    '''
+    Wrapper around cache.set to allow either int or timedelta timeouts,
+    and optional namespace support.
+
+    If `soft_timeout` is given (as an int or timedelta), or the seconds the
+    value took to compute as `compute_time`, the value is stored in a
+    `CacheEntry` which records them along with when it expires. Use
+    `unpack_entry` to read it back. So is a value set with a `TaggedKey`, to
+    record its tag versions.
+
+    Passes `kwargs` on to `cache.set` for Django 1.3+'s optional `version`
+    parameter.
+    '''
+    timeout = normalize_timeout(timeout)
+    val = _pack_entry(val, timeout, soft_timeout, compute_time,
+                      getattr(key, 'tag_versions', None))
 
-    logger.debug(u'setting cache: {} = {} ({}, timeout={})'.format(
-        key, val, val.__class__, timeout))
+    logger.debug(u'setting cache: %s = %r (%s, timeout=%s)',
+                 key, val, val.__class__, timeout)
 
     cache.cache.set(key, val, timeout=timeout, **kwargs)
+    _remember_value(key, val)
+
+
+async def aset_cache(key, val, timeout=None, soft_timeout=None,
+                     compute_time=None, **kwargs):
+    '''
+    Async version of `set_cache`, using Django's async cache API.
+    '''
+    timeout = normalize_timeout(timeout)
+    val = _pack_entry(val, timeout, soft_timeout, compute_time,
+                      getattr(key, 'tag_versions', None))
+
+    logger.debug(u'setting cache: %s = %r (%s, timeout=%s)',
+                 key, val, val.__class__, timeout)
+
+    await cache.cache.aset(key, val, timeout=timeout, **kwargs)
+    _remember_value(key, val)
+
+
+def set_cache_many(data, timeout=None, soft_timeout=None, compute_time=None,
+                   **kwargs):
+    '''
+    Like `set_cache`, but sets every key and value in the dict `data` with
+    a single `cache.set_many`. `compute_time`, if given, applies to each value.
+    '''
+    timeout = normalize_timeout(timeout)
+    data = dict((key, _pack_entry(val, timeout, soft_timeout, compute_time,
+                                  getattr(key, 'tag_versions', None)))
+                for (key, val) in data.items())
+
+    logger.debug(u'setting cache for %s keys (timeout=%s)', len(data), timeout)
+
+    cache.cache.set_many(data, timeout=timeout, **kwargs)
+    for (key, val) in data.items():
+        _remember_value(key, val)
+
+
+def _remember_value(key, val):
+    current = requestcache.get_current()
+    if current is not None:
+        current.values[key] = val
+
+
+def _pack_entry(val, timeout, soft_timeout=None, compute_time=None,
+                tags=None):
+    '''
+    Wraps `val` in a `CacheEntry` if there's any metadata to store with it.
+    `timeout` must already be normalized.
+    '''
+    if soft_timeout is None and compute_time is None and tags is None:
+        return val
+
+    now = time.time()
+    soft_expiry = expiry = None
+    if soft_timeout is not None:
+        soft_expiry = now + normalize_timeout(soft_timeout)
+    if timeout:
+        expiry = now + timeout
+    return CacheEntry(val, soft_expiry, expiry, compute_time, tags)
 
@@ -0,0 +1,148 @@
+'''
+Namespaced versions of the low-level Django cache API, for using CacheCow's
+key handling and namespaces without the decorators:
+
+    from cachecow import client
+
+    client.set_many({'a': 1, 'b': 2}, namespace=Namespace('tenant:42', 'stats'))
+    client.get_many(['a', 'b'], namespace=Namespace('tenant:42', 'stats'))
+    invalidate_namespace('tenant:42')
+
+Keys may be anything `make_key` accepts. A namespace's versions are resolved
+once for each call, however many keys it's given, so batch operations cost
+two round trips to the cache backend in total: one `get_many` for every level
+of the namespace and one for the data. Reads do better, fetching the
+namespace versions together with the values as `lookup_cache_many` does, so
+they usually cost a single round trip. Like `make_key`, writes trust
+namespace versions this process has seen within the
+`CACHECOW_NAMESPACE_VERSION_TTL` setting without fetching them at all.
+
+Values stored with metadata, such as by `cached_function` with a
+`soft_timeout`, are unpacked when read.
+'''
+
+from django.core import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from cachecow import requestcache, writebehind
+from cachecow.cache import (lookup_cache_many, make_key, normalize_timeout,
+                            unpack_entry, _finalize_key, _get_namespace_prefix,
+                            _namespace_key, _remember_value, _serialize_key)
+
+
+def _make_keys(objs, namespace):
+    '''
+    Returns a list of the cache keys for `objs`, resolving `namespace` only
+    once for all of them.
+    '''
+    if namespace is None:
+        return [make_key(obj) for obj in objs]
+    prefix = _get_namespace_prefix(namespace)
+    return [_finalize_key(_namespace_key(prefix, _serialize_key(obj)))
+            for obj in objs]
+
+
+def _normalize_timeout(timeout):
+    # Leave Django's sentinel for the backend's default timeout alone.
+    if timeout is DEFAULT_TIMEOUT:
+        return timeout
+    return normalize_timeout(timeout)
+
+
+def get(key, default=None, namespace=None):
+    '''
+    Returns the value for `key` in `namespace`, or `default` on a miss.
+    '''
+    val = lookup_cache_many([(key, namespace)])[0][1]
+    if val is None:
+        return default
+    return unpack_entry(val)[0]
+
+
+def get_many(keys, namespace=None):
+    '''
+    Returns a dict of the keys found in `namespace` and their values, fetching
+    the namespace's versions along with them in one `get_many`. The keys must
+    be hashable to be returned, e.g. strings or tuples rather than lists.
+    '''
+    keys = list(keys)
+    results = lookup_cache_many([(key, namespace) for key in keys])
+    found = {}
+    for (key, (_, val)) in zip(keys, results):
+        if val is not None:
+            found[key] = unpack_entry(val)[0]
+    return found
+
+
+def set(key, val, timeout=DEFAULT_TIMEOUT, namespace=None):
+    '''
+    Sets `key` in `namespace`. `timeout` may be an int or a timedelta, and
+    defaults to the cache backend's.
+    '''
+    timeout = _normalize_timeout(timeout)
+    key = _make_keys([key], namespace)[0]
+    cache.cache.set(key, val, timeout=timeout)
+    _remember_value(key, val)
+
+
+def set_many(data, timeout=DEFAULT_TIMEOUT, namespace=None):
+    '''
+    Sets every key and value in the dict `data` in `namespace` with a single
+    `set_many`. Returns a list of the keys which failed to be set, if the
+    backend reports any.
+    '''
+    timeout = _normalize_timeout(timeout)
+    objs = list(data)
+    keys = _make_keys(objs, namespace)
+    values = dict((key, data[obj]) for (obj, key) in zip(objs, keys))
+    failed = cache.cache.set_many(values, timeout=timeout) or []
+    for (key, val) in values.items():
+        if key not in failed:
+            _remember_value(key, val)
+    objs_by_key = dict(zip(keys, objs))
+    return [objs_by_key[key] for key in failed]
+
+
+def add(key, val, timeout=DEFAULT_TIMEOUT, namespace=None):
+    '''
+    Sets `key` in `namespace` only if it isn't already set. Returns True if
+    it was set.
+    '''
+    timeout = _normalize_timeout(timeout)
+    key = _make_keys([key], namespace)[0]
+    added = cache.cache.add(key, val, timeout=timeout)
+    if added:
+        _remember_value(key, val)
+    return added
+
+
+def delete(key, namespace=None):
+    '''
+    Deletes `key` from `namespace`. Returns True if it was there, if the
+    backend can tell.
+    '''
+    key = _make_keys([key], namespace)[0]
+    requestcache.forget_value(key)
+    writebehind.discard(key)
+    return cache.cache.delete(key)
+
+
+def delete_many(keys, namespace=None):
+    '''
+    Deletes `keys` from `namespace` with a single `delete_many`.
+    '''
+    keys = _make_keys(list(keys), namespace)
+    for key in keys:
+        requestcache.forget_value(key)
+        writebehind.discard(key)
+    cache.cache.delete_many(keys)
+
+
+def incr(key, delta=1, namespace=None):
+    '''
+    Increments the integer at `key` in `namespace` by `delta`, and returns
+    the new value. Raises ValueError if it isn't set, as Django's does.
+    '''
+    key = _make_keys([key], namespace)[0]
+    requestcache.forget_value(key)
+    return cache.cache.incr(key, delta)
@@ -0,0 +1,228 @@
+'''
+Transparent compression and chunking of cached values.
+
+With a `Codec`, values are serialized by CacheCow rather than by the cache
+backend -- with pickle, or one of the leaner serializers in
+`cachecow.serializers` -- and compressed with zlib when the result is larger
+than a threshold. A short header records how each value was encoded, so it
+can be decoded when reading it back.
+
+Payloads larger than the chunk size -- memcached won't store items over 1 MB,
+and fails silently when asked to -- are split across several chunk keys. The
+value's own key then holds a `ChunkManifest` describing them, and reads fetch
+all of the chunks with a single `get_many` and check them against the
+manifest's checksum. A chunk that's gone missing (or a mismatched one, from a
+concurrent write) makes the read a miss.
+
+See the `codec` and `serializer` arguments of `cached_function`, and the
+`codec` argument of `cached_view`. Codecs are configured with these settings:
+
+    `CACHECOW_SERIALIZER`: the serializer `cached_function` uses by default,
+    as a name or dotted path accepted by `serializers.get_serializer`. If
+    unset, `cached_function` leaves serialization to the cache backend
+    unless given a `codec` or `serializer`.
+
+    `CACHECOW_COMPRESS_THRESHOLD`: payloads larger than this many bytes are
+    compressed (1024 by default).
+
+    `CACHECOW_COMPRESS_LEVEL`: the zlib compression level (6 by default).
+
+    `CACHECOW_CHUNK_SIZE`: payloads larger than this many bytes are chunked
+    (1000000 by default, leaving room under memcached's 1 MB limit for keys
+    and item overhead).
+'''
+
+from collections import namedtuple
+import threading
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core import cache
+
+from cachecow.cache import CacheEntry, make_key
+from cachecow.serializers import get_serializer, get_serializer_for_tag
+
+
+DEFAULT_COMPRESS_THRESHOLD = 1024
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_CHUNK_SIZE = 1000000
+
+# Encoded payloads start with `_MAGIC`, then one of the compression flags,
+# then the serializer's tag.
+_MAGIC = b'\x93cc'
+_RAW = b'r'
+_COMPRESSED = b'z'
+_HEADER_LENGTH = len(_MAGIC) + 2
+
+# Stored in place of a chunked payload. `nonce` keeps the chunks of
+# concurrent writes to the same key apart.
+ChunkManifest = namedtuple('ChunkManifest',
+                           ['nonce', 'count', 'length', 'checksum'])
+
+# Serializer -> the Codec configured from settings which uses it.
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def _make_chunk_key(key, nonce, i):
+    return make_key([key, 'chunk', nonce, i])
+
+
+class Codec(object):
+    '''
+    `serializer` is anything accepted by `serializers.get_serializer`, and
+    defaults to pickle.
+    '''
+    def __init__(self, serializer='pickle',
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD,
+                 level=DEFAULT_COMPRESS_LEVEL, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.serializer = get_serializer(serializer)
+        self.compress_threshold = compress_threshold
+        self.level = level
+        self.chunk_size = chunk_size
+
+    def dumps(self, val):
+        '''
+        Returns `val` serialized into a payload with a header.
+        '''
+        data = self.serializer.dumps(val)
+        flag = _RAW
+        if self.compress_threshold is not None \
+                and len(data) > self.compress_threshold:
+            compressed = zlib.compress(data, self.level)
+            if len(compressed) < len(data):
+                data, flag = compressed, _COMPRESSED
+        return b''.join([_MAGIC, flag, self.serializer.tag, data])
+
+    def loads(self, payload):
+        flag = payload[len(_MAGIC):len(_MAGIC) + 1]
+        tag = payload[len(_MAGIC) + 1:_HEADER_LENGTH]
+        data = payload[_HEADER_LENGTH:]
+        if flag == _COMPRESSED:
+            data = zlib.decompress(data)
+        if tag == self.serializer.tag:
+            return self.serializer.loads(data)
+        return get_serializer_for_tag(tag).loads(data)
+
+    def encode(self, key, val):
+        '''
+        Returns a tuple of the value to store at `key` in place of `val`, and
+        a dict of any chunks to store along with it.
+        '''
+        payload = self.dumps(val)
+        if self.chunk_size is None or len(payload) <= self.chunk_size:
+            return payload, {}
+
+        nonce = uuid.uuid4().hex[:8]
+        chunks = [payload[i:i + self.chunk_size]
+                  for i in range(0, len(payload), self.chunk_size)]
+        manifest = ChunkManifest(nonce, len(chunks), len(payload),
+                                 zlib.crc32(payload))
+        return manifest, dict((_make_chunk_key(key, nonce, i), chunk)
+                              for (i, chunk) in enumerate(chunks))
+
+    def _decode_payload(self, val, fetched_chunks):
+        if isinstance(val, ChunkManifest):
+            payload = self._join_chunks(val, fetched_chunks)
+            if payload is None:
+                return None
+            return self.loads(payload)
+        if isinstance(val, bytes) and val[:len(_MAGIC)] == _MAGIC:
+            return self.loads(val)
+        return val
+
+    def _join_chunks(self, manifest, chunks):
+        if len(chunks) != manifest.count or None in chunks:
+            return None
+        payload = b''.join(chunks)
+        if (len(payload) != manifest.length
+                or zlib.crc32(payload) != manifest.checksum):
+            return None
+        return payload
+
+    def _chunk_keys(self, key, val):
+        manifest = val.value if isinstance(val, CacheEntry) else val
+        if not isinstance(manifest, ChunkManifest):
+            return []
+        return [_make_chunk_key(key, manifest.nonce, i)
+                for i in range(manifest.count)]
+
+    def _decode(self, val, chunks):
+        if isinstance(val, CacheEntry):
+            value = self._decode_payload(val.value, chunks)
+            return None if value is None else val._replace(value=value)
+        return self._decode_payload(val, chunks)
+
+    def decode(self, key, val):
+        '''
+        Returns the value read from `key` decoded, keeping any `CacheEntry`
+        envelope around it, or None if its chunks are missing or corrupt.
+        '''
+        if val is None:
+            return None
+        chunk_keys = self._chunk_keys(key, val)
+        chunks = []
+        if chunk_keys:
+            fetched = cache.cache.get_many(chunk_keys)
+            chunks = [fetched.get(k) for k in chunk_keys]
+        return self._decode(val, chunks)
+
+    async def adecode(self, key, val):
+        '''
+        Async version of `decode`.
+        '''
+        if val is None:
+            return None
+        chunk_keys = self._chunk_keys(key, val)
+        chunks = []
+        if chunk_keys:
+            fetched = await cache.cache.aget_many(chunk_keys)
+            chunks = [fetched.get(k) for k in chunk_keys]
+        return self._decode(val, chunks)
+
+
+def get_codec(serializer='pickle'):
+    '''
+    Returns the process-wide Codec for `serializer`, configured from settings.
+
+    Codecs are kept by the `serializer` argument as given, so that a dotted
+    path or class is only resolved (and instantiated) once.
+    '''
+    codec = _codecs.get(serializer)
+    if codec is None:
+        with _codecs_lock:
+            codec = _codecs.get(serializer)
+            if codec is None:
+                codec = _codecs[serializer] = Codec(
+                    serializer=get_serializer(serializer),
+                    compress_threshold=getattr(
+                        settings, 'CACHECOW_COMPRESS_THRESHOLD',
+                        DEFAULT_COMPRESS_THRESHOLD),
+                    level=getattr(settings, 'CACHECOW_COMPRESS_LEVEL',
+                                  DEFAULT_COMPRESS_LEVEL),
+                    chunk_size=getattr(settings, 'CACHECOW_CHUNK_SIZE',
+                                       DEFAULT_CHUNK_SIZE))
+    return codec
+
+
+def resolve_codec(codec, serializer=None):
+    '''
+    Turns the `codec` and `serializer` arguments accepted by the decorators
+    into a Codec instance, or None if values are to be stored as they are.
+
+    With `codec` left as None, a codec is only used if there's a
+    `serializer`. If `codec` is True, the codec configured from settings is
+    used, with `serializer` if given. False disables codecs altogether.
+    '''
+    if codec is False:
+        return None
+    if codec is None or codec is True:
+        if serializer is None:
+            if codec is None:
+                return None
+            serializer = 'pickle'
+        return get_codec(serializer)
+    if serializer is not None:
+        raise ValueError('Pass either a codec or a serializer, not both.')
+    return codec
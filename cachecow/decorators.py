@@ -1,20 +1,48 @@
 from functools import wraps
+import hashlib
 import inspect
 from itertools import chain
 import logging
+import time
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
 from django.core import cache
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.utils import translation
 
-from cachecow.cache import set_cache, make_key, key_arg_iterator
+from cachecow import codec as cachecow_codec
+from cachecow import (localcache, metrics, refresh, registry, requestcache,
+                      responses, singleflight, streaming, writebehind, xfetch)
+from cachecow.cache import (set_cache, set_cache_many, aset_cache, make_key,
+                            key_arg_iterator, lookup_cache, lookup_cache_many,
+                            alookup_cache, normalize_timeout, unpack_entry,
+                            CACHED_NONE, Namespace, SerializedKey,
+                            _format_key_arg, _namespace_chain, _pack_entry,
+                            _serialize_key, _tag_keys)
 from cachecow.intpacker import pack_int
 
 
 logger = logging.getLogger(__name__)
 
+# Distinguishes L1 misses from cached None values.
+_MISSING = object()
+
+
+def _key_args_for_func(key_args, func_args, func_kwargs):
+    '''
+    Calls and replaces any callable items in `key_args` with their return
+    values, and returns them as a list ready to be sent over to `make_key`.
+    '''
+    def call_if_callable(obj):
+        if callable(obj):
+            return obj(*func_args, **func_kwargs)
+        return obj
+
+    key_args = call_if_callable(key_args)
+    return list(map(call_if_callable, key_arg_iterator(key_args)))
+
 
 def _make_key_for_func(key_args, func_args, func_kwargs, namespace=None,
                        skip_prefix=False):
@@ -23,18 +51,55 @@ def _make_key_for_func(key_args, func_args, func_kwargs, namespace=None,
     any callable items in `key_args` with their return values before sending 
     `key_args` over to `make_key`. Does the same for a callable `namespace`.
     '''
+    key_args = _key_args_for_func(key_args, func_args, func_kwargs)
+    return make_key(key_args, namespace=namespace, skip_prefix=skip_prefix)
+
+
+def _namespace_for_func(namespace, func_args, func_kwargs):
+    '''
+    Returns the namespace to use for a call of the decorated function: either
+    a `Namespace`, or the serialized key args of a flat namespace. Calls a
+    callable `namespace` first.
+    '''
+    if callable(namespace):
+        namespace = namespace(*func_args, **func_kwargs)
+    if isinstance(namespace, Namespace):
+        return namespace
+    return _make_key_for_func(namespace, func_args, func_kwargs,
+                              skip_prefix=True)
+
+
+def _tags_for_func(tags, func_args, func_kwargs):
+    '''
+    Returns the list of tags to use for a call of the decorated function.
+    Calls a callable `tags`, or any callable tags within it, first.
+    '''
     def call_if_callable(obj):
         if callable(obj):
             return obj(*func_args, **func_kwargs)
         return obj
 
-    key_args = call_if_callable(key_args)
-    key_args = map(call_if_callable, key_arg_iterator(key_args))
+    return list(map(call_if_callable, call_if_callable(tags)))
 
-    return make_key(key_args, namespace=namespace, skip_prefix=skip_prefix)
+
+def _make_local_key(key_args, namespace=None, tags=None):
+    '''
+    Returns the key for a value in L1 caches: a tuple of the keys of the
+    namespace and any it's nested within, and of any tags (or None), and the
+    value's un-namespaced key. It doesn't depend on the namespaces' or tags'
+    current versions, so an L1 hit costs no round trip to the cache backend
+    at all.
+    '''
+    ns_keys = None
+    if namespace is not None:
+        ns_keys = _namespace_chain(namespace)
+    if tags is not None:
+        ns_keys = (ns_keys or ()) + _tag_keys(tags)
+    return (ns_keys, make_key(key_args))
 
 
-def _add_delete_cache_member(func, key=None, namespace=None, add_user_to_key=False):
+def _add_delete_cache_member(func, key=None, namespace=None, add_user_to_key=False,
+                             key_builder=None, tags=None):
     '''
     Adds a `delete_cache` member function to `func`. Pass it the same args
     as `func` so that it can find the right key to delete.
@@ -42,80 +107,408 @@ def _add_delete_cache_member(func, key=None, namespace=None, add_user_to_key=Fal
     If `func` was decorated with `cached_function` or `cached_view` with a
     `key` parameter specified, `delete_cache` takes no arguments.
     '''
+    if key_builder is None:
+        key_builder = _make_key_builder(func)
+
     def delete_cache(*args, **kwargs):
-        key_args = key or _make_key_args_from_function(func, *args, **kwargs)
+        key_args = key or key_builder(args, kwargs)
 
         if add_user_to_key and kwargs.get('user') is not None:
             # We can assume that key is specified (see cached_view's docstring).
+            # Either a user or their ID, as the view adds to the key.
+            user = kwargs['user']
             key_args = chain(key_arg_iterator(key_args, max_depth=0),
-                             [kwargs['user']])
+                             [getattr(user, 'id', user)])
 
         _namespace = None
         if namespace is not None:
-            _namespace = _make_key_for_func(namespace, args, kwargs,
-                                            skip_prefix=True)
+            _namespace = _namespace_for_func(namespace, args, kwargs)
+        _tags = None
+        if tags is not None:
+            _tags = _tags_for_func(tags, args, kwargs)
 
-        _key = _make_key_for_func(key_args, args, kwargs, namespace=_namespace)
+        key_args = _key_args_for_func(key_args, args, kwargs)
+        _key = make_key(key_args, namespace=_namespace)
 
-        logger.debug(u'deleting cache for key: {}'.format(_key))
+        logger.debug(u'deleting cache for key: %s', _key)
+        writebehind.discard(_key)
         cache.cache.delete(_key)
+        requestcache.forget_value(_key)
+        localcache.delete(_make_local_key(key_args, _namespace, _tags))
 
     func.delete_cache = delete_cache
 
 
-def _make_key_args_from_function(func, *args, **kwargs):
-    '''
-    Add a bunch of hopefully uniquely identifying parameters to a list to be 
-    passed to `make_key`. It's pretty crafty in finding distinguishing params
-    to use, but it is slightly conservative so as to not overrun the memcached 
-    key length limit, which results in a non-human-readable hash for a key.
-    '''
-    key_args = ['cached_func', func.__name__]
-
-    # This works on both functions and class methods.
-    signature_args = inspect.getargspec(func).args
-    if (inspect.ismethod(func)
-        or (signature_args and signature_args[0] in ['self', 'cls'])):
-        # Method, probably. 
-        #
-        # If ismethod returns True, it's definitely a method. Otherwise,
-        # we have to guess based on the first arg of the function's signature.
-        # This is the best guess we can have in Python, because the way a 
-        # function is passed to a decorator inside a class definition, the
-        # decorated function is as yet neither a bound nor unbound method. It's
-        # just a regular function. So we must guess from its args.
-        #
-        # A guess is good enough, since it only means that we add some extra
-        # fields from the first arg. If we're wrong, the key is more
-        # conservative (more detailed) than need be. We could wrongly call it a
-        # function when it's actually a method, but only if they're doing 
-        # unsightly things like naming the "self" or "cls" arg something else.
-        self = args[0]
-        key_args.append(self.__class__.__name__)
-        if hasattr(self, 'pk'): # django model? `pk` is a great differentiator!
-            key_args.append(self.pk)
-        key_args.extend(args[1:])
-    else:
-        # Function.
-        key_args.extend(args)
-    key_args.extend(kwargs.values())
+def _is_method(func):
+    '''
+    Returns True if `func` is (probably) a method. This works on both
+    functions and class methods.
+    '''
+    if inspect.ismethod(func):
+        return True
+
+    # If ismethod returns True, it's definitely a method. Otherwise,
+    # we have to guess based on the first arg of the function's signature.
+    # This is the best guess we can have in Python, because the way a 
+    # function is passed to a decorator inside a class definition, the
+    # decorated function is as yet neither a bound nor unbound method. It's
+    # just a regular function. So we must guess from its args.
+    #
+    # A guess is good enough, since it only means that we add some extra
+    # fields from the first arg. If we're wrong, the key is more
+    # conservative (more detailed) than need be. We could wrongly call it a
+    # function when it's actually a method, but only if they're doing 
+    # unsightly things like naming the "self" or "cls" arg something else.
+    try:
+        params = list(inspect.signature(func).parameters)
+    except (TypeError, ValueError):
+        return False
+    return bool(params) and params[0] in ['self', 'cls']
+
+
+def _stable_repr(obj):
+    '''
+    Returns a repr of a code object constant which is the same in every
+    process. Code objects' reprs contain memory addresses, and the order of
+    sets of strings depends on hash randomization, so they're handled here.
+    '''
+    if inspect.iscode(obj):
+        return _code_repr(obj)
+    elif isinstance(obj, (frozenset, set)):
+        return '{{{}}}'.format(','.join(sorted(map(_stable_repr, obj))))
+    elif isinstance(obj, tuple):
+        return '({})'.format(','.join(map(_stable_repr, obj)))
+    return repr(obj)
+
+
+def _code_repr(code):
+    return '|'.join([code.co_name,
+                     code.co_code.hex(),
+                     _stable_repr(code.co_consts),
+                     ','.join(code.co_names)])
 
+
+def _func_fingerprint(func):
+    '''
+    Returns a short string identifying the code of `func`, for the end of its
+    auto-generated keys.
+
+    It's a digest of the function's qualified name, bytecode and constants,
+    so it's the same in every process running identical code (unlike
+    `hash(func.__code__)`, which changes with PYTHONHASHSEED) and changes when
+    the code does.
+    '''
     # To be extra safe! (unreadable, so at end of key.)
     # If this results in any collisions, it actually won't make a difference.
     # It's fine to memoize functions that collide on this as if
-    # they are one, since they're identical if their codeblock hash is the same.
-    key_args.append(pack_int(func.__code__.__hash__()))
-    return key_args
+    # they are one, since they're identical if their code is the same.
+    name = '{}.{}'.format(func.__module__,
+                          getattr(func, '__qualname__', func.__name__))
+    digest = hashlib.md5('{}|{}'.format(name, _code_repr(func.__code__))
+                         .encode('utf-8')).digest()
+    # 48 bits is plenty, and packs into 8 characters.
+    return pack_int(int.from_bytes(digest[:6], 'big'))
+
+
+def _make_key_builder(func, fingerprint=None):
+    '''
+    Returns a function which takes the `args` tuple and `kwargs` dict of a
+    call to `func`, and returns its auto-generated key as a `SerializedKey`.
+
+    `fingerprint` replaces the `_func_fingerprint` at the end of the key, if
+    given.
+
+    The key is made of, in order: `'cached_func'` and the function's name;
+    for methods, the class name of `self` and its `pk` if it has one (a
+    Django model's `pk` is a great differentiator); the call's args and
+    kwarg values; and the fingerprint. It's serialized as `make_key` would
+    serialize a list of those, but everything which doesn't depend on the
+    call's args -- inspecting the signature, and serializing the function's
+    name and fingerprint -- is done once, here, rather than on every call.
+    '''
+    is_method = _is_method(func)
+    prefix = _serialize_key(['cached_func', func.__name__])
+    if fingerprint is None:
+        fingerprint = _func_fingerprint(func)
+    suffix = _format_key_arg(fingerprint)
+    atoms = (str, int, float, type(None))
+
+    def add_arg(parts, arg):
+        if isinstance(arg, atoms):
+            parts.append(_format_key_arg(arg))
+        else:
+            # Nested iterables are flattened one level, as by `make_key`.
+            parts.extend(map(_format_key_arg,
+                             key_arg_iterator(arg, max_depth=0)))
+
+    def build(args, kwargs):
+        parts = [prefix]
+        if is_method:
+            self = args[0]
+            parts.append(_format_key_arg(self.__class__.__name__))
+            if hasattr(self, 'pk'): # django model? `pk` is a great differentiator!
+                parts.append(_format_key_arg(self.pk))
+            args = args[1:]
+        for arg in args:
+            add_arg(parts, arg)
+        for arg in kwargs.values():
+            add_arg(parts, arg)
+        parts.append(suffix)
+        return SerializedKey('.'.join(parts))
+    return build
+
+
+def _metrics_name(func):
+    return u'{}.{}'.format(func.__module__, func.__qualname__)
+
+
+def _timeout_for_value(val, timeout, none_timeout):
+    if val is None and none_timeout is not None:
+        return none_timeout
+    return timeout
+
+
+def _set_local(local_cache, local_key, val, timeout, none_timeout=None):
+    '''
+    Keeps `val` in `local_cache` for `timeout`, capped at the L1 cache's own
+    `default_timeout`. L1 entries don't notice invalidations made by other
+    processes, so the cap bounds how long they can serve stale values.
+    '''
+    if local_cache is None:
+        return
+    timeout = normalize_timeout(_timeout_for_value(val, timeout, none_timeout))
+    if local_cache.default_timeout is not None and (
+            timeout is None or timeout > local_cache.default_timeout):
+        timeout = local_cache.default_timeout
+    # Tag with the namespace's own cache key, as `invalidate_namespace` sees it.
+    local_cache.set(local_key, val, timeout=timeout, namespace=local_key[0])
+
+
+def _encode_for_func(key, val, timeout, none_timeout, codec):
+    '''
+    Returns a tuple of the value to store for a decorated function, its
+    timeout, and a dict of any chunks to store along with it. The value is
+    `_MISSING` if nothing should be stored.
+
+    None is stored as `CACHED_NONE` so it can be told apart from a miss, for
+    `none_timeout` if given. A `none_timeout` of 0 means None isn't cached at
+    all.
+    '''
+    if val is None:
+        if none_timeout == 0:
+            return _MISSING, timeout, {}
+        if none_timeout is not None:
+            timeout = none_timeout
+        return CACHED_NONE, timeout, {}
+    if codec is None:
+        return val, timeout, {}
+    val, chunks = codec.encode(key, val)
+    return val, timeout, chunks
+
+
+def _entries_for_func(key, val, timeout, none_timeout=None, codec=None,
+                      chunks=None, soft_timeout=None, compute_time=None):
+    '''
+    Returns a tuple of a dict of everything to set for the value of a
+    decorated function (the value itself and any chunks of it, or nothing)
+    and their timeout, for `cachecow.writebehind`.
+    '''
+    val, timeout, encoded_chunks = _encode_for_func(key, val, timeout,
+                                                    none_timeout, codec)
+    timeout = normalize_timeout(timeout)
+    if val is _MISSING:
+        return {}, timeout
+    data = dict(chunks or {})
+    data.update(encoded_chunks)
+    data[key] = _pack_entry(val, timeout, soft_timeout, compute_time,
+                            getattr(key, 'tag_versions', None))
+    return data, timeout
+
+
+def _set_cache_for_func(key, val, timeout, none_timeout=None, codec=None,
+                        chunks=None, write_behind=False, metrics_name=None,
+                        **kwargs):
+    '''
+    Sets the value of a decorated function. See `_encode_for_func`. `chunks`
+    is a dict of any chunks of the value already encoded by the caller, to
+    set along with it.
+
+    If `write_behind` is enabled, the value is queued to be set by
+    `cachecow.writebehind` instead, and any drops are counted under
+    `metrics_name`.
+
+    Returns True if the value was set or queued, or False if there was
+    nothing to store or the queue dropped it.
+    '''
+    write_queue = writebehind.resolve_write_behind(write_behind)
+    if write_queue is not None:
+        if val is None and none_timeout == 0:
+            return False
+        return write_queue.submit(key, lambda: _entries_for_func(
+            key, val, timeout, none_timeout, codec, chunks, **kwargs),
+            metrics_name)
+
+    val, timeout, encoded_chunks = _encode_for_func(key, val, timeout,
+                                                    none_timeout, codec)
+    if val is _MISSING:
+        return False
+    chunks = dict(chunks or {})
+    chunks.update(encoded_chunks)
+    if chunks:
+        cache.cache.set_many(chunks, timeout=normalize_timeout(timeout))
+    set_cache(key, val, timeout, **kwargs)
+    return True
+
+
+async def _aset_cache_for_func(key, val, timeout, none_timeout=None,
+                               codec=None, chunks=None, write_behind=False,
+                               metrics_name=None, **kwargs):
+    '''
+    Async version of `_set_cache_for_func`. Write-behind sets are queued
+    without blocking the event loop.
+    '''
+    write_queue = writebehind.resolve_write_behind(write_behind)
+    if write_queue is not None:
+        if val is None and none_timeout == 0:
+            return False
+        return write_queue.submit(key, lambda: _entries_for_func(
+            key, val, timeout, none_timeout, codec, chunks, **kwargs),
+            metrics_name)
+
+    val, timeout, encoded_chunks = _encode_for_func(key, val, timeout,
+                                                    none_timeout, codec)
+    if val is _MISSING:
+        return False
+    chunks = dict(chunks or {})
+    chunks.update(encoded_chunks)
+    if chunks:
+        await cache.cache.aset_many(chunks, timeout=normalize_timeout(timeout))
+    await aset_cache(key, val, timeout, **kwargs)
+    return True
+
+
+def _set_cache_many_for_func(data, timeout, none_timeout=None, codec=None,
+                             write_behind=False, metrics_name=None,
+                             **kwargs):
+    '''
+    Like `_set_cache_for_func`, for a dict of keys and values. Values which
+    share a timeout are set together, along with any chunks. Returns a set
+    of the keys which were set or queued.
+    '''
+    write_queue = writebehind.resolve_write_behind(write_behind)
+    if write_queue is not None:
+        return set(key for (key, val) in data.items()
+                   if _set_cache_for_func(key, val, timeout, none_timeout,
+                                          codec, write_behind=write_queue,
+                                          metrics_name=metrics_name,
+                                          **kwargs))
+
+    stored = set()
+    by_timeout = {}
+    for (key, val) in data.items():
+        val, _timeout, chunks = _encode_for_func(key, val, timeout,
+                                                 none_timeout, codec)
+        if val is _MISSING:
+            continue
+        values, all_chunks = by_timeout.setdefault(_timeout, ({}, {}))
+        values[key] = val
+        all_chunks.update(chunks)
+
+    for (_timeout, (values, chunks)) in by_timeout.items():
+        if chunks:
+            cache.cache.set_many(chunks, timeout=normalize_timeout(_timeout))
+        set_cache_many(values, _timeout, **kwargs)
+        stored.update(values)
+    return stored
+
+
+def _decode(codec, key, val):
+    '''
+    Decodes a value read from `key` with `codec`, if there is one. Returns
+    None (a miss) if it was chunked and its chunks are gone.
+    '''
+    if codec is None:
+        return val
+    return codec.decode(key, val)
+
+
+async def _adecode(codec, key, val):
+    if codec is None:
+        return val
+    return await codec.adecode(key, val)
+
+
+def _resolve_single_flight(single_flight):
+    '''
+    Turns the `single_flight` argument accepted by the decorators into a
+    `cachecow.singleflight` mode, or None if it's disabled.
+    '''
+    if single_flight is True:
+        return singleflight.DISTRIBUTED
+    if not single_flight:
+        return None
+    if single_flight not in (singleflight.LOCAL, singleflight.DISTRIBUTED):
+        raise ValueError(
+            'Unknown single_flight value: {!r}'.format(single_flight))
+    return single_flight
 
 
-def cached_function(timeout=None, key=None, namespace=None):
+def _compute_on_miss(key, compute, single_flight, lock_timeout, codec=None,
+                     share=False):
+    '''
+    Calls `compute` after a cache miss on `key`, coalescing concurrent callers
+    if `single_flight` is enabled. Returns a tuple of `(value, computed)`; see
+    `singleflight.call`, which `share` is passed to.
+    '''
+    if single_flight is None:
+        return compute(), True
+    val, computed = singleflight.call(
+        key, compute, lambda: _decode(codec, key, cache.cache.get(key)),
+        mode=single_flight, lock_timeout=lock_timeout, share=share)
+    if not computed:
+        val = unpack_entry(val)[0]
+    return val, computed
+
+
+async def _acompute_on_miss(key, compute, single_flight, lock_timeout,
+                            codec=None, share=False):
+    '''
+    Async version of `_compute_on_miss`, where `compute` is a coroutine
+    function.
+    '''
+    if single_flight is None:
+        return await compute(), True
+
+    async def reread():
+        return await _adecode(codec, key, await cache.cache.aget(key))
+
+    val, computed = await singleflight.acall(key, compute, reread,
+                                             mode=single_flight,
+                                             lock_timeout=lock_timeout,
+                                             share=share)
+    if not computed:
+        val = unpack_entry(val)[0]
+    return val, computed
+
+
+def cached_function(timeout=None, key=None, namespace=None, local_cache=False,
+                    single_flight=False, lock_timeout=None, soft_timeout=None,
+                    refresh_executor=None, xfetch_beta=None,
+                    none_timeout=None, fingerprint=None, codec=None,
+                    serializer=None, tags=None, write_behind=False,
+                    warm_args=None):
     '''
     Memoizes a function or class method using the Django cache backend. 
 
     Adds a member to the decorated function, `delete_cache`. Call it with the 
     same args as the decorated function.
 
-    All kwargs, `timeout`, `key`, and `namespace`, are optional.
+    Also adds `get_many` and `warm` members, for fetching or caching the
+    values of many calls at once with a single `get_many` and `set_many`.
+    See their docstrings. Calls can also be prefetched for the rest of a
+    request with `cachecow.requestcache.prefetch`.
+
+    All kwargs are optional.
 
     `timeout` can be either an int, or a timedelta (or None).
 
@@ -124,6 +517,11 @@ def cached_function(timeout=None, key=None, namespace=None):
 
     However, if `key` is None, we'll automatically and determinisically create a
     uniquely identifying key for the function which is hopefully human-readable.
+    It ends with a fingerprint of the function's code, which is the same
+    across processes and deploys of identical code, and changes along with
+    the code. Pass a string as `fingerprint` to pin it instead, e.g. a version
+    you bump by hand, so that cached values survive deploys which change the
+    function without changing its results.
 
     Additionally, if `key` is callable, or if it's an iterable containing any 
     callables, they will be called with the same args and kwargs as the 
@@ -148,35 +546,443 @@ def cached_function(timeout=None, key=None, namespace=None):
     example, you may want to cache several functions in the same namespace 
     depending on the current user.
 
-    Note that any `namespace` functions *must* be deterministic: given the same 
+    Note that any `namespace` functions *must* be deterministic: given the same
     input arguments, it must always produce the same output.
+
+    `namespace` (or what a `namespace` function returns) may also be a nested
+    `cachecow.cache.Namespace`, such as `Namespace('tenant', 42, 'reports')`.
+    Invalidating any namespace it lies within, like `Namespace('tenant', 42)`
+    or simply `['tenant', 42]`, invalidates it as well. Every level's version
+    is fetched together with the value in a single `get_many`.
+
+    `tags` is a list of the things the value depends on, such as
+    `['user:7', ['product', 99]]`, any of which can be invalidated with
+    `cachecow.cache.invalidate_tag`. Unlike a namespace, a value can have any
+    number of them. Like `namespace`, `tags` or any tag within it may be a
+    function called with the decorated function's arguments. Tag versions
+    are stored along with the value, and fetched together with it to check
+    them, so there's no extra round trip, but each tag adds a key to every
+    lookup.
+
+    If `local_cache` is True, values are also kept in a per-process in-memory
+    L1 cache (see `cachecow.localcache`) which is checked before the Django
+    cache backend. Entries expire after `timeout` or the
+    `CACHECOW_LOCAL_CACHE_TIMEOUT` setting (300 seconds by default),
+    whichever is shorter. You can also pass your own `LocalCache` instance,
+    whose `default_timeout` caps it instead. `delete_cache`,
+    `invalidate_namespace` and `invalidate_tag` clear L1 entries in the
+    current process only, so other processes may serve a stale value until it
+    times out there: for up to that cap. Values are shared by reference, so
+    don't mutate what the function returns.
+
+    `single_flight` protects against stampedes when a popular key expires: only
+    one caller computes the missing value while concurrent callers wait for it
+    to be stored and then read it from the cache. Pass `'local'` to coalesce
+    callers within the current process only, or True (or `'distributed'`) to
+    also coalesce across processes with a lease lock held in the cache for up
+    to `lock_timeout` seconds. See `cachecow.singleflight`.
+
+    `soft_timeout` (an int or timedelta, shorter than `timeout`) enables
+    stale-while-revalidate: once it passes, callers still get the stale value
+    immediately, while a single refresh of it is run in the background by
+    `refresh_executor` (by default, the one configured in settings; see
+    `cachecow.refresh`). `timeout` remains the hard limit after which the
+    value is gone and must be recomputed by the caller. The L1 cache, if
+    enabled, holds values for `soft_timeout` at most.
+
+    `xfetch_beta` enables probabilistic early recomputation with the given
+    beta (1.0 is a good start; higher recomputes earlier). The time taken to
+    compute each value is stored with it, and a caller that reads it recomputes
+    it early with a probability that grows as `timeout` approaches, scaled by
+    that compute time. This spreads out recomputation of expensive values
+    without any locking. It requires a `timeout`, and raises ValueError
+    without one. See `cachecow.xfetch`.
+
+    Return values of None are cached like any other (they're stored as
+    `CACHED_NONE` so that they can be told apart from a cache miss).
+    `none_timeout` sets a separate, typically shorter, timeout for them, and a
+    `none_timeout` of 0 disables caching them.
+
+    Coroutine functions (`async def`) are supported too, using Django's async
+    cache API. Concurrent awaiters are coalesced on the event loop when
+    `single_flight` is enabled, and stale values are refreshed as tasks on
+    the event loop rather than by `refresh_executor`. `get_many` and `warm`
+    aren't available on them.
+
+    `codec` stores values through a `cachecow.codec.Codec`, which compresses
+    large values and splits ones too large for the cache backend across
+    several keys. Pass True to use the one configured in settings.
+
+    `serializer` picks how values are serialized for the cache, by name
+    (`'pickle'`, `'marshal'` or `'json'`), dotted path, or instance (see
+    `cachecow.serializers`). The leaner serializers only handle simple types,
+    but are faster and more compact than pickle. It defaults to the
+    `CACHECOW_SERIALIZER` setting, if set, and implies a codec configured
+    from settings.
+
+    If a metrics sink is configured, hits, misses, sets, errors, timings and
+    value sizes are recorded under the function's dotted path (see
+    `cachecow.metrics`).
+
+    If `write_behind` is True, values are set in the cache backend by a
+    background thread rather than before returning them, saving the caller
+    the time to encode and send them (see `cachecow.writebehind`). You can
+    also pass your own `WriteBehindQueue`. Other callers miss until the value
+    is flushed, except for `single_flight` waiters in the same process, which
+    are handed the value by the caller that computed it.
+
+    The decorated function is registered in `cachecow.registry` under its
+    dotted path. If `warm_args` is given, the `cachecow_warm` management
+    command can warm its cache with the calls it returns the arguments of
+    (see `cachecow.registry`). This isn't supported for coroutine functions.
     '''
+    if xfetch_beta is not None and timeout is None:
+        raise ValueError('xfetch_beta requires a timeout.')
+    _single_flight = _resolve_single_flight(single_flight)
+    local_timeout = timeout if soft_timeout is None else soft_timeout
+    if serializer is None and (codec is None or codec is True):
+        serializer = getattr(settings, 'CACHECOW_SERIALIZER', None)
+
     def decorator(func):
-        _add_delete_cache_member(func, key=key, namespace=namespace)
+        key_builder = _make_key_builder(func, fingerprint=fingerprint)
+        _add_delete_cache_member(func, key=key, namespace=namespace,
+                                 key_builder=key_builder, tags=tags)
+        _local_cache = localcache.resolve_local_cache(local_cache)
+        _codec = cachecow_codec.resolve_codec(codec, serializer=serializer)
+        metrics_name = _metrics_name(func)
 
-        @wraps(func)
-        def wrapped(*args, **kwargs):
-            key_args = key
+        def make_key_args(args, kwargs):
+            '''
+            Returns a tuple of the key args, namespace and tags for a call.
+            '''
             if key is None:
-                key_args = _make_key_args_from_function(func, *args, **kwargs)
+                key_args = key_builder(args, kwargs)
+            else:
+                key_args = _key_args_for_func(key, args, kwargs)
 
             _namespace = None
             if namespace is not None:
-                _namespace = _make_key_for_func(namespace, args, kwargs,
-                                                skip_prefix=True)
+                _namespace = _namespace_for_func(namespace, args, kwargs)
+            _tags = None
+            if tags is not None:
+                _tags = _tags_for_func(tags, args, kwargs)
 
-            _key = _make_key_for_func(key_args, args, kwargs,
-                                      namespace=_namespace)
+            return key_args, _namespace, _tags
 
-            val = cache.cache.get(_key)
-            if val is None:
+        def lookup_item(*args, **kwargs):
+            '''
+            Returns the item to pass to `lookup_cache_many` to look up the
+            value of a call, for `cachecow.requestcache.prefetch`.
+            '''
+            return make_key_args(args, kwargs)
+
+        def make_compute(_key, args, kwargs):
+            def compute():
+                start = time.perf_counter()
                 val = func(*args, **kwargs)
-                set_cache(_key, val, timeout)
+                elapsed = time.perf_counter() - start
+                compute_time = elapsed if xfetch_beta is not None else None
+
+                sink = metrics.get_sink()
+                if sink is not None:
+                    sink.observe(metrics_name, metrics.COMPUTE_TIME, elapsed)
+                if metrics.timed(sink, metrics_name, metrics.SET_TIME,
+                                 _set_cache_for_func, _key, val, timeout,
+                                 none_timeout, codec=_codec,
+                                 write_behind=write_behind,
+                                 metrics_name=metrics_name,
+                                 soft_timeout=soft_timeout,
+                                 compute_time=compute_time):
+                    metrics.record_set(sink, metrics_name, val)
+                return val
+            return compute
+
+        if inspect.iscoroutinefunction(func):
+            def make_acompute(_key, args, kwargs):
+                async def compute():
+                    start = time.perf_counter()
+                    val = await func(*args, **kwargs)
+                    elapsed = time.perf_counter() - start
+                    compute_time = elapsed if xfetch_beta is not None else None
+
+                    sink = metrics.get_sink()
+                    if sink is not None:
+                        sink.observe(metrics_name, metrics.COMPUTE_TIME,
+                                     elapsed)
+                    if await metrics.atimed(
+                            sink, metrics_name, metrics.SET_TIME,
+                            _aset_cache_for_func(
+                                _key, val, timeout, none_timeout,
+                                codec=_codec, write_behind=write_behind,
+                                metrics_name=metrics_name,
+                                soft_timeout=soft_timeout,
+                                compute_time=compute_time)):
+                        metrics.record_set(sink, metrics_name, val)
+                    return val
+                return compute
+
+            async def acall(sink, args, kwargs):
+                key_args, _namespace, _tags = make_key_args(args, kwargs)
+
+                _local_key = None
+                if _local_cache is not None:
+                    _local_key = _make_local_key(key_args, _namespace, _tags)
+                    val = _local_cache.get(_local_key, _MISSING)
+                    if val is not _MISSING:
+                        if sink is not None:
+                            sink.incr(metrics_name, metrics.HITS)
+                        return val
+
+                _key, val = await metrics.atimed(
+                    sink, metrics_name, metrics.GET_TIME,
+                    alookup_cache(key_args, namespace=_namespace, tags=_tags))
+                val = await _adecode(_codec, _key, val)
+                if sink is not None:
+                    sink.incr(metrics_name,
+                              metrics.MISSES if val is None else metrics.HITS)
+                compute = make_acompute(_key, args, kwargs)
+
+                if val is None:
+                    val, _ = await _acompute_on_miss(
+                        _key, compute, _single_flight, lock_timeout, _codec,
+                        share=bool(write_behind))
+                elif (xfetch_beta is not None
+                        and xfetch.should_recompute(val, xfetch_beta)):
+                    val = await compute()
+                else:
+                    val, stale = unpack_entry(val)
+                    if stale:
+                        await refresh.arefresh(_key, compute)
+                _set_local(_local_cache, _local_key, val, local_timeout,
+                           none_timeout)
+                return val
+
+            @wraps(func)
+            async def awrapped(*args, **kwargs):
+                sink = metrics.get_sink()
+                if sink is None:
+                    return await acall(None, args, kwargs)
+                try:
+                    return await acall(sink, args, kwargs)
+                except Exception:
+                    sink.incr(metrics_name, metrics.ERRORS)
+                    raise
+            awrapped.lookup_item = lookup_item
+            return awrapped
+
+        def call(sink, args, kwargs):
+            key_args, _namespace, _tags = make_key_args(args, kwargs)
+
+            _local_key = None
+            if _local_cache is not None:
+                _local_key = _make_local_key(key_args, _namespace, _tags)
+                val = _local_cache.get(_local_key, _MISSING)
+                if val is not _MISSING:
+                    if sink is not None:
+                        sink.incr(metrics_name, metrics.HITS)
+                    return val
+
+            _key, val = metrics.timed(sink, metrics_name, metrics.GET_TIME,
+                                      lookup_cache, key_args,
+                                      namespace=_namespace, tags=_tags)
+            val = _decode(_codec, _key, val)
+            if sink is not None:
+                sink.incr(metrics_name,
+                          metrics.MISSES if val is None else metrics.HITS)
+            compute = make_compute(_key, args, kwargs)
+
+            if val is None:
+                val, _ = _compute_on_miss(_key, compute, _single_flight,
+                                          lock_timeout, _codec,
+                                          share=bool(write_behind))
+            elif (xfetch_beta is not None
+                    and xfetch.should_recompute(val, xfetch_beta)):
+                val = compute()
+            else:
+                val, stale = unpack_entry(val)
+                if stale:
+                    refresh.refresh(_key, compute, executor=refresh_executor)
+            _set_local(_local_cache, _local_key, val, local_timeout,
+                       none_timeout)
             return val
+
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            sink = metrics.get_sink()
+            if sink is None:
+                return call(None, args, kwargs)
+            try:
+                return call(sink, args, kwargs)
+            except Exception:
+                sink.incr(metrics_name, metrics.ERRORS)
+                raise
+
+        def get_many(arg_list, batch_func=None):
+            '''
+            Returns a list of the values for a list of calls, fetching every
+            cached one with a single `get_many` and setting the rest with a
+            single `set_many`. Each item of `arg_list` is a tuple of
+            positional args for one call, or a single non-tuple arg.
+
+            Misses are computed by calling the decorated function for each,
+            unless `batch_func` is given, in which case it's called once with
+            the list of argument tuples that missed and must return a list of
+            their values in the same order.
+
+            Single-flight and early recomputation don't apply here, but stale
+            values are refreshed in the background as usual.
+            '''
+            arg_list = [args if isinstance(args, tuple) else (args,)
+                        for args in arg_list]
+            items = [make_key_args(args, {}) for args in arg_list]
+            vals = [_MISSING] * len(items)
+
+            local_keys = [None] * len(items)
+            if _local_cache is not None:
+                for (i, item) in enumerate(items):
+                    local_keys[i] = _make_local_key(*item)
+                    vals[i] = _local_cache.get(local_keys[i], _MISSING)
+
+            sink = metrics.get_sink()
+            pending = [i for (i, val) in enumerate(vals) if val is _MISSING]
+            keys = {}
+            misses = []
+            for (i, (_key, val)) in zip(pending, metrics.timed(
+                    sink, metrics_name, metrics.GET_TIME, lookup_cache_many,
+                    [items[i] for i in pending])):
+                keys[i] = _key
+                val = _decode(_codec, _key, val)
+                if val is None:
+                    misses.append(i)
+                    continue
+                vals[i], stale = unpack_entry(val)
+                if stale:
+                    refresh.refresh(_key, make_compute(_key, arg_list[i], {}),
+                                    executor=refresh_executor)
+                _set_local(_local_cache, local_keys[i], vals[i],
+                           local_timeout, none_timeout)
+
+            if misses:
+                start = time.perf_counter()
+                if batch_func is None:
+                    computed = [func(*arg_list[i]) for i in misses]
+                else:
+                    computed = list(batch_func([arg_list[i] for i in misses]))
+                    if len(computed) != len(misses):
+                        raise ValueError('batch_func returned {} values for {} '
+                                         'calls.'.format(len(computed),
+                                                         len(misses)))
+                elapsed = time.perf_counter() - start
+                compute_time = None
+                if xfetch_beta is not None:
+                    compute_time = elapsed / len(misses)
+
+                for (i, val) in zip(misses, computed):
+                    vals[i] = val
+                    _set_local(_local_cache, local_keys[i], val,
+                               local_timeout, none_timeout)
+                if sink is not None:
+                    sink.observe(metrics_name, metrics.COMPUTE_TIME, elapsed)
+                stored = metrics.timed(
+                    sink, metrics_name, metrics.SET_TIME,
+                    _set_cache_many_for_func,
+                    dict((keys[i], vals[i]) for i in misses), timeout,
+                    none_timeout, codec=_codec, write_behind=write_behind,
+                    metrics_name=metrics_name, soft_timeout=soft_timeout,
+                    compute_time=compute_time)
+                for i in misses:
+                    if keys[i] in stored:
+                        metrics.record_set(sink, metrics_name, vals[i])
+
+            if sink is not None:
+                sink.incr(metrics_name, metrics.MISSES, len(misses))
+                sink.incr(metrics_name, metrics.HITS,
+                          len(arg_list) - len(misses))
+            return vals
+
+        def warm(arg_list, batch_func=None):
+            '''
+            Makes sure the values for a list of calls are cached, as with
+            `get_many`, without returning them.
+            '''
+            get_many(arg_list, batch_func=batch_func)
+
+        wrapped.get_many = get_many
+        wrapped.warm = warm
+        wrapped.lookup_item = lookup_item
+        registry.register(metrics_name, wrapped, warm_args)
         return wrapped
     return decorator
 
 
+class cached_property(object):
+    '''
+    A property whose value is cached with `cached_function`, and then kept in
+    the instance's `__dict__`, so that reading it again on the same instance
+    costs no more than a plain attribute:
+
+        class Product(models.Model):
+            @cached_property(timeout=3600, namespace='products')
+            def summary(self):
+                ...
+
+    It can be used without arguments too, as `@cached_property`. All kwargs
+    are passed on to `cached_function`. Keys are built as for methods, from
+    the property's name, the class name and the instance's `pk` if it has
+    one, and a `namespace` or `key` function is called with the instance.
+
+    `del instance.summary` only forgets the value kept on the instance, so
+    it's read from the cache again next time. To delete the cached value
+    itself, call `Product.summary.delete_cache(instance)`, or invalidate its
+    namespace to delete it for every instance at once.
+
+    `Product.summary.preload(instances)` looks up the values for a list of
+    instances in a single `get_many`, computing and setting any which are
+    missing, and keeps them on each instance.
+    '''
+    def __new__(cls, func=None, **kwargs):
+        if func is None:
+            return lambda func: cls(func, **kwargs)
+        return super(cached_property, cls).__new__(cls)
+
+    def __init__(self, func, **kwargs):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self._cached = cached_function(**kwargs)(func)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        val = self._cached(instance)
+        instance.__dict__[self.name] = val
+        return val
+
+    def delete_cache(self, instance):
+        '''
+        Deletes the cached value for `instance`, and forgets the value kept on
+        it.
+        '''
+        instance.__dict__.pop(self.name, None)
+        self._cached.delete_cache(instance)
+
+    def preload(self, instances):
+        '''
+        Makes sure the value is kept on each of `instances`, looking up all
+        those which aren't yet with a single `get_many`.
+        '''
+        instances = [instance for instance in instances
+                     if self.name not in instance.__dict__]
+        if not instances:
+            return
+        vals = self._cached.get_many([(instance,) for instance in instances])
+        for (instance, val) in zip(instances, vals):
+            instance.__dict__[self.name] = val
+
+
 def _can_cache_request(request, *args, **kwargs):
     '''
     Only caches if the request is for GET or HEAD, and if the Django messages
@@ -188,16 +994,40 @@ def _can_cache_request(request, *args, **kwargs):
 
 
 def _can_cache_response(response):
-    return (response.status_code != 200
-            or 'no-cache' in response.get('Cache-Control', '')
-            or 'no-cache' in response.get('Pragma', ''))
+    return (response.status_code == 200
+            and 'no-cache' not in response.get('Cache-Control', '')
+            and 'no-cache' not in response.get('Pragma', ''))
+
+
+def _request_key_args(request):
+    '''
+    Returns the parts of a request which go into `cached_view`'s
+    auto-generated keys.
+    '''
+    # Don't naively add the `request` arg to the cache key.
+    request_args = list(chain.from_iterable(request.GET.items()))
+
+    # Only add specific parts of the `request` object to the key.
+    request_args.append(request.method)
+
+    # Current language.
+    request_args.append(translation.get_language())
+
+    # Current site, if available.
+    request_args.append(getattr(settings, 'SITE_ID', None))
+    return request_args
 
 
 def cached_view(timeout=None, key=None, namespace=None, add_user_to_key=False,
                 request_gatekeeper=_can_cache_request,
                 response_gatekeeper=_can_cache_response,
                 cached_response_wrapper=HttpResponse,
-                serializer=lambda response: response.content):
+                serializer=lambda response: response.content,
+                local_cache=False, single_flight=False, lock_timeout=None,
+                none_timeout=None, fingerprint=None, codec=None,
+                full_response=False, response_headers=None,
+                request_key=_request_key_args, early=False,
+                cache_streaming=True, tags=None, write_behind=False):
     '''
     Use this instead of `cached_function` for caching views.  See 
     `cached_function` for documentation on how to use this.
@@ -212,37 +1042,88 @@ def cached_view(timeout=None, key=None, namespace=None, add_user_to_key=False,
     If `add_user_to_key` is True, the key will be prefixed with the logged-in
     user's ID when logged in. Currently this can only be used if `key` is also
     specified, in order to avoid conflicts with function kwargs.
+
+    `local_cache` keeps serialized responses in a per-process L1 cache, and
+    `single_flight` coalesces concurrent misses, as with `cached_function`.
+    Requests that wait on another request's response are served from the
+    cache, so each gets its own response object.
+
+    If `serializer` returns None for a response, that is cached too (for
+    `none_timeout`, if given), and hits pass None to
+    `cached_response_wrapper`.
+
+    `codec` applies to the output of `serializer`, as with `cached_function`.
+
+    If `full_response` is True, `serializer` and `cached_response_wrapper` are
+    ignored, and the whole response is cached instead: its status code, the
+    headers named in `response_headers` (by default,
+    `cachecow.responses.DEFAULT_HEADERS`) and its content, along with an ETag
+    and Last-Modified date. Hits with a matching `If-None-Match` or
+    `If-Modified-Since` header get a 304 without the content being decoded
+    or sent. Only the content goes through `codec`, if given, so that 304s
+    don't need to decompress it or fetch its chunks.
+
+    Async views are supported too, using Django's async cache API. The
+    `request_gatekeeper` may be a coroutine function; if it isn't, it's run
+    with `sync_to_async`, since it may touch the session.
+
+    Streaming responses are cached as they're streamed to the client, unless
+    `cache_streaming` is False, and hits are streamed back from the cache a
+    few chunks at a time (see `cachecow.streaming`). `serializer`,
+    `cached_response_wrapper` and `codec` don't apply to them, and they
+    aren't kept in L1. Since they're only stored once fully streamed,
+    `single_flight` waiters usually go on to render them themselves.
+
+    Metrics are recorded as with `cached_function`, with the size of each
+    response's content as its value size.
+
+    `write_behind` applies to responses as with `cached_function`, except for
+    streaming ones, which are already stored once the stream ends. Responses
+    aren't handed to `single_flight` waiters, since each request needs its
+    own, so waiters render them themselves until they're flushed.
+
+    `request_key` is a function which, given the request, returns a list of
+    the parts of it that go into the auto-generated key. By default, these
+    are the GET parameters, method, current language and `SITE_ID`.
+
+    If `early` is True, hits for anonymous GET requests can be served by
+    `cachecow.middleware.CacheMiddleware` before the rest of the middleware
+    stack and the view are run. These skip `request_gatekeeper`, so only use
+    it for views whose key doesn't depend on the session, user or messages.
+    The decorated view gets a `get_cached_response(request, *args, **kwargs)`
+    member, which returns the cached response for an anonymous request, or
+    None on a miss.
     '''
+    _single_flight = _resolve_single_flight(single_flight)
+
     if add_user_to_key and key is None:
         raise ValueError("Cannot use add_user_to_key without also specifing key.")
 
     def decorator(func):
+        key_builder = _make_key_builder(func, fingerprint=fingerprint)
         _add_delete_cache_member(func, key=key, namespace=namespace,
-                                 add_user_to_key=add_user_to_key)
-
-        @wraps(func)
-        def wrapped(request, *args, **kwargs):
-            if not request_gatekeeper(request, *args, **kwargs):
-                return func(request, *args, **kwargs)
+                                 add_user_to_key=add_user_to_key,
+                                 key_builder=key_builder, tags=tags)
+        _local_cache = localcache.resolve_local_cache(local_cache)
+        _codec = cachecow_codec.resolve_codec(codec)
+        metrics_name = _metrics_name(func)
 
+        def make_key_args(request, args, kwargs, anonymous=False):
+            '''
+            Returns a tuple of the key args, namespace and tags for a
+            request. If `anonymous` is True, the request's user isn't looked
+            at.
+            '''
             key_args = key
 
             # Default key.
             if not key_args:
-                # Don't naively add the `request` arg to the cache key.
-                key_args = _make_key_args_from_function(func, *args, **kwargs)
-
-                # Only add specific parts of the `request` object to the key.
-                key_args.extend(chain.from_iterable(request.GET.items()))
-                key_args.append(request.method)
-
-                # Current language.
-                key_args.append(translation.get_language())
+                key_args = SerializedKey('{}.{}'.format(
+                    key_builder(args, kwargs),
+                    _serialize_key(request_key(request))))
 
-                # Current site, if available.
-                key_args.append(getattr(settings, 'SITE_ID', None))
-
-            if add_user_to_key and request.user.is_authenticated():
+            if (add_user_to_key and not anonymous
+                    and request.user.is_authenticated):
                 key_args = chain(key_arg_iterator(key_args, max_depth=0),
                                  [request.user.id])
 
@@ -252,24 +1133,293 @@ def cached_view(timeout=None, key=None, namespace=None, add_user_to_key=False,
 
             _namespace = None
             if namespace is not None:
-                _namespace = _make_key_for_func(namespace, _args, kwargs,
-                                                skip_prefix=True)
+                _namespace = _namespace_for_func(namespace, _args, kwargs)
+            _tags = None
+            if tags is not None:
+                _tags = _tags_for_func(tags, _args, kwargs)
+
+            if not isinstance(key_args, SerializedKey):
+                key_args = _key_args_for_func(key_args, _args, kwargs)
+            return key_args, _namespace, _tags
 
-            _key = _make_key_for_func(key_args, _args, kwargs, namespace=_namespace)
+        def get_local(key_args, _namespace, _tags):
+            '''
+            Returns a tuple of the L1 key and L1 value, or `_MISSING`.
+            '''
+            if _local_cache is None:
+                return None, _MISSING
+            _local_key = _make_local_key(key_args, _namespace, _tags)
+            return _local_key, _local_cache.get(_local_key, _MISSING)
 
-            resp = None
-            val = cache.cache.get(_key)
-            logger.debug(u'getting cache from {}: {}'.format(_key, val))
+        # Full responses are read without the codec, which only applies to
+        # their content, and is used by `hit` instead. They're kept in L1
+        # with their content decoded.
+        read_codec = None if full_response else _codec
 
+        def found(_key, val, _local_key):
+            '''
+            Handles a value read from the cache backend, returning `_MISSING`
+            for a miss.
+            '''
+            logger.debug(u'getting cache from %s: %r', _key, val)
             if val is None:
-                resp = func(request, *args, **kwargs)
+                return _MISSING
+            val = unpack_entry(val)[0]
+            if not full_response and not isinstance(val,
+                                                    streaming.CachedStream):
+                _set_local(_local_cache, _local_key, val, timeout,
+                           none_timeout)
+            return val
 
-                if response_gatekeeper(resp):
-                    set_cache(_key, serializer(resp), timeout)
-            else:
-                resp = cached_response_wrapper(val)
+        def serialize(_key, resp):
+            '''
+            Returns a tuple of the value to cache for a response, the value to
+            keep in L1, and a dict of any chunks of its content to store along
+            with them.
+            '''
+            if not full_response:
+                val = serializer(resp)
+                return val, val, {}
+            cached = responses.make_cached_response(resp, response_headers)
+            responses.add_validators(resp, cached)
+            if _codec is None:
+                return cached, cached, {}
+            content, chunks = _codec.encode(_key, cached.content)
+            return cached._replace(content=content), cached, chunks
+
+        def store(_key, resp, _local_key):
+            if resp.streaming:
+                if cache_streaming and response_gatekeeper(resp):
+                    streaming.tee(resp, _key, timeout, response_headers)
+            elif response_gatekeeper(resp):
+                sink = metrics.get_sink()
+                val, local_val, chunks = serialize(_key, resp)
+                if metrics.timed(sink, metrics_name, metrics.SET_TIME,
+                                 _set_cache_for_func, _key, val, timeout,
+                                 none_timeout, codec=read_codec,
+                                 chunks=chunks, write_behind=write_behind,
+                                 metrics_name=metrics_name):
+                    metrics.record_set(sink, metrics_name, resp.content)
+                _set_local(_local_cache, _local_key, local_val, timeout,
+                           none_timeout)
+
+        async def astore(_key, resp, _local_key):
+            if resp.streaming:
+                if cache_streaming and response_gatekeeper(resp):
+                    streaming.tee(resp, _key, timeout, response_headers)
+            elif response_gatekeeper(resp):
+                sink = metrics.get_sink()
+                val, local_val, chunks = serialize(_key, resp)
+                if await metrics.atimed(
+                        sink, metrics_name, metrics.SET_TIME,
+                        _aset_cache_for_func(_key, val, timeout, none_timeout,
+                                             codec=read_codec, chunks=chunks,
+                                             write_behind=write_behind,
+                                             metrics_name=metrics_name)):
+                    metrics.record_set(sink, metrics_name, resp.content)
+                _set_local(_local_cache, _local_key, local_val, timeout,
+                           none_timeout)
+
+        def hit(request, val):
+            '''
+            Returns the response for a value from L1, or one from the cache
+            backend which needs no decoding.
+            '''
+            if isinstance(val, StreamingHttpResponse):
+                return val
+            if not full_response:
+                return cached_response_wrapper(val)
+            if responses.is_not_modified(request, val):
+                return responses.make_not_modified_response(val)
+            return responses.make_response(val)
+
+        def with_content(val, content, _local_key):
+            '''
+            Returns a full response read from the cache backend with its
+            content decoded as `content`, or `_MISSING` if that failed.
+            '''
+            if content is None:
+                return _MISSING
+            val = val._replace(content=content)
+            _set_local(_local_cache, _local_key, val, timeout, none_timeout)
+            return val
+
+        def decode_content(request, _key, val, _local_key):
+            # 304s don't need the content, so don't decode it for them.
+            if val is _MISSING or not full_response:
+                return val
+            if responses.is_not_modified(request, val):
+                return val
+            return with_content(val, _decode(_codec, _key, val.content),
+                                _local_key)
+
+        async def adecode_content(request, _key, val, _local_key):
+            if val is _MISSING or not full_response:
+                return val
+            if responses.is_not_modified(request, val):
+                return val
+            content = await _adecode(_codec, _key, val.content)
+            return with_content(val, content, _local_key)
+
+        def resolve(request, _key, val, _local_key):
+            '''
+            Finishes reading a value from the cache backend: decodes the
+            content of full responses, and turns cached streams into
+            streaming responses. Returns `_MISSING` if that failed.
+            '''
+            if isinstance(val, streaming.CachedStream):
+                resp = streaming.make_response(_key, val)
+                return _MISSING if resp is None else resp
+            return decode_content(request, _key, val, _local_key)
+
+        async def aresolve(request, _key, val, _local_key):
+            if isinstance(val, streaming.CachedStream):
+                resp = await streaming.amake_response(_key, val)
+                return _MISSING if resp is None else resp
+            return await adecode_content(request, _key, val, _local_key)
 
-            return resp
+        def lookup(request, key_args, _namespace, _tags):
+            '''
+            Returns a tuple of the cache key (None for L1 hits), L1 key, and
+            cached value or `_MISSING` for a request.
+            '''
+            sink = metrics.get_sink()
+            _local_key, val = get_local(key_args, _namespace, _tags)
+            if val is not _MISSING:
+                if sink is not None:
+                    sink.incr(metrics_name, metrics.HITS)
+                return None, _local_key, val
+            _key, val = metrics.timed(sink, metrics_name, metrics.GET_TIME,
+                                      lookup_cache, key_args,
+                                      namespace=_namespace, tags=_tags)
+            val = resolve(request, _key, found(
+                _key, _decode(read_codec, _key, val), _local_key), _local_key)
+            if sink is not None:
+                sink.incr(metrics_name, metrics.MISSES if val is _MISSING
+                          else metrics.HITS)
+            return _key, _local_key, val
+
+        async def alookup(request, key_args, _namespace, _tags):
+            sink = metrics.get_sink()
+            _local_key, val = get_local(key_args, _namespace, _tags)
+            if val is not _MISSING:
+                if sink is not None:
+                    sink.incr(metrics_name, metrics.HITS)
+                return None, _local_key, val
+            _key, val = await metrics.atimed(
+                sink, metrics_name, metrics.GET_TIME,
+                alookup_cache(key_args, namespace=_namespace, tags=_tags))
+            val = await aresolve(request, _key, found(
+                _key, await _adecode(read_codec, _key, val), _local_key),
+                _local_key)
+            if sink is not None:
+                sink.incr(metrics_name, metrics.MISSES if val is _MISSING
+                          else metrics.HITS)
+            return _key, _local_key, val
+
+        if inspect.iscoroutinefunction(func):
+            async def acall(request, args, kwargs):
+                if inspect.iscoroutinefunction(request_gatekeeper):
+                    can_cache = await request_gatekeeper(request, *args,
+                                                         **kwargs)
+                else:
+                    can_cache = await sync_to_async(request_gatekeeper)(
+                        request, *args, **kwargs)
+                if not can_cache:
+                    return await func(request, *args, **kwargs)
+
+                _key, _local_key, val = await alookup(
+                    request, *make_key_args(request, args, kwargs))
+                if val is not _MISSING:
+                    return hit(request, val)
+
+                async def compute():
+                    start = time.perf_counter()
+                    resp = await func(request, *args, **kwargs)
+                    sink = metrics.get_sink()
+                    if sink is not None:
+                        sink.observe(metrics_name, metrics.COMPUTE_TIME,
+                                     time.perf_counter() - start)
+                    await astore(_key, resp, _local_key)
+                    return resp
+
+                resp, computed = await _acompute_on_miss(
+                    _key, compute, _single_flight, lock_timeout, read_codec)
+                if computed:
+                    return resp
+                val = await aresolve(request, _key,
+                                     found(_key, resp, _local_key), _local_key)
+                if val is _MISSING:
+                    return await compute()
+                return hit(request, val)
+
+            @wraps(func)
+            async def wrapped(request, *args, **kwargs):
+                sink = metrics.get_sink()
+                if sink is None:
+                    return await acall(request, args, kwargs)
+                try:
+                    return await acall(request, args, kwargs)
+                except Exception:
+                    sink.incr(metrics_name, metrics.ERRORS)
+                    raise
+        else:
+            def call(request, args, kwargs):
+                if not request_gatekeeper(request, *args, **kwargs):
+                    return func(request, *args, **kwargs)
+
+                _key, _local_key, val = lookup(
+                    request, *make_key_args(request, args, kwargs))
+                if val is not _MISSING:
+                    return hit(request, val)
+
+                def compute():
+                    start = time.perf_counter()
+                    resp = func(request, *args, **kwargs)
+                    sink = metrics.get_sink()
+                    if sink is not None:
+                        sink.observe(metrics_name, metrics.COMPUTE_TIME,
+                                     time.perf_counter() - start)
+                    store(_key, resp, _local_key)
+                    return resp
+
+                resp, computed = _compute_on_miss(
+                    _key, compute, _single_flight, lock_timeout, read_codec)
+                if computed:
+                    return resp
+                val = resolve(request, _key, found(_key, resp, _local_key),
+                              _local_key)
+                if val is _MISSING:
+                    return compute()
+                return hit(request, val)
+
+            @wraps(func)
+            def wrapped(request, *args, **kwargs):
+                sink = metrics.get_sink()
+                if sink is None:
+                    return call(request, args, kwargs)
+                try:
+                    return call(request, args, kwargs)
+                except Exception:
+                    sink.incr(metrics_name, metrics.ERRORS)
+                    raise
+
+        def get_cached_response(request, *args, **kwargs):
+            '''
+            Returns the cached response for an anonymous request, or None on
+            a miss.
+            '''
+            val = lookup(request, *make_key_args(request, args, kwargs,
+                                                 anonymous=True))[2]
+            if val is _MISSING:
+                return None
+            return hit(request, val)
+
+        if early:
+            # Outer decorators copy this attribute along with the rest of
+            # `wrapped.__dict__`, so the middleware checks `view` to only
+            # serve early for the view itself, not for anything wrapping it.
+            get_cached_response.view = wrapped
+            wrapped.get_cached_response = get_cached_response
         return wrapped
     return decorator
-
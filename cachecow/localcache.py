@@ -0,0 +1,220 @@
+'''
+A small per-process, in-memory cache that can sit in front of the Django cache
+backend as a first-level ("L1") cache.
+
+Values are stored by reference -- they are not pickled or copied -- so reads
+are about as cheap as a dict lookup. The flip side is that callers must not
+mutate values they get back from it.
+
+Since each process has its own L1, an entry can outlive an invalidation made
+by another process until its timeout expires. The decorators never keep an
+entry for longer than the L1 cache's `default_timeout` (the
+`CACHECOW_LOCAL_CACHE_TIMEOUT` setting, for the default one), however long
+the value's own timeout, so that bounds how stale an L1 hit can be. Keep it
+short for anything that must be invalidated promptly across processes.
+'''
+
+from collections import OrderedDict
+import sys
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+
+# Defaults for the process-wide L1, overridable in Django settings.
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_TIMEOUT = 300
+
+# Every LocalCache created in this process, so that deletions and namespace
+# invalidations can be applied to all of them.
+_instances = weakref.WeakSet()
+
+_default_local_cache = None
+_default_local_cache_lock = threading.Lock()
+
+
+def _approximate_size(val):
+    '''
+    Returns a rough size in bytes of `val`. Looks one level into containers,
+    which is good enough for enforcing a memory cap without being expensive.
+    '''
+    size = sys.getsizeof(val)
+    if isinstance(val, (str, bytes, bytearray)):
+        return size
+    if isinstance(val, dict):
+        return size + sum(sys.getsizeof(k) + sys.getsizeof(v)
+                          for (k, v) in val.items())
+    if isinstance(val, (list, tuple, set, frozenset)):
+        return size + sum(sys.getsizeof(x) for x in val)
+    return size
+
+
+class LocalCache(object):
+    '''
+    A thread-safe LRU cache with per-entry timeouts, bounded by both a number
+    of entries and an approximate total size in bytes.
+
+    Entries may be tagged with a namespace key, or a tuple of them, so that
+    `delete_namespace` can drop every entry belonging to a namespace at once.
+    '''
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, default_timeout=DEFAULT_TIMEOUT):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_timeout = default_timeout
+
+        # key -> (value, expires_at, size, namespaces)
+        self._entries = OrderedDict()
+        self._namespaces = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+        _instances.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                val, expires_at, _, _ = self._entries[key]
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return val
+
+    def set(self, key, val, timeout=None, namespace=None):
+        '''
+        `timeout` is in seconds. None means this cache's `default_timeout`,
+        and a timeout <= 0 means the value isn't stored at all.
+
+        `namespace` may be a tuple of namespace keys, such as those of a
+        nested namespace and every namespace it lies within.
+        '''
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout is not None and timeout <= 0:
+            return
+
+        size = _approximate_size(val)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        expires_at = None
+        if timeout is not None:
+            expires_at = time.monotonic() + timeout
+
+        if namespace is None:
+            namespaces = ()
+        elif isinstance(namespace, tuple):
+            namespaces = namespace
+        else:
+            namespaces = (namespace,)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (val, expires_at, size, namespaces)
+            self._size += size
+            for namespace in namespaces:
+                self._namespaces.setdefault(namespace, set()).add(key)
+            self._cull()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_namespace(self, namespace):
+        with self._lock:
+            for key in list(self._namespaces.get(namespace, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._namespaces.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, _, size, namespaces = self._entries.pop(key)
+        self._size -= size
+        for namespace in namespaces:
+            keys = self._namespaces[namespace]
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[namespace]
+
+    def _cull(self):
+        # Evict least recently used entries until we're within our bounds.
+        while self._entries and (
+                (self.max_entries is not None
+                 and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._size > self.max_bytes)):
+            self._remove(next(iter(self._entries)))
+
+
+def get_default_local_cache():
+    '''
+    Returns the process-wide LocalCache, creating it from the
+    `CACHECOW_LOCAL_CACHE_MAX_ENTRIES`, `CACHECOW_LOCAL_CACHE_MAX_BYTES` and
+    `CACHECOW_LOCAL_CACHE_TIMEOUT` settings on first use.
+    '''
+    global _default_local_cache
+    if _default_local_cache is None:
+        with _default_local_cache_lock:
+            if _default_local_cache is None:
+                _default_local_cache = LocalCache(
+                    max_entries=getattr(settings,
+                                        'CACHECOW_LOCAL_CACHE_MAX_ENTRIES',
+                                        DEFAULT_MAX_ENTRIES),
+                    max_bytes=getattr(settings,
+                                      'CACHECOW_LOCAL_CACHE_MAX_BYTES',
+                                      DEFAULT_MAX_BYTES),
+                    default_timeout=getattr(settings,
+                                            'CACHECOW_LOCAL_CACHE_TIMEOUT',
+                                            DEFAULT_TIMEOUT))
+    return _default_local_cache
+
+
+def resolve_local_cache(local_cache):
+    '''
+    Turns the `local_cache` argument accepted by the decorators into a
+    LocalCache instance, or None if L1 caching is disabled.
+    '''
+    if local_cache is True:
+        return get_default_local_cache()
+    if local_cache is None or local_cache is False:
+        return None
+    return local_cache
+
+
+def delete(key):
+    '''
+    Deletes `key` from every LocalCache in this process.
+    '''
+    for local_cache in list(_instances):
+        local_cache.delete(key)
+
+
+def delete_namespace(namespace):
+    '''
+    Deletes every entry tagged with `namespace` from every LocalCache in this
+    process.
+    '''
+    for local_cache in list(_instances):
+        local_cache.delete_namespace(namespace)
+
+
+def clear():
+    '''
+    Empties every LocalCache in this process.
+    '''
+    for local_cache in list(_instances):
+        local_cache.clear()
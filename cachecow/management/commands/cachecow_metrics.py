@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from cachecow import metrics
+
+
+class Command(BaseCommand):
+    help = ('Reports the metrics of cached functions and views, as published '
+            'to the cache by each process.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true',
+                            help='Dump the raw metrics as JSON.')
+        parser.add_argument('--flush', action='store_true',
+                            help="Publish this process's own metrics first.")
+
+    def handle(self, *args, **options):
+        sink = metrics.get_sink()
+        if options['flush'] and isinstance(sink, metrics.InMemorySink):
+            sink.flush()
+
+        published = metrics.load_published()
+        if options['json']:
+            self.stdout.write(json.dumps(published, indent=2, sort_keys=True))
+            return
+        if not published:
+            self.stdout.write('No metrics have been published.')
+            return
+
+        self.stdout.write(
+            '{:<50} {:>8} {:>8} {:>6} {:>8} {:>6} {:>8} {:>10} {:>10} {:>10} '
+            '{:>10}'.format('function', 'hits', 'misses', 'ratio', 'sets',
+                            'errors', 'dropped', 'compute ms', 'get ms',
+                            'set ms', 'size B'))
+        for name in sorted(published):
+            m = published[name]
+            lookups = m[metrics.HITS] + m[metrics.MISSES]
+            ratio = m[metrics.HITS] / lookups if lookups else 0
+            self.stdout.write(
+                '{:<50} {:>8} {:>8} {:>6.1%} {:>8} {:>6} {:>8} {:>10.2f} '
+                '{:>10.2f} {:>10.2f} {:>10.0f}'.format(
+                    name, m[metrics.HITS], m[metrics.MISSES], ratio,
+                    m[metrics.SETS], m[metrics.ERRORS],
+                    m.get(metrics.DROPPED, 0),
+                    _mean(m[metrics.COMPUTE_TIME]) * 1000,
+                    _mean(m[metrics.GET_TIME]) * 1000,
+                    _mean(m[metrics.SET_TIME]) * 1000,
+                    _mean(m[metrics.VALUE_SIZE])))
+
+
+def _mean(histogram):
+    if not histogram['count']:
+        return 0
+    return histogram['sum'] / histogram['count']
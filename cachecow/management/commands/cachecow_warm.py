@@ -0,0 +1,115 @@
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from importlib import import_module
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import get_resolver
+
+from cachecow import registry
+
+
+class Command(BaseCommand):
+    help = ('Warms the cache for the cached functions registered with '
+            'warm_args, computing and storing only the values which are '
+            'missing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='Only warm functions whose dotted paths '
+                                 'start with one of these.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of threads or processes to warm '
+                                 'with.')
+        parser.add_argument('--processes', action='store_true',
+                            help='Use a pool of processes, not threads.')
+        parser.add_argument('--rate', type=float,
+                            help='The most values to compute per second, '
+                                 'across all workers.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of calls looked up together.')
+        parser.add_argument('--list', action='store_true',
+                            help='List the registered functions instead.')
+
+    def handle(self, *args, **options):
+        _import_modules()
+        functions = registry.get_registered(options['names'])
+
+        if options['list']:
+            for registered in functions:
+                self.stdout.write('{}{}'.format(
+                    registered.name,
+                    '' if registered.warm_args else ' (no warm_args)'))
+            return
+
+        functions = [registered for registered in functions
+                     if registered.warm_args is not None]
+        if not functions:
+            raise CommandError('No registered functions have warm_args.')
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive.')
+
+        rate = options['rate']
+        if options['processes']:
+            executor = ProcessPoolExecutor(
+                options['workers'], initializer=registry._init_process,
+                initargs=(rate and rate / options['workers'],))
+        else:
+            executor = ThreadPoolExecutor(options['workers'])
+            limiter = registry.RateLimiter(rate) if rate else None
+
+        start = time.monotonic()
+        total_computed = total_skipped = 0
+        with executor:
+            for registered in functions:
+                arg_list = registry.get_warm_args(registered)
+                futures = []
+                for i in range(0, len(arg_list), options['batch_size']):
+                    batch = arg_list[i:i + options['batch_size']]
+                    if options['processes']:
+                        futures.append(executor.submit(
+                            registry._warm_batch_in_process,
+                            registered.func.__module__, registered.name,
+                            batch))
+                    else:
+                        futures.append(executor.submit(
+                            registry.warm_batch, registered.name, batch,
+                            limiter))
+
+                computed = skipped = 0
+                for future in as_completed(futures):
+                    try:
+                        batch_computed, batch_skipped = future.result()
+                    except Exception as e:
+                        self.stderr.write('{}: error warming a batch: {!r}'
+                                          .format(registered.name, e))
+                        continue
+                    computed += batch_computed
+                    skipped += batch_skipped
+                    self.stdout.write('{}: {}/{} ({} computed, {} cached)'
+                                      .format(registered.name,
+                                              computed + skipped,
+                                              len(arg_list), computed,
+                                              skipped))
+                total_computed += computed
+                total_skipped += skipped
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            'Warmed {} values ({} computed, {} already cached) in {:.1f}s, '
+            '{:.1f} computed/s.'.format(
+                total_computed + total_skipped, total_computed, total_skipped,
+                elapsed, total_computed / elapsed if elapsed else 0))
+
+
+def _import_modules():
+    '''
+    Imports the modules which define cached functions, so that they're
+    registered: those imported by the URLconf, and any listed in the
+    `CACHECOW_WARM_MODULES` setting.
+    '''
+    if getattr(settings, 'ROOT_URLCONF', None):
+        get_resolver().url_patterns
+    for module in getattr(settings, 'CACHECOW_WARM_MODULES', []):
+        import_module(module)
@@ -0,0 +1,321 @@
+'''
+Per-function metrics for `cached_function` and `cached_view`.
+
+When a sink is configured, each decorated function reports its hits, misses,
+sets, errors and dropped write-behind sets, along with histograms of how long
+it took to compute values, to get them from and set them in the cache, and
+how large they were. With no sink (the default), the decorators skip all of
+this. Sets only count values which were stored, or queued to be.
+
+A sink is any object with these methods, where `name` is the decorated
+function's dotted path:
+
+    `incr(name, metric, count=1)`: for `HITS`, `MISSES`, `SETS`, `ERRORS` and
+    `DROPPED`.
+
+    `observe(name, metric, value)`: for `COMPUTE_TIME`, `GET_TIME` and
+    `SET_TIME` in seconds, and `VALUE_SIZE` in bytes.
+
+Two sinks are built in: `InMemorySink`, which keeps counters and histograms
+in the process and can publish them to the cache backend for the
+`cachecow_metrics` management command to report on, and `CallbackSink`, which
+passes each metric on to a statsd-style callback.
+
+The sink is set with `set_sink`, or the `CACHECOW_METRICS_SINK` setting: a
+dotted path to a sink class, or to a function returning a sink.
+`CACHECOW_METRICS_FLUSH_INTERVAL` sets how often, in seconds, the
+`InMemorySink` created from settings publishes its metrics from a background
+thread (60 by default; None to never publish them). Recording a metric never
+talks to the cache backend itself.
+'''
+
+from bisect import bisect_left
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import cache
+from django.utils.module_loading import import_string
+
+from cachecow.cache import make_key
+from cachecow.localcache import _approximate_size
+
+
+logger = logging.getLogger(__name__)
+
+HITS = 'hits'
+MISSES = 'misses'
+SETS = 'sets'
+ERRORS = 'errors'
+# Sets dropped by `cachecow.writebehind`.
+DROPPED = 'dropped'
+COUNTERS = (HITS, MISSES, SETS, ERRORS, DROPPED)
+
+COMPUTE_TIME = 'compute_time'
+GET_TIME = 'get_time'
+SET_TIME = 'set_time'
+VALUE_SIZE = 'value_size'
+
+# Upper bounds of histogram buckets, with a last bucket for anything larger.
+TIME_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+HISTOGRAMS = {
+    COMPUTE_TIME: TIME_BUCKETS,
+    GET_TIME: TIME_BUCKETS,
+    SET_TIME: TIME_BUCKETS,
+    VALUE_SIZE: SIZE_BUCKETS,
+}
+
+DEFAULT_FLUSH_INTERVAL = 60
+
+# How long published metrics outlive a process which stops publishing them.
+PUBLISHED_TIMEOUT = 24 * 60 * 60
+
+_sink = None
+_sink_configured = False
+_sink_lock = threading.Lock()
+
+
+def _make_processes_key():
+    return make_key('cachecow_metrics_processes')
+
+
+def _make_process_key(process):
+    return make_key(['cachecow_metrics', process])
+
+
+class InMemorySink(object):
+    '''
+    Keeps counters and histograms in memory. If `flush_interval` is given,
+    they're published to the cache backend that often by a background
+    thread, started when the first metric is recorded, so that
+    `load_published` can merge those of every process.
+    '''
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval
+        self.process = u'{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                           uuid.uuid4().hex[:6])
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def _function_metrics(self, name):
+        metrics = self._metrics.get(name)
+        if metrics is None:
+            metrics = self._metrics[name] = dict((c, 0) for c in COUNTERS)
+            for (metric, buckets) in HISTOGRAMS.items():
+                metrics[metric] = {'count': 0, 'sum': 0,
+                                   'buckets': [0] * (len(buckets) + 1)}
+        return metrics
+
+    def incr(self, name, metric, count=1):
+        with self._lock:
+            self._function_metrics(name)[metric] += count
+        if self._thread is None and self.flush_interval is not None:
+            self._start_flusher()
+
+    def observe(self, name, metric, value):
+        with self._lock:
+            histogram = self._function_metrics(name)[metric]
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['buckets'][bisect_left(HISTOGRAMS[metric], value)] += 1
+        if self._thread is None and self.flush_interval is not None:
+            self._start_flusher()
+
+    def snapshot(self):
+        '''
+        Returns a copy of the metrics, as a dict of function names to dicts
+        of their counters and histograms.
+        '''
+        with self._lock:
+            return _copy_metrics(self._metrics)
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._flush_periodically,
+                                            name='cachecow-metrics',
+                                            daemon=True)
+            self._thread.start()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(u'error publishing metrics')
+
+    def stop(self):
+        '''
+        Stops publishing metrics in the background.
+        '''
+        self._stopped.set()
+
+    def flush(self):
+        '''
+        Publishes this process's metrics to the cache backend.
+        '''
+        cache.cache.set(_make_process_key(self.process), self.snapshot(),
+                        timeout=PUBLISHED_TIMEOUT)
+        processes = cache.cache.get(_make_processes_key()) or []
+        if self.process not in processes:
+            # Racy, but a process that's lost is re-added on its next flush.
+            cache.cache.set(_make_processes_key(), processes + [self.process],
+                            timeout=PUBLISHED_TIMEOUT)
+
+
+class CallbackSink(object):
+    '''
+    Passes metrics on to `callback(stat, value, kind)`, where `stat` is
+    `'<prefix>.<function name>.<metric>'`, and `kind` is statsd's type for
+    it: `'c'` for counters, `'ms'` for times (in milliseconds) and `'h'` for
+    sizes.
+    '''
+    def __init__(self, callback, prefix='cachecow'):
+        self.callback = callback
+        self.prefix = prefix
+
+    def incr(self, name, metric, count=1):
+        self.callback(u'{}.{}.{}'.format(self.prefix, name, metric), count,
+                      'c')
+
+    def observe(self, name, metric, value):
+        stat = u'{}.{}.{}'.format(self.prefix, name, metric)
+        if metric == VALUE_SIZE:
+            self.callback(stat, value, 'h')
+        else:
+            self.callback(stat, value * 1000, 'ms')
+
+
+def _copy_metrics(metrics):
+    copy = {}
+    for (name, function_metrics) in metrics.items():
+        copy[name] = dict(function_metrics)
+        for metric in HISTOGRAMS:
+            histogram = function_metrics[metric]
+            copy[name][metric] = dict(histogram,
+                                      buckets=list(histogram['buckets']))
+    return copy
+
+
+def _merge_metrics(into, metrics):
+    for (name, function_metrics) in metrics.items():
+        if name not in into:
+            into[name] = _copy_metrics({name: function_metrics})[name]
+            continue
+        merged = into[name]
+        for counter in COUNTERS:
+            # Processes running older versions may not have every counter.
+            merged[counter] = (merged.get(counter, 0)
+                               + function_metrics.get(counter, 0))
+        for metric in HISTOGRAMS:
+            histogram = function_metrics[metric]
+            merged[metric]['count'] += histogram['count']
+            merged[metric]['sum'] += histogram['sum']
+            merged[metric]['buckets'] = [
+                a + b for (a, b) in zip(merged[metric]['buckets'],
+                                        histogram['buckets'])]
+    return into
+
+
+def load_published():
+    '''
+    Returns the metrics published by every process, merged, in the same
+    form as `InMemorySink.snapshot`.
+    '''
+    processes = cache.cache.get(_make_processes_key()) or []
+    published = cache.cache.get_many(
+        [_make_process_key(process) for process in processes])
+    merged = {}
+    for metrics in published.values():
+        _merge_metrics(merged, metrics)
+    return merged
+
+
+def _sink_from_settings():
+    path = getattr(settings, 'CACHECOW_METRICS_SINK', None)
+    if path is None:
+        return None
+    factory = import_string(path)
+    if factory is InMemorySink:
+        return InMemorySink(flush_interval=getattr(
+            settings, 'CACHECOW_METRICS_FLUSH_INTERVAL',
+            DEFAULT_FLUSH_INTERVAL))
+    return factory()
+
+
+def get_sink():
+    '''
+    Returns the sink metrics are recorded to, or None if they aren't.
+    '''
+    global _sink, _sink_configured
+    if not _sink_configured:
+        with _sink_lock:
+            if not _sink_configured:
+                _sink = _sink_from_settings()
+                _sink_configured = True
+    return _sink
+
+
+def set_sink(sink):
+    '''
+    Sets the sink metrics are recorded to, overriding settings. Pass None to
+    stop recording them.
+    '''
+    global _sink, _sink_configured
+    with _sink_lock:
+        _sink = sink
+        _sink_configured = True
+
+
+def value_size(val):
+    '''
+    Returns the size in bytes of a value, exactly for bytes and strings, and
+    roughly for anything else.
+    '''
+    if isinstance(val, (bytes, bytearray)):
+        return len(val)
+    return _approximate_size(val)
+
+
+def record_set(sink, name, val):
+    if sink is not None:
+        sink.incr(name, SETS)
+        sink.observe(name, VALUE_SIZE, value_size(val))
+
+
+def timed(sink, name, metric, func, *args, **kwargs):
+    '''
+    Calls `func`, recording how long it took as `metric` if there's a sink.
+    '''
+    if sink is None:
+        return func(*args, **kwargs)
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sink.observe(name, metric, time.perf_counter() - start)
+
+
+async def atimed(sink, name, metric, awaitable):
+    '''
+    Async version of `timed`, awaiting `awaitable`.
+    '''
+    if sink is None:
+        return await awaitable
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        sink.observe(name, metric, time.perf_counter() - start)
@@ -0,0 +1,73 @@
+'''
+Middleware which serves hits for `cached_view(early=True)` views before the
+rest of the middleware stack runs, and middleware which memoizes cache lookups
+for the duration of each request.
+
+On a hit, the session isn't loaded, the user isn't authenticated, and neither
+messages nor the view itself are touched -- for anonymous traffic, a hit costs
+little more than a single cache `get`. Only anonymous GET requests are served
+early: ones without a session or messages cookie, so they can't have a
+logged-in user or pending messages. Everything else, and misses, go through
+as usual, and are cached by the view.
+
+Add `cachecow.middleware.CacheMiddleware` to `MIDDLEWARE` above
+`SessionMiddleware`, but below any middleware that the cached responses
+depend on, such as `LocaleMiddleware` when the current language goes into
+their keys.
+
+Add `cachecow.middleware.RequestCacheMiddleware` to `MIDDLEWARE` to give each
+request its own request cache (see `cachecow.requestcache`). Put it high up,
+so that it covers any other middleware which does lookups.
+'''
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.urls import Resolver404, resolve
+
+from cachecow.requestcache import request_cache
+
+
+def _is_anonymous(request):
+    return (settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and CookieStorage.cookie_name not in request.COOKIES)
+
+
+class CacheMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_cached_response(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    def get_cached_response(self, request):
+        '''
+        Returns the cached response for `request`, or None if it can't be
+        served early.
+        '''
+        if request.method != 'GET' or not _is_anonymous(request):
+            return None
+        try:
+            match = resolve(request.path_info,
+                            getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+        get_cached_response = getattr(match.func, 'get_cached_response', None)
+        # Decorators over the cached view, such as `login_required`, copy
+        # the attribute onto their own wrappers. Serving early for them would
+        # skip whatever they check, so only do it for the view itself.
+        if (get_cached_response is None
+                or getattr(get_cached_response, 'view', None) is not match.func):
+            return None
+        return get_cached_response(request, *match.args, **match.kwargs)
+
+
+class RequestCacheMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_cache():
+            return self.get_response(request)
@@ -0,0 +1,250 @@
+'''
+Background refreshing of stale cache values, for stale-while-revalidate.
+
+Once a value's soft timeout passes, callers keep getting the stale value while
+a single refresh of it runs on a bounded pool of worker threads. See the
+`soft_timeout` argument of `cached_function`.
+
+The default executor is configured with these settings:
+
+    `CACHECOW_REFRESH_WORKERS`: number of worker threads (2 by default).
+
+    `CACHECOW_REFRESH_QUEUE_SIZE`: how many refreshes may wait for a worker
+    (100 by default).
+
+    `CACHECOW_REFRESH_DROP_POLICY`: what to do with a refresh when the queue
+    is full. One of `'drop_new'` (the default) to drop it, `'drop_oldest'` to
+    drop the longest waiting refresh instead, or `'caller_runs'` to run it in
+    the calling thread.
+
+Call `shutdown` when your process is exiting to let queued refreshes finish.
+'''
+
+import asyncio
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core import cache
+
+from cachecow.cache import make_key
+
+
+logger = logging.getLogger(__name__)
+
+DROP_NEW = 'drop_new'
+DROP_OLDEST = 'drop_oldest'
+CALLER_RUNS = 'caller_runs'
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 100
+
+# Default seconds a process holds the right to refresh a stale key for,
+# so that a crashed refresh doesn't block refreshing it forever.
+DEFAULT_LOCK_TIMEOUT = 30
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+# Refreshes running as asyncio tasks, referenced so they aren't garbage
+# collected before they finish.
+_async_refreshes = set()
+
+
+class RefreshExecutor(object):
+    '''
+    A bounded pool of worker threads which runs refreshes, at most one
+    pending per key. Threads are started on the first submission.
+    '''
+    def __init__(self, max_workers=DEFAULT_WORKERS,
+                 max_queue_size=DEFAULT_QUEUE_SIZE, drop_policy=DROP_NEW):
+        if drop_policy not in (DROP_NEW, DROP_OLDEST, CALLER_RUNS):
+            raise ValueError('Unknown drop policy: {!r}'.format(drop_policy))
+        self.max_workers = max_workers
+        self.drop_policy = drop_policy
+
+        self._queue = queue.Queue(max_queue_size)
+        self._pending = set()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, key, func, on_drop=None):
+        '''
+        Queues `func` to be called to refresh `key`. Returns False if it was
+        dropped, either because a refresh of `key` is already pending, the
+        queue is full, or the executor has been shut down.
+
+        `on_drop`, if given, is called if the refresh is dropped later on
+        instead, to make room for a newer one.
+        '''
+        dropped = None
+        with self._lock:
+            if self._shutdown or key in self._pending:
+                return False
+            self._start_workers()
+
+            caller_runs = False
+            try:
+                self._queue.put_nowait((key, func, on_drop))
+            except queue.Full:
+                if self.drop_policy == DROP_NEW:
+                    logger.debug(u'refresh queue full, dropping %s', key)
+                    return False
+                elif self.drop_policy == DROP_OLDEST:
+                    try:
+                        oldest_key, _, dropped = self._queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                    else:
+                        self._queue.task_done()
+                        self._pending.discard(oldest_key)
+                        logger.debug(u'refresh queue full, dropping %s',
+                                     oldest_key)
+                    self._queue.put_nowait((key, func, on_drop))
+                else:
+                    caller_runs = True
+            self._pending.add(key)
+
+        if dropped is not None:
+            try:
+                dropped()
+            except Exception:
+                logger.exception(u'error cleaning up dropped refresh')
+        if caller_runs:
+            self._run(key, func)
+        return True
+
+    def shutdown(self, wait=True, timeout=None):
+        '''
+        Stops accepting refreshes. If `wait` is True, blocks until every queued
+        refresh has run, or until `timeout` seconds have passed for each
+        worker.
+        '''
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = list(self._threads)
+
+        # Workers exit once they reach these, after draining the queue.
+        for _ in threads:
+            self._queue.put((None, None, None))
+
+        if wait:
+            for thread in threads:
+                thread.join(timeout)
+
+    def _start_workers(self):
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._work,
+                                      name='cachecow-refresh',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            key, func, _ = self._queue.get()
+            try:
+                if func is None:
+                    return
+                self._run(key, func)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, key, func):
+        try:
+            func()
+        except Exception:
+            logger.exception(u'error refreshing cache for %s', key)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+def get_default_executor():
+    '''
+    Returns the process-wide RefreshExecutor, creating it from settings on
+    first use.
+    '''
+    global _default_executor
+    if _default_executor is None:
+        with _default_executor_lock:
+            if _default_executor is None:
+                _default_executor = RefreshExecutor(
+                    max_workers=getattr(settings, 'CACHECOW_REFRESH_WORKERS',
+                                        DEFAULT_WORKERS),
+                    max_queue_size=getattr(settings,
+                                           'CACHECOW_REFRESH_QUEUE_SIZE',
+                                           DEFAULT_QUEUE_SIZE),
+                    drop_policy=getattr(settings, 'CACHECOW_REFRESH_DROP_POLICY',
+                                        DROP_NEW))
+    return _default_executor
+
+
+def shutdown(wait=True, timeout=None):
+    '''
+    Shuts down the default executor, letting queued refreshes finish if
+    `wait` is True. A new default executor is created if one is needed again.
+    '''
+    global _default_executor
+    with _default_executor_lock:
+        executor, _default_executor = _default_executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, timeout=timeout)
+
+
+def refresh(key, compute, executor=None, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    '''
+    Submits `compute` to refresh the stale value at `key` in the background,
+    unless another process or thread is already refreshing it. The right to
+    refresh is taken out with `cache.add` for up to `lock_timeout` seconds.
+    '''
+    if executor is None:
+        executor = get_default_executor()
+
+    lock_key = make_key(['cachecow_refresh', key])
+    if not cache.cache.add(lock_key, 1, timeout=lock_timeout):
+        return False
+
+    def release():
+        cache.cache.delete(lock_key)
+
+    def task():
+        try:
+            compute()
+        finally:
+            release()
+
+    # If the task is dropped from the queue, release its right to refresh
+    # along with it, so that the key can be refreshed again right away.
+    if not executor.submit(key, task, on_drop=release):
+        cache.cache.delete(lock_key)
+        return False
+    return True
+
+
+async def arefresh(key, compute, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    '''
+    Async version of `refresh`, where `compute` is a coroutine function. The
+    refresh runs as a task on the current event loop rather than on an
+    executor.
+    '''
+    lock_key = make_key(['cachecow_refresh', key])
+    if not await cache.cache.aadd(lock_key, 1, timeout=lock_timeout):
+        return False
+
+    async def task():
+        try:
+            await compute()
+        except Exception:
+            logger.exception(u'error refreshing cache for %s', key)
+        finally:
+            await cache.cache.adelete(lock_key)
+
+    refresh_task = asyncio.ensure_future(task())
+    _async_refreshes.add(refresh_task)
+    refresh_task.add_done_callback(_async_refreshes.discard)
+    return True
@@ -0,0 +1,117 @@
+'''
+A registry of the functions decorated with `cached_function`, for warming the
+cache after a deploy or a cache restart with the `cachecow_warm` management
+command.
+
+Every (non-async) `cached_function` is registered under its dotted path when
+it's decorated. To be warmed, it needs a `warm_args` function, which returns
+an iterable of the arguments of the calls to warm, each either a tuple of
+positional args or a single non-tuple arg:
+
+    @cached_function(warm_args=lambda: Product.objects.values_list('pk',
+                                                                   flat=True))
+    def product_summary(product_id):
+        ...
+
+Functions are only registered once the modules defining them are imported.
+The `cachecow_warm` command loads the URLconf, which usually imports views
+and what they use, and any modules listed in the `CACHECOW_WARM_MODULES`
+setting.
+'''
+
+from collections import namedtuple
+from importlib import import_module
+import threading
+import time
+
+import django
+
+
+Registered = namedtuple('Registered', ['name', 'func', 'warm_args'])
+
+# Dotted path -> Registered.
+_registry = {}
+
+
+def register(name, func, warm_args=None):
+    _registry[name] = Registered(name, func, warm_args)
+
+
+def get_registered(prefixes=None):
+    '''
+    Returns a list of the registered functions, sorted by name, whose names
+    start with any of `prefixes` if given.
+    '''
+    return [registered for (name, registered) in sorted(_registry.items())
+            if not prefixes or name.startswith(tuple(prefixes))]
+
+
+def get_warm_args(registered):
+    '''
+    Returns a list of the argument tuples to warm a registered function
+    with.
+    '''
+    return [args if isinstance(args, tuple) else (args,)
+            for args in registered.warm_args()]
+
+
+class RateLimiter(object):
+    '''
+    Spaces out calls to `wait` so that they return at most `rate` times a
+    second, across threads.
+    '''
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def warm_batch(name, arg_list, limiter=None):
+    '''
+    Makes sure the values of a batch of calls of the registered function
+    `name` are cached, looking them all up with a single `get_many` and
+    computing only those which are missing, at most as fast as `limiter`
+    allows. Returns a tuple of the number of values computed and the number
+    that were already cached.
+    '''
+    func = _registry[name].func
+    computed = []
+
+    def batch_func(misses):
+        vals = []
+        for args in misses:
+            if limiter is not None:
+                limiter.wait()
+            vals.append(func.__wrapped__(*args))
+        computed.extend(misses)
+        return vals
+
+    func.warm(arg_list, batch_func=batch_func)
+    return len(computed), len(arg_list) - len(computed)
+
+
+# Each worker process's share of the rate limit.
+_process_limiter = None
+
+
+def _init_process(rate):
+    global _process_limiter
+    django.setup()
+    if rate:
+        _process_limiter = RateLimiter(rate)
+
+
+def _warm_batch_in_process(module, name, arg_list):
+    # Functions are registered by importing their modules, which a spawned
+    # process may not have done yet.
+    if name not in _registry:
+        import_module(module)
+    return warm_batch(name, arg_list, _process_limiter)
@@ -0,0 +1,114 @@
+'''
+Request-scoped memoizing of cache lookups.
+
+A page render may call many cached functions, each looking up its namespace
+version and its value, often the same ones as the others. Within a request
+cache, the namespace and tag versions seen and the values found are kept for
+the rest of the request, so each is only fetched from the cache backend once.
+
+Activate one for each request with `cachecow.middleware.RequestCacheMiddleware`,
+or around any block of code with `request_cache`:
+
+    with request_cache():
+        prefetch([(get_user, (7,)), (get_product, (99,), {'lang': 'en'})])
+        ...
+
+`prefetch` looks up the values of calls to functions decorated with
+`cached_function` in a single `get_many`, so that when they're called, they
+hit the request cache.
+
+Within a request cache, a namespace or tag invalidated by another process
+isn't noticed until the next request (invalidations made in this one are),
+and values are shared by reference between the lookups that find them, so
+don't mutate them. Only hits are kept, so misses are looked up again as
+usual until they're set. Values set with `write_behind` aren't kept either.
+Outside of a request cache, nothing changes.
+'''
+
+from contextlib import contextmanager
+import contextvars
+
+
+_current = contextvars.ContextVar('cachecow_request_cache', default=None)
+
+
+class RequestCache(object):
+    def __init__(self):
+        # Namespace or tag key -> version.
+        self.versions = {}
+        # Cache key -> value as read from or set in the cache backend.
+        self.values = {}
+
+
+def get_current():
+    '''
+    Returns the active RequestCache, or None.
+    '''
+    return _current.get()
+
+
+def forget_value(key):
+    '''
+    Drops `key` from the active request cache, if any, e.g. once it's been
+    deleted from the cache backend.
+    '''
+    current = _current.get()
+    if current is not None:
+        current.values.pop(key, None)
+
+
+@contextmanager
+def request_cache():
+    '''
+    Activates a RequestCache for the duration of the block, unless one is
+    already active, and yields it.
+    '''
+    current = _current.get()
+    if current is not None:
+        yield current
+        return
+    current = RequestCache()
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def _lookup_items(calls):
+    items = []
+    for call in calls:
+        func, args = call[:2]
+        kwargs = call[2] if len(call) > 2 else {}
+        lookup_item = getattr(func, 'lookup_item', None)
+        if lookup_item is None:
+            raise ValueError('{!r} is not decorated with cached_function.'
+                             .format(func))
+        items.append(lookup_item(*args, **kwargs))
+    return items
+
+
+def prefetch(calls):
+    '''
+    Looks up the cached values of a list of calls of `cached_function`s in a
+    single `get_many`, keeping them in the active request cache. Each call is
+    a tuple of `(func, args)` or `(func, args, kwargs)`.
+
+    Does nothing if no request cache is active.
+    '''
+    from cachecow.cache import lookup_cache_many
+
+    if _current.get() is None:
+        return
+    lookup_cache_many(_lookup_items(calls))
+
+
+async def aprefetch(calls):
+    '''
+    Async version of `prefetch`.
+    '''
+    from cachecow.cache import alookup_cache_many
+
+    if _current.get() is None:
+        return
+    await alookup_cache_many(_lookup_items(calls))
@@ -0,0 +1,114 @@
+'''
+Caching of whole responses for `cached_view`, with conditional GET support.
+
+With `full_response`, `cached_view` caches a response's status code, some of
+its headers and its content together as a `CachedResponse`, along with an
+ETag and Last-Modified date computed when it's cached. The response sent to
+the client carries these too, so that when it asks again with a matching
+`If-None-Match` or `If-Modified-Since` header, it's answered with a 304 that
+doesn't need the cached content at all.
+'''
+
+from collections import namedtuple
+import hashlib
+import time
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+
+# Headers kept with cached responses, unless `cached_view` is given others.
+DEFAULT_HEADERS = (
+    'Cache-Control',
+    'Content-Disposition',
+    'Content-Encoding',
+    'Content-Language',
+    'Content-Location',
+    'Content-Type',
+    'Expires',
+    'Vary',
+)
+
+# Headers a 304 carries from the response it stands in for (RFC 7232 4.1).
+_NOT_MODIFIED_HEADERS = ('Cache-Control', 'Content-Location', 'Expires',
+                         'Vary')
+
+# `headers` is a tuple of (name, value) pairs, and `last_modified` a
+# timestamp in seconds.
+CachedResponse = namedtuple('CachedResponse', [
+    'status_code', 'headers', 'content', 'etag', 'last_modified'])
+
+
+def make_cached_response(response, headers=None):
+    '''
+    Returns a CachedResponse for `response`, keeping the given `headers` (or
+    `DEFAULT_HEADERS`). Its own ETag and Last-Modified headers are kept if it
+    has them; otherwise the ETag is a hash of its content, and it was last
+    modified now.
+    '''
+    if headers is None:
+        headers = DEFAULT_HEADERS
+    content = response.content
+    etag = response.get('ETag')
+    if not etag:
+        etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+    last_modified = parse_http_date_safe(response.get('Last-Modified', ''))
+    if last_modified is None:
+        last_modified = int(time.time())
+    return CachedResponse(
+        response.status_code,
+        tuple((name, response[name]) for name in headers
+              if response.has_header(name)),
+        content, etag, last_modified)
+
+
+def add_validators(response, cached):
+    '''
+    Gives `response` the ETag and Last-Modified headers of `cached`, unless
+    it has its own.
+    '''
+    if not response.has_header('ETag'):
+        response['ETag'] = cached.etag
+    if not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(cached.last_modified)
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def is_not_modified(request, cached):
+    '''
+    Returns whether `request` is conditional on a copy of `cached` that the
+    client already has. `If-Modified-Since` is only checked if there's no
+    `If-None-Match`.
+    '''
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if '*' in etags:
+            return True
+        etag = _strip_weak(cached.etag)
+        return any(_strip_weak(e) == etag for e in etags)
+
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return (if_modified_since is not None
+            and cached.last_modified <= if_modified_since)
+
+
+def make_not_modified_response(cached):
+    response = HttpResponseNotModified()
+    for (name, value) in cached.headers:
+        if name in _NOT_MODIFIED_HEADERS:
+            response[name] = value
+    add_validators(response, cached)
+    return response
+
+
+def make_response(cached):
+    response = HttpResponse(cached.content, status=cached.status_code)
+    for (name, value) in cached.headers:
+        response[name] = value
+    add_validators(response, cached)
+    return response
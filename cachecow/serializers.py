@@ -0,0 +1,114 @@
+'''
+Serializers for cached values, used by `cachecow.codec.Codec`.
+
+A serializer is any object with `dumps` and `loads` methods, converting values
+to and from bytes, and a single-byte `tag` which is stored with each value so
+that it's always read back with the serializer which wrote it.
+
+The built-in serializers can be referred to by name:
+
+    `'pickle'`: pickle, with the highest protocol. Buffers which values
+    pickle as `pickle.PickleBuffer`s, such as numpy arrays' data, are stored
+    after the pickle stream rather than inside it, and are read back as
+    views of the cached value rather than copies. Writing still copies them
+    once, into the payload, and plain bytes and bytearrays are pickled as
+    usual. Handles anything picklable.
+
+    `'marshal'`: marshal, which is fast and compact but only handles builtin
+    types (None, bools, numbers, strings, bytes, and lists, tuples, sets and
+    dicts of them).
+
+    `'json'`: compact JSON. Handles the same types as JSON itself, so tuples
+    come back as lists, and dict keys as strings.
+'''
+
+import json
+import marshal
+import pickle
+import struct
+
+from django.utils.module_loading import import_string
+
+
+class PickleSerializer(object):
+    tag = b'p'
+
+    # The count of out-of-band buffers, then each of their lengths.
+    _header = struct.Struct('!I')
+
+    def dumps(self, val):
+        buffers = []
+        data = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL,
+                            buffer_callback=buffers.append)
+        raws = [buf.raw() for buf in buffers]
+        header = [self._header.pack(len(raws))]
+        header.extend(self._header.pack(raw.nbytes) for raw in raws)
+        return b''.join(header + raws + [data])
+
+    def loads(self, data):
+        data = memoryview(data)
+        size = self._header.size
+        (count,) = self._header.unpack_from(data)
+        lengths = [self._header.unpack_from(data, size * (i + 1))[0]
+                   for i in range(count)]
+        offset = size * (count + 1)
+        buffers = []
+        for length in lengths:
+            buffers.append(data[offset:offset + length])
+            offset += length
+        return pickle.loads(data[offset:], buffers=buffers)
+
+
+class MarshalSerializer(object):
+    tag = b'm'
+
+    def dumps(self, val):
+        return marshal.dumps(val)
+
+    def loads(self, data):
+        return marshal.loads(data)
+
+
+class JSONSerializer(object):
+    tag = b'j'
+
+    def dumps(self, val):
+        return json.dumps(val, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer(),
+    'marshal': MarshalSerializer(),
+    'json': JSONSerializer(),
+}
+
+_serializers_by_tag = dict((serializer.tag, serializer)
+                           for serializer in SERIALIZERS.values())
+
+
+def get_serializer(serializer):
+    '''
+    Returns a serializer given a built-in serializer's name, a dotted path
+    to a serializer (or serializer class), or a serializer itself.
+    '''
+    if isinstance(serializer, str):
+        if serializer in SERIALIZERS:
+            return SERIALIZERS[serializer]
+        serializer = import_string(serializer)
+    if isinstance(serializer, type):
+        serializer = serializer()
+    _serializers_by_tag.setdefault(serializer.tag, serializer)
+    return serializer
+
+
+def get_serializer_for_tag(tag):
+    '''
+    Returns the serializer which wrote a value with the given tag.
+    '''
+    try:
+        return _serializers_by_tag[tag]
+    except KeyError:
+        raise ValueError('Unknown serializer tag: {!r}'.format(tag))
@@ -0,0 +1,191 @@
+'''
+Invalidating namespaces automatically when models change.
+
+Rather than calling `invalidate_namespace` in every `save`, bind namespaces
+to a model, and they're invalidated whenever one of its instances is saved
+or deleted, or its many-to-many relations change:
+
+    @invalidates_namespaces('products', lambda obj: ['product', obj.pk])
+    class Product(models.Model):
+        ...
+
+    bind_namespaces(User, [lambda user: ['user', user.pk]])
+
+Namespaces are given as `cached_function` accepts them, either flat or as a
+nested `cachecow.cache.Namespace`, or as functions which take the instance
+and return one (or None, to skip it).
+
+Invalidations are deferred with `transaction.on_commit`, so that other
+processes can't cache what they read while the transaction is still open,
+and those made within one transaction are coalesced: each namespace is
+invalidated once when it commits, however many instances were changed. A bulk
+update of a thousand rows in one namespace costs a single `cache.incr`.
+Outside of a transaction, they're made right away.
+
+Bind namespaces once, e.g. in an `AppConfig.ready`, when the models'
+relations are resolved. Note that `QuerySet.update` and `bulk_create` don't
+send these signals, so they don't invalidate anything.
+'''
+
+from collections import OrderedDict
+import logging
+import threading
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from cachecow.cache import invalidate_namespace, _namespace_own_key
+
+
+logger = logging.getLogger(__name__)
+
+# Model -> list of namespaces or functions returning them.
+_bindings = {}
+
+# Each thread's pending invalidations, as a dict of database alias ->
+# OrderedDict of namespace key -> namespace.
+_pending = threading.local()
+
+
+def bind_namespaces(model, namespaces, m2m=True):
+    '''
+    Invalidates `namespaces` whenever an instance of `model` is saved or
+    deleted, and, if `m2m` is True, whenever its many-to-many relations
+    change, from either side. Binding more namespaces to the same model adds
+    to them.
+    '''
+    if model not in _bindings:
+        _bindings[model] = []
+        post_save.connect(_on_change, sender=model, weak=False,
+                          dispatch_uid=_dispatch_uid(model))
+        post_delete.connect(_on_change, sender=model, weak=False,
+                            dispatch_uid=_dispatch_uid(model))
+        if m2m:
+            for (through, reverse, lookup, name) in _m2m_relations(model):
+                m2m_changed.connect(
+                    _make_m2m_receiver(model, reverse, lookup),
+                    sender=through, weak=False,
+                    dispatch_uid=_dispatch_uid(model, name))
+    _bindings[model].extend(namespaces)
+
+
+def unbind_namespaces(model):
+    '''
+    Stops invalidating any namespaces bound to `model`.
+    '''
+    if _bindings.pop(model, None) is None:
+        return
+    post_save.disconnect(sender=model, dispatch_uid=_dispatch_uid(model))
+    post_delete.disconnect(sender=model, dispatch_uid=_dispatch_uid(model))
+    for (through, reverse, lookup, name) in _m2m_relations(model):
+        m2m_changed.disconnect(sender=through,
+                               dispatch_uid=_dispatch_uid(model, name))
+
+
+def invalidates_namespaces(*namespaces, **kwargs):
+    '''
+    Class decorator version of `bind_namespaces`.
+    '''
+    def decorator(model):
+        bind_namespaces(model, namespaces, **kwargs)
+        return model
+    return decorator
+
+
+def _dispatch_uid(model, name=None):
+    uid = 'cachecow.signals.{}'.format(model._meta.label)
+    if name is not None:
+        uid = '{}.{}'.format(uid, name)
+    return uid
+
+
+def _m2m_relations(model):
+    '''
+    Yields a tuple for each many-to-many relation of `model`, both those it
+    declares and those declared on other models which point to it: the
+    through model, the value of `reverse` in `m2m_changed` when the instance
+    sent is one of `model`'s, the lookup from `model` to the other side, and
+    a name to tell the relation's receiver apart.
+    '''
+    for field in model._meta.local_many_to_many:
+        yield (field.remote_field.through, False, field.name, field.name)
+    for rel in model._meta.related_objects:
+        if rel.many_to_many:
+            yield (rel.through, True, rel.field.related_query_name(),
+                   'reverse.{}'.format(rel.field.related_query_name()))
+
+
+def _namespaces_for(model, instance):
+    for namespace in _bindings.get(model, ()):
+        if callable(namespace):
+            namespace = namespace(instance)
+        if namespace is not None:
+            yield namespace
+
+
+def _on_change(sender, instance, using, **kwargs):
+    _schedule(_namespaces_for(sender, instance), using)
+
+
+def _make_m2m_receiver(model, own_reverse, lookup_name):
+    '''
+    Returns a receiver of `m2m_changed` for a many-to-many relation of
+    `model`, which invalidates the namespaces of the instances of `model`
+    whose relations changed. `own_reverse` is the value of `reverse` when
+    the instance sent is one of `model`'s, and `lookup_name` is the lookup
+    from `model` to the other side, as `_m2m_relations` gives them.
+    '''
+    def receiver(sender, instance, action, reverse, pk_set, using, **kwargs):
+        if reverse == own_reverse:
+            # `instance` is the one of ours whose relations changed.
+            if action in ('post_add', 'post_remove', 'post_clear'):
+                _schedule(_namespaces_for(model, instance), using)
+            return
+
+        # `instance` is on the other side, and `pk_set` holds ours.
+        if action in ('post_add', 'post_remove'):
+            if not pk_set:
+                return
+            lookup = {'pk__in': pk_set}
+        elif action == 'pre_clear':
+            lookup = {lookup_name: instance}
+        else:
+            return
+
+        if not any(callable(namespace) for namespace in _bindings[model]):
+            # No need to fetch the instances when they don't matter.
+            _schedule(_namespaces_for(model, None), using)
+            return
+        for obj in model._default_manager.using(using).filter(**lookup):
+            _schedule(_namespaces_for(model, obj), using)
+    return receiver
+
+
+def _schedule(namespaces, using):
+    '''
+    Adds `namespaces` to the pending invalidations for the `using` database,
+    to be made when its current transaction commits.
+    '''
+    batches = _pending.__dict__.setdefault('batches', {})
+    batch = batches.setdefault(using, OrderedDict())
+    scheduled = False
+    for namespace in namespaces:
+        batch[_namespace_own_key(namespace)] = namespace
+        scheduled = True
+    if scheduled:
+        # Every change registers a flush, since if its transaction is rolled
+        # back, so are the flushes it registered, and the batch is left for
+        # the next one. The first to run flushes the whole batch.
+        transaction.on_commit(lambda: _flush(using), using=using)
+
+
+def _flush(using):
+    batch = _pending.__dict__.get('batches', {}).pop(using, None)
+    if not batch:
+        return
+    logger.debug(u'invalidating %s namespaces on commit', len(batch))
+    for namespace in batch.values():
+        try:
+            invalidate_namespace(namespace)
+        except Exception:
+            logger.exception(u'error invalidating namespace: %r', namespace)
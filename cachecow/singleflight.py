@@ -0,0 +1,221 @@
+'''
+Stampede protection for cache misses.
+
+When a popular key expires, every caller that misses on it would otherwise
+recompute the value at the same time. Single-flight makes one caller (the
+"leader") recompute it while the others wait for the value to be stored, and
+then read it back from the cache.
+
+Callers are coalesced within a process with a lock per key, and optionally
+across processes with a lease lock taken out with `cache.add`. If the leader
+never stores a value -- it raised, or the result wasn't cacheable -- or it
+takes longer than the lock timeout, waiters go on to compute the value
+themselves. Where the value is stored only after the leader returns, as with
+write-behind, the leader can share it with waiters in the same process
+instead.
+'''
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import cache
+
+from cachecow.cache import make_key
+
+
+logger = logging.getLogger(__name__)
+
+# Default seconds a cross-process lease is held for, and so the longest a
+# waiter will wait for the leader before computing the value itself.
+DEFAULT_LOCK_TIMEOUT = 30
+
+# Bounds on how long waiters sleep between polls of the cache, in seconds.
+# The delay doubles after each poll.
+MIN_POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.5
+
+# Single-flight modes accepted by the decorators' `single_flight` argument.
+LOCAL = 'local'
+DISTRIBUTED = 'distributed'
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+# (event loop, key) -> _Flight, for coroutines. Only touched from within the
+# loop's own thread, so it needs no lock.
+_async_flights = {}
+
+
+class _Flight(object):
+    '''
+    A leader's computation of a key, which waiters within the process wait on.
+    '''
+    def __init__(self, event):
+        self.event = event
+        # A tuple of the value, if the leader computed it and shares it.
+        self.result = None
+
+
+def _get_lock_timeout(lock_timeout):
+    if lock_timeout is None:
+        lock_timeout = getattr(settings, 'CACHECOW_SINGLE_FLIGHT_LOCK_TIMEOUT',
+                               DEFAULT_LOCK_TIMEOUT)
+    return lock_timeout
+
+
+def _make_lock_key(key):
+    return make_key(['cachecow_lock', key])
+
+
+def _call_with_lease(key, compute, reread, lock_timeout):
+    lock_key = _make_lock_key(key)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + lock_timeout
+    delay = MIN_POLL_INTERVAL
+
+    while True:
+        if cache.cache.add(lock_key, token, timeout=lock_timeout):
+            try:
+                return compute(), True
+            finally:
+                # Don't release a lease which timed out and was taken over.
+                if cache.cache.get(lock_key) == token:
+                    cache.cache.delete(lock_key)
+
+        if time.monotonic() >= deadline:
+            logger.debug(u'gave up waiting on lease for %s', key)
+            return compute(), True
+
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_INTERVAL)
+
+        val = reread()
+        if val is not None:
+            return val, False
+
+
+def call(key, compute, reread, mode=DISTRIBUTED, lock_timeout=None,
+         share=False):
+    '''
+    Returns a tuple of `(value, computed)`, where `value` is either the return
+    value of `compute` or, if another caller computed it first, of `reread`.
+    `computed` tells which.
+
+    `compute` should compute the value for `key` and store it in the cache.
+    `reread` should read it back, returning None if it isn't there. If
+    `share` is True, callers waiting within this process are handed the value
+    the leader computed instead of rereading it, for when it's only stored
+    after `compute` returns; `computed` is False for them too.
+
+    `mode` is either `LOCAL`, to only coalesce callers within this process, or
+    `DISTRIBUTED`, to also coalesce across processes with a lease lock held in
+    the cache for up to `lock_timeout` seconds (or the
+    `CACHECOW_SINGLE_FLIGHT_LOCK_TIMEOUT` setting, 30 by default). In either
+    mode, callers wait for the leader for up to `lock_timeout` seconds before
+    computing the value themselves.
+    '''
+    if mode not in (LOCAL, DISTRIBUTED):
+        raise ValueError('Unknown single-flight mode: {!r}'.format(mode))
+    lock_timeout = _get_lock_timeout(lock_timeout)
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight(threading.Event())
+
+    if not leader:
+        if not flight.event.wait(lock_timeout):
+            logger.debug(u'gave up waiting on leader for %s', key)
+            return compute(), True
+        if flight.result is not None:
+            return flight.result[0], False
+        val = reread()
+        if val is not None:
+            return val, False
+        return compute(), True
+
+    try:
+        if mode == DISTRIBUTED:
+            val, computed = _call_with_lease(key, compute, reread,
+                                             lock_timeout)
+        else:
+            val, computed = compute(), True
+        if share and computed:
+            flight.result = (val,)
+        return val, computed
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.event.set()
+
+
+async def _acall_with_lease(key, compute, reread, lock_timeout):
+    lock_key = _make_lock_key(key)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + lock_timeout
+    delay = MIN_POLL_INTERVAL
+
+    while True:
+        if await cache.cache.aadd(lock_key, token, timeout=lock_timeout):
+            try:
+                return await compute(), True
+            finally:
+                if await cache.cache.aget(lock_key) == token:
+                    await cache.cache.adelete(lock_key)
+
+        if time.monotonic() >= deadline:
+            logger.debug(u'gave up waiting on lease for %s', key)
+            return await compute(), True
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_INTERVAL)
+
+        val = await reread()
+        if val is not None:
+            return val, False
+
+
+async def acall(key, compute, reread, mode=DISTRIBUTED, lock_timeout=None,
+                share=False):
+    '''
+    Async version of `call`, where `compute` and `reread` are coroutine
+    functions. Coroutines waiting on the same key within an event loop are
+    coalesced without blocking the loop.
+    '''
+    if mode not in (LOCAL, DISTRIBUTED):
+        raise ValueError('Unknown single-flight mode: {!r}'.format(mode))
+    lock_timeout = _get_lock_timeout(lock_timeout)
+
+    flight_key = (asyncio.get_running_loop(), key)
+    flight = _async_flights.get(flight_key)
+    if flight is not None:
+        try:
+            await asyncio.wait_for(flight.event.wait(), lock_timeout)
+        except asyncio.TimeoutError:
+            logger.debug(u'gave up waiting on leader for %s', key)
+            return await compute(), True
+        if flight.result is not None:
+            return flight.result[0], False
+        val = await reread()
+        if val is not None:
+            return val, False
+        return await compute(), True
+
+    flight = _async_flights[flight_key] = _Flight(asyncio.Event())
+    try:
+        if mode == DISTRIBUTED:
+            val, computed = await _acall_with_lease(key, compute, reread,
+                                                    lock_timeout)
+        else:
+            val, computed = await compute(), True
+        if share and computed:
+            flight.result = (val,)
+        return val, computed
+    finally:
+        del _async_flights[flight_key]
+        flight.event.set()
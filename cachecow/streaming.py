@@ -0,0 +1,243 @@
+'''
+Caching of streaming responses for `cached_view`.
+
+A `StreamingHttpResponse` is cached by teeing its content as it's sent to
+the client. The content is buffered a chunk at a time, and each chunk is
+written under its own key as soon as it's full, so no more than a chunk is
+held in memory. Once the stream finishes, a `CachedStream` describing the
+chunks is stored at the view's key, so readers never see a partial stream.
+Streams larger than the size limit aren't cached.
+
+Hits are served as a new streaming response whose content is read from the
+cache a few chunks at a time. The first chunks are read before responding,
+so a hit whose chunks have been evicted is treated as a miss. If a later
+chunk has gone missing, the stream is cut short and the cached stream is
+deleted; the response's Content-Length lets the client tell it was
+truncated.
+
+These settings apply:
+
+    `CACHECOW_STREAM_CHUNK_SIZE`: bytes per chunk (1000000 by default, to
+    fit under memcached's 1 MB item limit).
+
+    `CACHECOW_STREAM_MAX_SIZE`: streams larger than this many bytes aren't
+    cached (50 MB by default).
+'''
+
+from collections import namedtuple
+import logging
+import uuid
+
+from django.conf import settings
+from django.core import cache
+from django.http import StreamingHttpResponse
+
+from cachecow import responses
+from cachecow.cache import aset_cache, make_key, normalize_timeout, set_cache
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000000
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+
+# How many chunks hits read from the cache at a time.
+FETCH_BATCH_SIZE = 4
+
+# Headers kept with cached streams: the same as with cached responses.
+DEFAULT_HEADERS = responses.DEFAULT_HEADERS
+
+# Stored at a view's key for a cached stream. `headers` is a tuple of
+# (name, value) pairs, and `nonce` keeps the chunks of concurrent writes to
+# the same key apart.
+CachedStream = namedtuple('CachedStream', [
+    'status_code', 'headers', 'nonce', 'count', 'length'])
+
+
+def _make_chunk_key(key, nonce, i):
+    return make_key([key, 'stream', nonce, i])
+
+
+class _Tee(object):
+    '''
+    Buffers the content of a streaming response into chunks written to the
+    cache, and finally stores a `CachedStream` for them at `key`.
+    '''
+    def __init__(self, response, key, timeout, headers=None):
+        if headers is None:
+            headers = DEFAULT_HEADERS
+        self.key = key
+        self.timeout = normalize_timeout(timeout)
+        self.chunk_size = getattr(settings, 'CACHECOW_STREAM_CHUNK_SIZE',
+                                  DEFAULT_CHUNK_SIZE)
+        self.max_size = getattr(settings, 'CACHECOW_STREAM_MAX_SIZE',
+                                DEFAULT_MAX_SIZE)
+        self.stream = CachedStream(
+            response.status_code,
+            tuple((name, response[name]) for name in headers
+                  if response.has_header(name)),
+            uuid.uuid4().hex[:8], 0, 0)
+
+        self._buffer = []
+        self._buffered = 0
+        self.abandoned = False
+
+    def feed(self, data):
+        '''
+        Adds `data` to the buffer, returning a dict of any full chunks to
+        write.
+        '''
+        if self.abandoned:
+            return {}
+        if isinstance(data, str):
+            data = data.encode(settings.DEFAULT_CHARSET)
+        if self.stream.length + self._buffered + len(data) > self.max_size:
+            logger.debug(u'stream for %s too large to cache', self.key)
+            self.abandoned = True
+            self._buffer = []
+            return {}
+        self._buffer.append(data)
+        self._buffered += len(data)
+        chunks = {}
+        while self._buffered >= self.chunk_size:
+            chunks.update(self._take(self.chunk_size))
+        return chunks
+
+    def finish(self):
+        '''
+        Returns a dict of the last chunk to write, if any, and the
+        `CachedStream` to store. The latter is None if the stream was
+        abandoned.
+        '''
+        if self.abandoned:
+            return {}, None
+        chunks = self._take(self._buffered) if self._buffered else {}
+        return chunks, self.stream
+
+    def _take(self, size):
+        data = b''.join(self._buffer)
+        chunk, rest = data[:size], data[size:]
+        self._buffer = [rest] if rest else []
+        self._buffered = len(rest)
+
+        chunk_key = _make_chunk_key(self.key, self.stream.nonce,
+                                    self.stream.count)
+        self.stream = self.stream._replace(count=self.stream.count + 1,
+                                           length=self.stream.length + size)
+        return {chunk_key: chunk}
+
+
+def tee(response, key, timeout, headers=None):
+    '''
+    Makes `response`, a streaming response, cache its content at `key` as
+    it's streamed.
+    '''
+    t = _Tee(response, key, timeout, headers)
+    content = response.streaming_content
+
+    if response.is_async:
+        async def streaming_content():
+            async for data in content:
+                chunks = t.feed(data)
+                if chunks:
+                    await cache.cache.aset_many(chunks, timeout=t.timeout)
+                yield data
+            chunks, stream = t.finish()
+            if stream is not None:
+                if chunks:
+                    await cache.cache.aset_many(chunks, timeout=t.timeout)
+                await aset_cache(key, stream, t.timeout)
+    else:
+        def streaming_content():
+            for data in content:
+                chunks = t.feed(data)
+                if chunks:
+                    cache.cache.set_many(chunks, timeout=t.timeout)
+                yield data
+            chunks, stream = t.finish()
+            if stream is not None:
+                if chunks:
+                    cache.cache.set_many(chunks, timeout=t.timeout)
+                set_cache(key, stream, t.timeout)
+
+    response.streaming_content = streaming_content()
+
+
+def _chunk_batches(key, stream):
+    keys = [_make_chunk_key(key, stream.nonce, i)
+            for i in range(stream.count)]
+    return [keys[i:i + FETCH_BATCH_SIZE]
+            for i in range(0, len(keys), FETCH_BATCH_SIZE)]
+
+
+def _ordered(batch, fetched):
+    '''
+    Returns the chunks of `batch` in order, or None if any are missing.
+    '''
+    chunks = [fetched.get(k) for k in batch]
+    if None in chunks:
+        return None
+    return chunks
+
+
+def _make_response(key, stream, batches, first, asynchronous):
+    if asynchronous:
+        async def content():
+            for chunk in first:
+                yield chunk
+            for batch in batches[1:]:
+                chunks = _ordered(batch, await cache.cache.aget_many(batch))
+                if chunks is None:
+                    logger.warning(u'chunk missing from cached stream %s',
+                                   key)
+                    await cache.cache.adelete(key)
+                    return
+                for chunk in chunks:
+                    yield chunk
+    else:
+        def content():
+            for chunk in first:
+                yield chunk
+            for batch in batches[1:]:
+                chunks = _ordered(batch, cache.cache.get_many(batch))
+                if chunks is None:
+                    logger.warning(u'chunk missing from cached stream %s',
+                                   key)
+                    cache.cache.delete(key)
+                    return
+                for chunk in chunks:
+                    yield chunk
+
+    response = StreamingHttpResponse(content(), status=stream.status_code)
+    for (name, value) in stream.headers:
+        response[name] = value
+    response['Content-Length'] = str(stream.length)
+    return response
+
+
+def make_response(key, stream):
+    '''
+    Returns a streaming response serving the cached `stream` at `key`, or
+    None if its chunks are missing.
+    '''
+    batches = _chunk_batches(key, stream)
+    first = []
+    if batches:
+        first = _ordered(batches[0], cache.cache.get_many(batches[0]))
+        if first is None:
+            return None
+    return _make_response(key, stream, batches, first, asynchronous=False)
+
+
+async def amake_response(key, stream):
+    '''
+    Async version of `make_response`, for async views. The response streams
+    its content asynchronously.
+    '''
+    batches = _chunk_batches(key, stream)
+    first = []
+    if batches:
+        first = _ordered(batches[0], await cache.cache.aget_many(batches[0]))
+        if first is None:
+            return None
+    return _make_response(key, stream, batches, first, asynchronous=True)
@@ -1,15 +1,48 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+from io import StringIO
 from datetime import timedelta
-from itertools import chain
+import os
+import subprocess
+import sys
+import threading
+import time
 
 from django.conf import settings
-from django.test import TestCase
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.urls import path
 
+from django.core import cache
+
+from cachecow import (cache as cachecow_cache, client, metrics, singleflight,
+                      xfetch)
 from cachecow.cache import (make_key, _format_key_arg, timedelta_to_seconds,
-                            invalidate_namespace, key_arg_iterator)
-from cachecow.decorators import cached_function
-from cachecow.intpacker import pack_int, unpack_int
+                            invalidate_namespace, invalidate_tag,
+                            key_arg_iterator, lookup_cache, set_cache,
+                            CacheEntry, Namespace)
+from cachecow.decorators import (cached_function, cached_property,
+                                 cached_view,
+                                 _make_key_builder,
+                                 _func_fingerprint)
+from cachecow.intpacker import pack_int
+from cachecow import codec as codec_module
+from cachecow.codec import Codec, ChunkManifest, get_codec
+from cachecow.tests.models import Author, Book
+from cachecow.serializers import get_serializer
+from cachecow.localcache import LocalCache
+from cachecow.middleware import CacheMiddleware, RequestCacheMiddleware
+from cachecow.requestcache import prefetch, request_cache
+from cachecow.registry import RateLimiter, get_registered, warm_batch
+from cachecow.refresh import (RefreshExecutor, DROP_NEW, DROP_OLDEST,
+                              CALLER_RUNS, refresh)
+from cachecow.signals import bind_namespaces, unbind_namespaces
+from cachecow.singleflight import _make_lock_key
+from cachecow.writebehind import WriteBehindQueue
 
 
 class CacheHelperTest(TestCase):
@@ -211,6 +244,1690 @@ class CacheHelperTest(TestCase):
         self.assertEqual(iterated_args, flat_args)
 
 
+class LocalCacheTest(TestCase):
+    def test_lru_eviction(self):
+        l1 = LocalCache(max_entries=2)
+        l1.set('a', 1)
+        l1.set('b', 2)
+        l1.get('a')
+        l1.set('c', 3)
+        self.assertEqual(l1.get('a'), 1)
+        self.assertEqual(l1.get('b'), None)
+        self.assertEqual(l1.get('c'), 3)
+
+    def test_byte_limit(self):
+        l1 = LocalCache(max_bytes=1000)
+        l1.set('a', 'x' * 600)
+        l1.set('b', 'y' * 600)
+        self.assertEqual(l1.get('a'), None)
+        self.assertEqual(len(l1), 1)
+        l1.set('c', 'z' * 2000)
+        self.assertEqual(l1.get('c'), None)
+
+    def test_timeout(self):
+        l1 = LocalCache()
+        l1.set('a', 1, timeout=0)
+        self.assertEqual(l1.get('a'), None)
+        l1.set('b', 1, timeout=-1)
+        self.assertEqual(l1.get('b'), None)
+
+    def test_decorator_reads_local_cache_first(self):
+        l1 = LocalCache()
+        foo = 10
+
+        @cached_function(key='test_l1_read', local_cache=l1)
+        def my_func():
+            return foo
+
+        self.assertEqual(my_func(), foo)
+        cache.cache.delete(make_key('test_l1_read'))
+        foo = 20
+        self.assertEqual(my_func(), 10)
+
+        my_func.delete_cache()
+        self.assertEqual(my_func(), foo)
+
+    def test_namespace_invalidation_clears_local_cache(self):
+        l1 = LocalCache()
+        foo = 10
+
+        @cached_function(namespace='test_l1_ns', local_cache=l1)
+        def my_func():
+            return foo
+
+        self.assertEqual(my_func(), foo)
+        self.assertEqual(len(l1), 1)
+        foo = 20
+        invalidate_namespace('test_l1_ns')
+        self.assertEqual(len(l1), 0)
+        self.assertEqual(my_func(), foo)
+
+    def test_local_timeout_is_capped(self):
+        l1 = LocalCache(default_timeout=5)
+
+        @cached_function(key='test_l1_cap', timeout=3600, local_cache=l1)
+        def my_func():
+            return 1
+
+        my_func()
+        (_, expires_at, _, _), = l1._entries.values()
+        self.assertTrue(expires_at <= time.monotonic() + 5)
+
+        @cached_function(key='test_l1_short', timeout=2, local_cache=l1)
+        def short_func():
+            return 1
+
+        short_func()
+        self.assertTrue(max(entry[1] for entry in l1._entries.values())
+                        <= time.monotonic() + 5)
+        self.assertTrue(min(entry[1] for entry in l1._entries.values())
+                        <= time.monotonic() + 2)
+
+
+class CallCounter(object):
+    '''
+    Records the calls made to the cache backend's methods while in use, not
+    counting calls the backend makes to itself.
+    '''
+    methods = ('get', 'get_many', 'set', 'set_many', 'add', 'incr', 'delete',
+               'delete_many')
+
+    def __enter__(self):
+        self.calls = []
+        self._depth = 0
+        for name in self.methods:
+            setattr(cache.cache, name,
+                    self._counted(name, getattr(cache.cache, name)))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name in self.methods:
+            delattr(cache.cache, name)
+
+    def _counted(self, name, original):
+        def counted(*args, **kwargs):
+            if not self._depth:
+                self.calls.append(name)
+            self._depth += 1
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self._depth -= 1
+        return counted
+
+
+class NamespaceRoundTripTest(TestCase):
+    def setUp(self):
+        cachecow_cache._namespace_versions.clear()
+
+    def test_single_round_trip(self):
+        @cached_function(namespace='test_rt_ns')
+        def my_func(x):
+            return x
+
+        my_func(1)
+        with CallCounter() as counter:
+            self.assertEqual(my_func(1), 1)
+        self.assertEqual(counter.calls, ['get_many'])
+
+    def test_invalidation_by_another_process(self):
+        foo = 10
+
+        @cached_function(namespace='test_rt_other')
+        def my_func():
+            return foo
+
+        self.assertEqual(my_func(), foo)
+        foo = 20
+        # Bypass `invalidate_namespace` so this process's memory is stale.
+        cache.cache.incr(make_key('test_rt_other'))
+        self.assertEqual(my_func(), foo)
+
+    @override_settings(CACHECOW_NAMESPACE_VERSION_TTL=60)
+    def test_version_ttl(self):
+        @cached_function(namespace='test_rt_ttl')
+        def my_func(x):
+            return x
+
+        my_func(1)
+        with CallCounter() as counter:
+            my_func(1)
+        self.assertEqual(counter.calls, ['get'])
+
+    def test_concurrent_initialization(self):
+        ns_key = make_key('test_rt_init')
+        cache.cache.add(ns_key, 12345)
+        self.assertEqual(cachecow_cache._init_namespace_version(ns_key), 12345)
+
+
+class SingleFlightTest(TestCase):
+    def test_local_coalescing(self):
+        calls = []
+        release = threading.Event()
+
+        @cached_function(key='test_sf_local', single_flight='local')
+        def slow_func():
+            calls.append(1)
+            release.wait(5)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow_func()))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_local_waiters_give_up_on_hung_leader(self):
+        hang = threading.Event()
+
+        def hung_leader():
+            singleflight.call('test_sf_hung', lambda: hang.wait(5),
+                              lambda: None, mode='local')
+        leader = threading.Thread(target=hung_leader)
+        leader.start()
+        time.sleep(0.05)
+
+        start = time.monotonic()
+        self.assertEqual(singleflight.call('test_sf_hung', lambda: 'mine',
+                                           lambda: None, mode='local',
+                                           lock_timeout=0.1),
+                         ('mine', True))
+        self.assertTrue(time.monotonic() - start < 2)
+        hang.set()
+        leader.join()
+
+    def test_waits_on_other_process_lease(self):
+        key = make_key('test_sf_lease')
+        cache.cache.add(_make_lock_key(key), 'other process', 5)
+
+        def other_process():
+            time.sleep(0.05)
+            cache.cache.set(key, 'theirs')
+        threading.Thread(target=other_process).start()
+
+        @cached_function(key='test_sf_lease', single_flight=True)
+        def my_func():
+            return 'ours'
+
+        self.assertEqual(my_func(), 'theirs')
+
+    def test_lease_timeout(self):
+        key = make_key('test_sf_timeout')
+        cache.cache.add(_make_lock_key(key), 'other process', 5)
+
+        @cached_function(key='test_sf_timeout', single_flight=True,
+                         lock_timeout=0.05)
+        def my_func():
+            return 'ours'
+
+        self.assertEqual(my_func(), 'ours')
+
+    def test_cached_view(self):
+        calls = []
+
+        @cached_view(key='test_sf_view', single_flight=True)
+        def my_view(request):
+            calls.append(1)
+            return HttpResponse('hello')
+
+        request = RequestFactory().get('/')
+        self.assertEqual(my_view(request).content, b'hello')
+        self.assertEqual(my_view(request).content, b'hello')
+        self.assertEqual(len(calls), 1)
+
+
+class StaleWhileRevalidateTest(TestCase):
+    def test_stale_value_is_refreshed_in_background(self):
+        executor = RefreshExecutor(max_workers=1)
+        foo = 10
+
+        @cached_function(key='test_swr', soft_timeout=0.05,
+                         refresh_executor=executor)
+        def my_func():
+            return foo
+
+        self.assertEqual(my_func(), 10)
+        foo = 20
+        self.assertEqual(my_func(), 10)
+        time.sleep(0.1)
+        self.assertEqual(my_func(), 10)
+
+        executor.shutdown(wait=True)
+        self.assertEqual(my_func(), 20)
+
+    def _blocked_executor(self, drop_policy):
+        executor = RefreshExecutor(max_workers=1, max_queue_size=1,
+                                   drop_policy=drop_policy)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        executor.submit('blocker', lambda: release.wait(5))
+        time.sleep(0.05)
+        ran = []
+        executor.submit('queued', lambda: ran.append('queued'))
+        return executor, release, ran
+
+    def test_drop_new(self):
+        executor, release, ran = self._blocked_executor(DROP_NEW)
+        self.assertFalse(executor.submit('new', lambda: ran.append('new')))
+        self.assertFalse(executor.submit('queued', lambda: None))
+        release.set()
+        executor.shutdown(wait=True)
+        self.assertEqual(ran, ['queued'])
+
+    def test_drop_oldest(self):
+        executor, release, ran = self._blocked_executor(DROP_OLDEST)
+        self.assertTrue(executor.submit('new', lambda: ran.append('new')))
+        release.set()
+        executor.shutdown(wait=True)
+        self.assertEqual(ran, ['new'])
+
+    def test_drop_oldest_releases_lock(self):
+        executor = RefreshExecutor(max_workers=1, max_queue_size=1,
+                                   drop_policy=DROP_OLDEST)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        executor.submit('blocker', lambda: release.wait(5))
+        time.sleep(0.05)
+
+        self.assertTrue(refresh('k1', lambda: None, executor=executor))
+        self.assertTrue(refresh('k2', lambda: None, executor=executor))
+        # k1 was dropped for k2, so it can be refreshed again right away.
+        self.assertTrue(refresh('k1', lambda: None, executor=executor))
+        release.set()
+        executor.shutdown(wait=True)
+
+    def test_caller_runs(self):
+        executor, release, ran = self._blocked_executor(CALLER_RUNS)
+        self.assertTrue(executor.submit('new', lambda: ran.append('new')))
+        self.assertEqual(ran, ['new'])
+        release.set()
+        executor.shutdown(wait=True)
+        self.assertEqual(ran, ['new', 'queued'])
+
+
+class XFetchTest(TestCase):
+    def setUp(self):
+        self._clock, self._random = xfetch.clock, xfetch.random
+        self.now = 1000.0
+        self.rand = 0.5
+        xfetch.clock = lambda: self.now
+        xfetch.random = lambda: self.rand
+
+    def tearDown(self):
+        xfetch.clock, xfetch.random = self._clock, self._random
+
+    def test_should_recompute(self):
+        entry = CacheEntry('val', None, 1010.0, 2.0)
+        # The gap is -2 * log(0.5), about 1.4s.
+        self.assertFalse(xfetch.should_recompute(entry))
+        self.now = 1009.0
+        self.assertTrue(xfetch.should_recompute(entry))
+        self.assertFalse(xfetch.should_recompute(entry, beta=0.5))
+        self.assertFalse(xfetch.should_recompute('plain value'))
+        self.assertFalse(xfetch.should_recompute(CacheEntry('val', None)))
+
+    def test_decorator(self):
+        foo = 10
+
+        @cached_function(key='test_xfetch', timeout=60, xfetch_beta=1.0)
+        def my_func():
+            return foo
+
+        self.assertEqual(my_func(), 10)
+        entry = cache.cache.get(make_key('test_xfetch'))
+        self.assertTrue(entry.compute_time is not None)
+
+        foo = 20
+        self.now = entry.expiry - 3600
+        self.assertEqual(my_func(), 10)
+        self.now = entry.expiry - entry.compute_time * 0.1
+        self.assertEqual(my_func(), 20)
+
+    def test_requires_timeout(self):
+        self.assertRaises(ValueError, cached_function, xfetch_beta=1.0)
+
+
+class CachedNoneTest(TestCase):
+    def test_none_is_cached(self):
+        calls = []
+
+        @cached_function(key='test_cached_none')
+        def my_func():
+            calls.append(1)
+            return None
+
+        self.assertEqual(my_func(), None)
+        self.assertEqual(my_func(), None)
+        self.assertEqual(len(calls), 1)
+
+        my_func.delete_cache()
+        my_func()
+        self.assertEqual(len(calls), 2)
+
+    def test_falsy_values_are_cached(self):
+        for i, falsy in enumerate([0, '', [], False]):
+            foo = falsy
+
+            @cached_function(key=['test_cached_falsy', i])
+            def my_func():
+                return foo
+
+            self.assertEqual(my_func(), falsy)
+            foo = 'truthy'
+            self.assertEqual(my_func(), falsy)
+
+    def test_none_timeout(self):
+        calls = []
+
+        @cached_function(key='test_none_timeout', none_timeout=0)
+        def my_func():
+            calls.append(1)
+            return None
+
+        my_func()
+        my_func()
+        self.assertEqual(len(calls), 2)
+
+    def test_none_with_local_cache(self):
+        l1 = LocalCache()
+        calls = []
+
+        @cached_function(key='test_none_l1', local_cache=l1)
+        def my_func():
+            calls.append(1)
+            return None
+
+        my_func()
+        cache.cache.delete(make_key('test_none_l1'))
+        self.assertEqual(my_func(), None)
+        self.assertEqual(len(calls), 1)
+
+
+class BulkTest(TestCase):
+    def setUp(self):
+        cachecow_cache._namespace_versions.clear()
+
+    def test_get_many(self):
+        calls = []
+
+        @cached_function(namespace='test_bulk_ns')
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertEqual(double(1), 2)
+        with CallCounter() as counter:
+            self.assertEqual(double.get_many([1, 2, (3,)]), [2, 4, 6])
+        self.assertEqual(counter.calls, ['get_many', 'set_many'])
+        self.assertEqual(calls, [1, 2, 3])
+
+        with CallCounter() as counter:
+            self.assertEqual(double.get_many([3, 2, 1]), [6, 4, 2])
+        self.assertEqual(counter.calls, ['get_many'])
+        self.assertEqual(double(2), 4)
+        self.assertEqual(calls, [1, 2, 3])
+
+    def test_get_many_after_invalidation(self):
+        foo = 1
+
+        @cached_function(namespace='test_bulk_invalidation')
+        def multiply(x):
+            return x * foo
+
+        self.assertEqual(multiply.get_many([1, 2]), [1, 2])
+        foo = 10
+        invalidate_namespace('test_bulk_invalidation')
+        cachecow_cache._namespace_versions.clear()
+        self.assertEqual(multiply.get_many([1, 2]), [10, 20])
+
+    def test_batch_func(self):
+        batches = []
+
+        def batch_square(arg_list):
+            batches.append(arg_list)
+            return [x * x for (x,) in arg_list]
+
+        @cached_function()
+        def square(x):
+            raise AssertionError('Should use batch_func.')
+
+        square.warm([1, 2], batch_func=batch_square)
+        self.assertEqual(square.get_many([1, 2, 3], batch_func=batch_square),
+                         [1, 4, 9])
+        self.assertEqual(batches, [[(1,), (2,)], [(3,)]])
+        self.assertEqual(square(3), 9)
+
+
+class AsyncTest(TestCase):
+    async def test_async_function(self):
+        foo = 10
+
+        @cached_function(namespace='test_async_ns')
+        async def my_func(x):
+            return foo + x
+
+        self.assertEqual(await my_func(1), 11)
+        foo = 20
+        self.assertEqual(await my_func(1), 11)
+        invalidate_namespace('test_async_ns')
+        self.assertEqual(await my_func(1), 21)
+
+    async def test_async_single_flight(self):
+        calls = []
+
+        @cached_function(key='test_async_sf', single_flight='local')
+        async def slow_func():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 42
+
+        results = await asyncio.gather(*[slow_func() for _ in range(5)])
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(len(calls), 1)
+
+    async def test_async_view(self):
+        calls = []
+
+        @cached_view(key='test_async_view')
+        async def my_view(request):
+            calls.append(1)
+            return HttpResponse('hello')
+
+        request = RequestFactory().get('/')
+        self.assertEqual((await my_view(request)).content, b'hello')
+        self.assertEqual((await my_view(request)).content, b'hello')
+        self.assertEqual(len(calls), 1)
+
+
+class KeyBuilderTest(TestCase):
+    def test_key_format(self):
+        def my_func(a, b, c=None):
+            pass
+
+        class Model(object):
+            pk = 7
+
+            def my_method(self, a):
+                pass
+
+        build = _make_key_builder(my_func)
+        fingerprint = _func_fingerprint(my_func)
+        for (args, kwargs) in [((1, 'two words'), {}),
+                               ((None, [1, [2, 3]]), {'c': {'x': 1}}),
+                               ((u'\u00e9\t', 2.5), {'c': 'a:b'})]:
+            self.assertEqual(
+                make_key(build(args, kwargs)),
+                make_key(['cached_func', 'my_func'] + list(args)
+                         + list(kwargs.values()) + [fingerprint]))
+
+        build = _make_key_builder(Model.my_method)
+        self.assertEqual(
+            make_key(build((Model(), 'foo'), {})),
+            make_key(['cached_func', 'my_method', 'Model', 7, 'foo',
+                      _func_fingerprint(Model.my_method)]))
+
+    def test_fingerprint_override(self):
+        def my_func(a):
+            pass
+
+        build = _make_key_builder(my_func, fingerprint='v2')
+        self.assertEqual(make_key(build((1,), {})),
+                         make_key(['cached_func', 'my_func', 1, 'v2']))
+
+
+def _fingerprinted(x):
+    def inner():
+        return x in {'a', 'b', 'c', 'd'}
+    return inner
+
+
+class FingerprintTest(TestCase):
+    def test_stable_across_processes(self):
+        script = '''if True:
+            import sys
+            sys.path.insert(0, {path!r})
+            from django.conf import settings
+            settings.configure(INSTALLED_APPS=['cachecow.tests'])
+            import django
+            django.setup()
+            from cachecow.decorators import _func_fingerprint
+            from cachecow.tests.tests import _fingerprinted
+            print(_func_fingerprint(_fingerprinted))
+            '''.format(path=os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))))
+
+        fingerprints = set()
+        for seed in ['1', '2', '3']:
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            fingerprints.add(subprocess.check_output(
+                [sys.executable, '-c', script], env=env).strip().decode())
+        self.assertEqual(fingerprints, set([_func_fingerprint(_fingerprinted)]))
+
+    def test_changes_with_code(self):
+        def my_func():
+            return 1
+        a = _func_fingerprint(my_func)
+
+        def my_func():
+            return 2
+        self.assertNotEqual(a, _func_fingerprint(my_func))
+
+    def test_pinned_fingerprint(self):
+        @cached_function(fingerprint='v1')
+        def my_func():
+            return 1
+        self.assertEqual(my_func(), 1)
+
+        @cached_function(fingerprint='v1')
+        def my_func():
+            return 2
+        self.assertEqual(my_func(), 1)
+
+
+class CodecTest(TestCase):
+    def test_compression(self):
+        codec = Codec(compress_threshold=100)
+        small, big = 'x' * 10, 'x' * 10000
+        self.assertTrue(len(codec.dumps(big)) < 1000)
+        self.assertEqual(codec.loads(codec.dumps(big)), big)
+        self.assertEqual(codec.loads(codec.dumps(small)), small)
+
+    def test_decorator(self):
+        codec = Codec(compress_threshold=100)
+        foo = {'a': 'x' * 10000}
+
+        @cached_function(key='test_codec', codec=codec)
+        def my_func():
+            return foo
+
+        self.assertEqual(my_func(), foo)
+        stored = cache.cache.get(make_key('test_codec'))
+        self.assertTrue(isinstance(stored, bytes) and len(stored) < 1000)
+        self.assertEqual(my_func(), {'a': 'x' * 10000})
+
+    def test_chunking(self):
+        codec = Codec(compress_threshold=None, chunk_size=1000)
+        calls = []
+
+        @cached_function(key='test_codec_chunks', codec=codec)
+        def my_func():
+            calls.append(1)
+            return 'y' * 5000
+
+        self.assertEqual(my_func(), 'y' * 5000)
+        manifest = cache.cache.get(make_key('test_codec_chunks'))
+        self.assertTrue(isinstance(manifest, ChunkManifest))
+        self.assertEqual(manifest.count, 6)
+        self.assertEqual(my_func(), 'y' * 5000)
+        self.assertEqual(len(calls), 1)
+
+        # A missing chunk makes it a miss.
+        chunk_key = make_key([make_key('test_codec_chunks'), 'chunk',
+                              manifest.nonce, 3])
+        cache.cache.delete(chunk_key)
+        self.assertEqual(my_func(), 'y' * 5000)
+        self.assertEqual(len(calls), 2)
+
+    def test_cached_view(self):
+        @cached_view(key='test_codec_view', codec=Codec(compress_threshold=10))
+        def my_view(request):
+            return HttpResponse('hello ' * 100)
+
+        request = RequestFactory().get('/')
+        my_view(request)
+        self.assertTrue(isinstance(
+            cache.cache.get(make_key('test_codec_view')), bytes))
+        self.assertEqual(my_view(request).content, b'hello ' * 100)
+
+
+class SerializerTest(TestCase):
+    def test_round_trips(self):
+        val = {'a': [1, 2.5, None, True], 'b': 'c'}
+        for name in ['pickle', 'marshal', 'json']:
+            codec = Codec(serializer=name)
+            self.assertEqual(codec.loads(codec.dumps(val)), val)
+
+    def test_pickle_out_of_band_buffers(self):
+        codec = Codec(compress_threshold=None)
+        val = [bytearray(b'x' * 10000), 'y']
+        self.assertEqual(codec.loads(codec.dumps(val)), val)
+
+    def test_reads_back_with_writing_serializer(self):
+        # Payloads record which serializer wrote them.
+        payload = Codec(serializer='marshal').dumps((1, 2))
+        self.assertEqual(Codec(serializer='json').loads(payload), (1, 2))
+
+    def test_custom_serializer(self):
+        serializer = get_serializer('cachecow.serializers.JSONSerializer')
+        self.assertEqual(serializer.tag, b'j')
+
+    def test_codec_memoized_for_dotted_path(self):
+        path = 'cachecow.serializers.JSONSerializer'
+        codec = get_codec(path)
+        size = len(codec_module._codecs)
+        self.assertTrue(get_codec(path) is codec)
+        self.assertEqual(len(codec_module._codecs), size)
+
+    def test_decorator(self):
+        @cached_function(key='test_serializer', serializer='json')
+        def my_func():
+            return {'a': (1, 2)}
+
+        self.assertEqual(my_func(), {'a': (1, 2)})
+        stored = cache.cache.get(make_key('test_serializer'))
+        self.assertTrue(isinstance(stored, bytes))
+        # JSON turns tuples into lists.
+        self.assertEqual(my_func(), {'a': [1, 2]})
+
+    @override_settings(CACHECOW_SERIALIZER='marshal')
+    def test_setting(self):
+        @cached_function(key='test_serializer_setting')
+        def my_func():
+            return [1, 2]
+
+        my_func()
+        stored = cache.cache.get(make_key('test_serializer_setting'))
+        self.assertEqual(Codec(serializer='marshal').loads(stored), [1, 2])
+        self.assertEqual(my_func(), [1, 2])
+
+
+def _make_counting_view(make_response, **kwargs):
+    '''
+    Returns a `cached_view` decorated with `kwargs` which returns
+    `make_response()`, and a list it appends to each time it's called.
+    '''
+    calls = []
+
+    @cached_view(**kwargs)
+    def my_view(request):
+        calls.append(1)
+        return make_response()
+    return my_view, calls
+
+
+def _json_response():
+    response = HttpResponse('{"a": 1}', status=200,
+                            content_type='application/json')
+    response['Set-Cookie'] = 'secret'
+    return response
+
+
+def _csv_stream():
+    return StreamingHttpResponse(iter(['a,b\n', '1,2\n', '3,4\n']),
+                                 content_type='text/csv')
+
+
+class FullResponseTest(TestCase):
+    def make_view(self, key, **kwargs):
+        return _make_counting_view(_json_response, key=key,
+                                   full_response=True, **kwargs)
+
+    def test_keeps_headers(self):
+        my_view, calls = self.make_view('test_full_response')
+        first = my_view(RequestFactory().get('/'))
+        self.assertTrue(first.has_header('ETag'))
+        response = my_view(RequestFactory().get('/'))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, b'{"a": 1}')
+        self.assertEqual(response['ETag'], first['ETag'])
+        self.assertFalse(response.has_header('Set-Cookie'))
+
+    def test_if_none_match(self):
+        my_view, calls = self.make_view('test_full_response_etag')
+        etag = my_view(RequestFactory().get('/'))['ETag']
+        response = my_view(RequestFactory().get(
+            '/', HTTP_IF_NONE_MATCH='W/' + etag))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = my_view(RequestFactory().get(
+            '/', HTTP_IF_NONE_MATCH='"other"'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 1)
+
+    def test_if_modified_since(self):
+        my_view, calls = self.make_view('test_full_response_ims')
+        last_modified = my_view(RequestFactory().get('/'))['Last-Modified']
+        response = my_view(RequestFactory().get(
+            '/', HTTP_IF_MODIFIED_SINCE=last_modified))
+        self.assertEqual(response.status_code, 304)
+        response = my_view(RequestFactory().get(
+            '/', HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 1970 00:00:00 GMT'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_skips_chunks(self):
+        codec = Codec(compress_threshold=None, chunk_size=2)
+        my_view, calls = self.make_view('test_full_response_chunks',
+                                        codec=codec)
+        etag = my_view(RequestFactory().get('/'))['ETag']
+        with CallCounter() as counter:
+            response = my_view(RequestFactory().get(
+                '/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        # Just the read of the response itself, not its chunks.
+        self.assertEqual(counter.calls, ['get'])
+
+        response = my_view(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'{"a": 1}')
+        self.assertEqual(len(calls), 1)
+
+    def test_local_cache(self):
+        my_view, calls = self.make_view('test_full_response_l1',
+                                        local_cache=LocalCache())
+        my_view(RequestFactory().get('/'))
+        with CallCounter() as counter:
+            response = my_view(RequestFactory().get('/'))
+        self.assertEqual(counter.calls, [])
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+_early_view_calls = []
+
+
+@cached_view(early=True, full_response=True)
+def _early_view(request, slug):
+    _early_view_calls.append(slug)
+    return HttpResponse(slug)
+
+
+@login_required
+@cached_view(key='test_early_secret', early=True, full_response=True,
+             request_gatekeeper=lambda request: True)
+def _secret_view(request):
+    return HttpResponse('top secret')
+
+
+urlpatterns = [
+    path('early/<slug>/', _early_view),
+    path('secret/', _secret_view),
+]
+
+
+class _User(object):
+    def __init__(self, id):
+        self.id = id
+        self.is_authenticated = id is not None
+
+
+class AddUserToKeyTest(TestCase):
+    def setUp(self):
+        cache.cache.clear()
+
+    def test_keyed_by_user(self):
+        calls = []
+
+        @cached_view(key='test_user_key', add_user_to_key=True)
+        def my_view(request):
+            calls.append(1)
+            return HttpResponse(str(getattr(request.user, 'id', None)))
+
+        def get(user):
+            request = RequestFactory().get('/')
+            request.user = user
+            return my_view(request).content
+
+        self.assertEqual(get(_User(1)), b'1')
+        self.assertEqual(get(_User(2)), b'2')
+        self.assertEqual(get(_User(None)), b'None')
+        self.assertEqual(get(_User(1)), b'1')
+        self.assertEqual(len(calls), 3)
+
+        my_view.delete_cache(user=_User(1))
+        self.assertEqual(get(_User(1)), b'1')
+        self.assertEqual(get(_User(2)), b'2')
+        self.assertEqual(len(calls), 4)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class CacheMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.cache.clear()
+        del _early_view_calls[:]
+        self.passed_through = []
+
+        def get_response(request):
+            self.passed_through.append(request)
+            return _early_view(request, 'a')
+        self.middleware = CacheMiddleware(get_response)
+
+    def test_serves_hits_early(self):
+        request = RequestFactory().get('/early/a/')
+        self.assertEqual(self.middleware(request).content, b'a')
+        self.assertEqual(len(self.passed_through), 1)
+
+        with CallCounter() as counter:
+            response = self.middleware(RequestFactory().get('/early/a/'))
+        self.assertEqual(response.content, b'a')
+        self.assertEqual(counter.calls, ['get'])
+        self.assertEqual(len(self.passed_through), 1)
+        self.assertEqual(_early_view_calls, ['a'])
+
+    def test_conditional(self):
+        etag = self.middleware(RequestFactory().get('/early/a/'))['ETag']
+        response = self.middleware(RequestFactory().get(
+            '/early/a/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(self.passed_through), 1)
+
+    def test_passes_through_with_session(self):
+        self.middleware(RequestFactory().get('/early/a/'))
+        request = RequestFactory().get('/early/a/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'abc'
+        self.middleware(request)
+        self.assertEqual(len(self.passed_through), 2)
+
+    def test_passes_through_unknown_urls(self):
+        self.middleware(RequestFactory().get('/elsewhere/'))
+        self.assertEqual(len(self.passed_through), 1)
+
+    def test_passes_through_decorated_views(self):
+        middleware = CacheMiddleware(_secret_view)
+        request = RequestFactory().get('/secret/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'abc'
+        request.user = _User(1)
+        self.assertEqual(middleware(request).content, b'top secret')
+
+        request = RequestFactory().get('/secret/')
+        request.user = _User(None)
+        response = middleware(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertNotEqual(response.content, b'top secret')
+
+
+@override_settings(CACHECOW_STREAM_CHUNK_SIZE=4)
+class StreamingTest(TestCase):
+    def make_view(self, key):
+        return _make_counting_view(_csv_stream, key=key)
+
+    def test_stream_is_cached(self):
+        my_view, calls = self.make_view('test_stream')
+        response = my_view(RequestFactory().get('/'))
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'a,b\n1,2\n3,4\n')
+
+        response = my_view(RequestFactory().get('/'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Length'], '12')
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'a,b\n1,2\n3,4\n')
+        self.assertEqual(len(calls), 1)
+
+    def test_unfinished_stream_isnt_cached(self):
+        my_view, calls = self.make_view('test_stream_unfinished')
+        next(iter(my_view(RequestFactory().get('/')).streaming_content))
+        my_view(RequestFactory().get('/'))
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(CACHECOW_STREAM_MAX_SIZE=8)
+    def test_max_size(self):
+        my_view, calls = self.make_view('test_stream_max_size')
+        b''.join(my_view(RequestFactory().get('/')).streaming_content)
+        my_view(RequestFactory().get('/'))
+        self.assertEqual(len(calls), 2)
+
+    def test_missing_chunk(self):
+        my_view, calls = self.make_view('test_stream_missing')
+        b''.join(my_view(RequestFactory().get('/')).streaming_content)
+        stream = cache.cache.get(make_key('test_stream_missing'))
+        cache.cache.delete(make_key([make_key('test_stream_missing'),
+                                     'stream', stream.nonce, 0]))
+        response = my_view(RequestFactory().get('/'))
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'a,b\n1,2\n3,4\n')
+        self.assertEqual(len(calls), 2)
+
+    async def test_async_stream(self):
+        calls = []
+
+        async def content():
+            for row in ['a,b\n', '1,2\n']:
+                yield row
+
+        @cached_view(key='test_async_stream')
+        async def my_view(request):
+            calls.append(1)
+            return StreamingHttpResponse(content())
+
+        async def read(response):
+            return b''.join([chunk async for chunk in
+                             response.streaming_content])
+
+        request = RequestFactory().get('/')
+        self.assertEqual(await read(await my_view(request)), b'a,b\n1,2\n')
+        self.assertEqual(await read(await my_view(request)), b'a,b\n1,2\n')
+        self.assertEqual(len(calls), 1)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.sink = metrics.InMemorySink()
+        metrics.set_sink(self.sink)
+
+    def tearDown(self):
+        metrics.set_sink(None)
+
+    def test_publishes_in_background(self):
+        sink = metrics.InMemorySink(flush_interval=0.05)
+        self.addCleanup(sink.stop)
+        with CallCounter() as counter:
+            sink.incr('test_background', metrics.HITS)
+            sink.observe('test_background', metrics.GET_TIME, 0.001)
+        self.assertEqual(counter.calls, [])
+
+        deadline = time.monotonic() + 5
+        while ('test_background' not in metrics.load_published()
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(
+            metrics.load_published()['test_background'][metrics.HITS], 1)
+
+    def test_function_metrics(self):
+        @cached_function(key='test_metrics')
+        def my_func():
+            return 'x' * 100
+
+        my_func()
+        my_func()
+        name = my_func.__module__ + '.' + my_func.__qualname__
+        m = self.sink.snapshot()[name]
+        self.assertEqual((m['hits'], m['misses'], m['sets'], m['errors']),
+                         (1, 1, 1, 0))
+        self.assertEqual(m['get_time']['count'], 2)
+        self.assertEqual(m['compute_time']['count'], 1)
+        self.assertEqual(m['value_size']['buckets'], [0, 1, 0, 0, 0, 0])
+
+    def test_uncached_values_are_not_sets(self):
+        @cached_function(key='test_metrics_none', none_timeout=0)
+        def my_func():
+            return None
+
+        my_func()
+        name = my_func.__module__ + '.' + my_func.__qualname__
+        m = self.sink.snapshot()[name]
+        self.assertEqual((m['misses'], m['sets']), (1, 0))
+        self.assertEqual(m['value_size']['count'], 0)
+
+    def test_errors(self):
+        @cached_function(key='test_metrics_errors')
+        def my_func():
+            raise ValueError
+
+        self.assertRaises(ValueError, my_func)
+        name = my_func.__module__ + '.' + my_func.__qualname__
+        self.assertEqual(self.sink.snapshot()[name]['errors'], 1)
+
+    def test_view_metrics(self):
+        @cached_view(key='test_metrics_view')
+        def my_view(request):
+            return HttpResponse('hello')
+
+        my_view(RequestFactory().get('/'))
+        my_view(RequestFactory().get('/'))
+        name = my_view.__module__ + '.' + my_view.__qualname__
+        m = self.sink.snapshot()[name]
+        self.assertEqual((m['hits'], m['misses'], m['sets']), (1, 1, 1))
+        self.assertEqual(m['value_size']['sum'], 5)
+
+    def test_callback_sink(self):
+        stats = []
+        metrics.set_sink(metrics.CallbackSink(
+            lambda *args: stats.append(args)))
+
+        @cached_function(key='test_metrics_callback')
+        def my_func():
+            return 1
+
+        my_func()
+        kinds = dict((stat.rsplit('.', 1)[1], kind)
+                     for (stat, _, kind) in stats)
+        self.assertEqual(kinds['misses'], 'c')
+        self.assertEqual(kinds['compute_time'], 'ms')
+        self.assertEqual(kinds['value_size'], 'h')
+
+    def test_published(self):
+        self.sink.incr('a.b', metrics.HITS, 2)
+        self.sink.flush()
+        other = metrics.InMemorySink()
+        other.incr('a.b', metrics.HITS)
+        other.observe('a.b', metrics.GET_TIME, 0.002)
+        other.flush()
+        published = metrics.load_published()
+        self.assertEqual(published['a.b']['hits'], 3)
+        self.assertEqual(published['a.b']['get_time']['count'], 1)
+
+        out = StringIO()
+        call_command('cachecow_metrics', stdout=out)
+        self.assertTrue('a.b' in out.getvalue())
+
+
+class NestedNamespaceTest(TestCase):
+    def setUp(self):
+        cachecow_cache._namespace_versions.clear()
+
+    def test_parent_invalidates_children(self):
+        foo = 10
+        reports = Namespace('test_nested', 42, 'reports')
+
+        @cached_function(namespace=reports.child(2026))
+        def my_func():
+            return foo
+
+        @cached_function(namespace=Namespace('test_nested', 43))
+        def other_tenant():
+            return foo
+
+        self.assertEqual(my_func(), 10)
+        self.assertEqual(other_tenant(), 10)
+        foo = 20
+        invalidate_namespace(reports.child(2025))
+        self.assertEqual(my_func(), 10)
+        invalidate_namespace(['test_nested', 42])
+        self.assertEqual(my_func(), 20)
+        self.assertEqual(other_tenant(), 10)
+
+    def test_single_round_trip(self):
+        @cached_function(namespace=lambda x: Namespace('test_nested_rt', x,
+                                                       'a', 'b'))
+        def my_func(x):
+            return x
+
+        my_func(1)
+        with CallCounter() as counter:
+            self.assertEqual(my_func(1), 1)
+        self.assertEqual(counter.calls, ['get_many'])
+
+    def test_top_level_matches_flat_namespace(self):
+        self.assertEqual(make_key('x', namespace=Namespace('test_nested_flat')),
+                         make_key('x', namespace='test_nested_flat'))
+
+    def test_invalidation_clears_local_cache(self):
+        l1 = LocalCache()
+
+        @cached_function(namespace=Namespace('test_nested_l1', 'child'),
+                         local_cache=l1)
+        def my_func():
+            return 1
+
+        my_func()
+        self.assertEqual(len(l1), 1)
+        invalidate_namespace('test_nested_l1')
+        self.assertEqual(len(l1), 0)
+
+
+class TagTest(TestCase):
+    def test_invalidate_any_tag(self):
+        foo = 10
+
+        @cached_function(tags=lambda user_id, product_id: [
+            ['user', user_id], ['product', product_id]])
+        def my_func(user_id, product_id):
+            return foo
+
+        self.assertEqual(my_func(7, 99), 10)
+        self.assertEqual(my_func(8, 99), 10)
+        foo = 20
+        invalidate_tag(['user', 7])
+        self.assertEqual(my_func(7, 99), 20)
+        self.assertEqual(my_func(8, 99), 10)
+        foo = 30
+        invalidate_tag(['product', 99])
+        self.assertEqual(my_func(7, 99), 30)
+        self.assertEqual(my_func(8, 99), 30)
+
+    def test_single_round_trip(self):
+        @cached_function(tags=['test_tag_rt_a', 'test_tag_rt_b'])
+        def my_func(x):
+            return x
+
+        my_func(1)
+        with CallCounter() as counter:
+            self.assertEqual(my_func(1), 1)
+        self.assertEqual(counter.calls, ['get_many'])
+
+    def test_invalidated_while_computing(self):
+        key, val = lookup_cache('test_tag_race', tags=['test_tag_race'])
+        self.assertEqual(val, None)
+        invalidate_tag('test_tag_race')
+        set_cache(key, 'stale')
+        self.assertEqual(
+            lookup_cache('test_tag_race', tags=['test_tag_race'])[1], None)
+
+    def test_untagged_value(self):
+        set_cache(make_key('test_tag_untagged'), 'val')
+        self.assertEqual(lookup_cache('test_tag_untagged',
+                                      tags=['test_tag_untagged'])[1], None)
+
+    def test_invalidation_clears_local_cache(self):
+        l1 = LocalCache()
+
+        @cached_function(tags=['test_tag_l1'], local_cache=l1)
+        def my_func():
+            return 1
+
+        my_func()
+        self.assertEqual(len(l1), 1)
+        invalidate_tag('test_tag_l1')
+        self.assertEqual(len(l1), 0)
+
+
+class WriteBehindTest(TestCase):
+    def setUp(self):
+        # Long enough that only the tests flush.
+        self.queue = WriteBehindQueue(flush_interval=60)
+
+    def tearDown(self):
+        self.queue.shutdown()
+        metrics.set_sink(None)
+
+    def test_set_on_flush(self):
+        calls = []
+
+        @cached_function(key='test_wb', write_behind=self.queue)
+        def my_func():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(my_func(), 1)
+        self.assertEqual(my_func(), 2)
+        self.queue.flush()
+        self.assertEqual(my_func(), 2)
+
+    def test_delete_drops_queued_write(self):
+        calls = []
+
+        @cached_function(key='test_wb_delete', write_behind=self.queue)
+        def my_func():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(my_func(), 1)
+        my_func.delete_cache()
+        self.queue.flush()
+        self.assertEqual(cache.cache.get(make_key('test_wb_delete')), None)
+        self.assertEqual(my_func(), 2)
+
+    def test_client_delete_drops_queued_write(self):
+        key = make_key('test_wb_client_delete')
+        self.queue.submit(key, lambda: ({key: 'stale'}, 60))
+        client.delete('test_wb_client_delete')
+        self.queue.flush()
+        self.assertEqual(client.get('test_wb_client_delete'), None)
+
+    def test_coalesces_and_batches(self):
+        @cached_function(write_behind=self.queue)
+        def my_func(x):
+            return x
+
+        for x in range(3):
+            my_func(x)
+        my_func.get_many([0, 3, 4])
+        with CallCounter() as counter:
+            self.queue.flush()
+        self.assertEqual(counter.calls, ['set_many'])
+        with CallCounter() as counter:
+            self.assertEqual(my_func.get_many(range(5)), list(range(5)))
+        self.assertEqual(counter.calls, ['get_many'])
+
+    def test_cached_view(self):
+        @cached_view(full_response=True, codec=Codec(chunk_size=10),
+                     write_behind=self.queue)
+        def my_view(request):
+            return HttpResponse('x' * 100)
+
+        request = RequestFactory().get('/wb/')
+        etag = my_view(request)['ETag']
+        self.queue.flush()
+        resp = my_view(RequestFactory().get('/wb/',
+                                            HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(my_view(request).content, b'x' * 100)
+
+    def test_dropped_writes(self):
+        sink = metrics.InMemorySink()
+        metrics.set_sink(sink)
+        queue = WriteBehindQueue(max_size=1, flush_interval=60)
+
+        @cached_function(write_behind=queue)
+        def my_func(x):
+            return x
+
+        my_func(1)
+        my_func(2)
+        queue.shutdown()
+        name = my_func.__module__ + '.' + my_func.__qualname__
+        self.assertEqual(sink.snapshot()[name]['dropped'], 1)
+        self.assertEqual(sink.snapshot()[name]['sets'], 1)
+        self.assertEqual(my_func.get_many([1, 2]), [1, 2])
+
+    def test_single_flight_shares_value(self):
+        calls = []
+        release = threading.Event()
+
+        @cached_function(key='test_wb_single_flight', single_flight='local',
+                         write_behind=self.queue)
+        def slow_func():
+            calls.append(1)
+            release.wait(5)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow_func()))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(cache.cache.get(make_key('test_wb_single_flight')))
+
+    def test_worker_flushes(self):
+        queue = WriteBehindQueue(flush_interval=0.01)
+        queue.submit('test_wb_worker',
+                     lambda: ({'test_wb_worker': 'val'}, None))
+        queue.shutdown()
+        self.assertEqual(cache.cache.get('test_wb_worker'), 'val')
+
+
+class RequestCacheTest(TestCase):
+    def setUp(self):
+        cachecow_cache._namespace_versions.clear()
+
+    def test_memoizes_lookups(self):
+        @cached_function(namespace='test_rc_ns')
+        def my_func(x):
+            return x
+
+        @cached_function(namespace='test_rc_ns')
+        def other_func(x):
+            return -x
+
+        my_func(1)
+        other_func(1)
+        with request_cache():
+            with CallCounter() as counter:
+                self.assertEqual(my_func(1), 1)
+                self.assertEqual(other_func(1), -1)
+                self.assertEqual(my_func(1), 1)
+        self.assertEqual(counter.calls, ['get_many', 'get'])
+
+    def test_prefetch(self):
+        @cached_function(namespace='test_rc_prefetch')
+        def my_func(x):
+            return x
+
+        @cached_function(tags=['test_rc_tag'])
+        def other_func(x, y=0):
+            return x + y
+
+        my_func(1)
+        other_func(2, y=3)
+        with request_cache():
+            with CallCounter() as counter:
+                prefetch([(my_func, (1,)), (other_func, (2,), {'y': 3})])
+                self.assertEqual(my_func(1), 1)
+                self.assertEqual(other_func(2, y=3), 5)
+        self.assertEqual(counter.calls, ['get_many'])
+
+    def test_sets_and_invalidations_within_request(self):
+        foo = 10
+
+        @cached_function(namespace='test_rc_inv', tags=['test_rc_inv_tag'])
+        def my_func():
+            return foo
+
+        with request_cache():
+            self.assertEqual(my_func(), 10)
+            with CallCounter() as counter:
+                self.assertEqual(my_func(), 10)
+            self.assertEqual(counter.calls, [])
+            foo = 20
+            invalidate_namespace('test_rc_inv')
+            self.assertEqual(my_func(), 20)
+            foo = 30
+            invalidate_tag('test_rc_inv_tag')
+            self.assertEqual(my_func(), 30)
+            foo = 40
+            my_func.delete_cache()
+            self.assertEqual(my_func(), 40)
+
+    def test_scoped_to_request(self):
+        foo = 10
+
+        @cached_function(namespace='test_rc_scope')
+        def my_func():
+            return foo
+
+        with request_cache():
+            my_func()
+        foo = 20
+        # As if by another process.
+        cache.cache.incr(make_key('test_rc_scope'))
+        with request_cache():
+            self.assertEqual(my_func(), 20)
+
+    def test_middleware(self):
+        @cached_function(key='test_rc_middleware')
+        def my_func():
+            return 1
+
+        my_func()
+
+        def view(request):
+            with CallCounter() as counter:
+                my_func()
+                my_func()
+            return HttpResponse(str(len(counter.calls)))
+
+        resp = RequestCacheMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(resp.content, b'1')
+
+
+@cached_function(warm_args=lambda: range(10))
+def _warmed_function(x):
+    return x * 2
+
+
+class WarmTest(TestCase):
+    name = __name__ + '._warmed_function'
+
+    def setUp(self):
+        cache.cache.clear()
+
+    def test_registered(self):
+        names = [registered.name for registered in get_registered([__name__])]
+        self.assertTrue(self.name in names)
+
+    def test_warm_batch_skips_cached(self):
+        _warmed_function(1)
+        self.assertEqual(warm_batch(self.name, [(1,), (2,), (3,)]), (2, 1))
+        with CallCounter() as counter:
+            self.assertEqual(_warmed_function.get_many([1, 2, 3]), [2, 4, 6])
+        self.assertEqual(counter.calls, ['get_many'])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        self.assertTrue(time.monotonic() - start >= 0.05)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('cachecow_warm', self.name, workers=2, batch_size=3,
+                     stdout=out)
+        self.assertTrue('10/10' in out.getvalue())
+        with CallCounter() as counter:
+            self.assertEqual(_warmed_function.get_many(range(10)),
+                             [x * 2 for x in range(10)])
+        self.assertEqual(counter.calls, ['get_many'])
+
+        out = StringIO()
+        call_command('cachecow_warm', self.name, stdout=out)
+        self.assertTrue('0 computed, 10 already cached' in out.getvalue())
+
+
+class ClientTest(TestCase):
+    def setUp(self):
+        cache.cache.clear()
+        cachecow_cache._namespace_versions.clear()
+
+    def test_round_trip(self):
+        client.set('a', 1)
+        self.assertEqual(client.get('a'), 1)
+        self.assertEqual(client.get('missing', 'default'), 'default')
+        self.assertEqual(client.get(['a']), 1)
+        client.set(['b', 2], 'list key', namespace='client_ns')
+        self.assertEqual(client.get(['b', 2], namespace='client_ns'),
+                         'list key')
+        self.assertTrue(client.delete('a'))
+        self.assertEqual(client.get('a'), None)
+
+    def test_namespaces(self):
+        ns = Namespace('client_tenant', 'stats')
+        client.set_many({'a': 1, 'b': 2}, namespace=ns)
+        client.set('a', 'flat')
+        self.assertEqual(client.get_many(['a', 'b', 'c'], namespace=ns),
+                         {'a': 1, 'b': 2})
+        self.assertEqual(client.get('a'), 'flat')
+
+        invalidate_namespace('client_tenant')
+        self.assertEqual(client.get_many(['a', 'b'], namespace=ns), {})
+        self.assertEqual(client.get('a'), 'flat')
+
+    def test_batch_round_trips(self):
+        ns = Namespace('client_rt', 'inner')
+        client.set('x', 0, namespace=ns)
+        cachecow_cache._namespace_versions.clear()
+
+        with CallCounter() as counter:
+            client.set_many(dict((i, i) for i in range(20)), namespace=ns)
+        self.assertEqual(counter.calls, ['get_many', 'set_many'])
+
+        # The versions just seen are checked along with the values.
+        with CallCounter() as counter:
+            self.assertEqual(len(client.get_many(range(20), namespace=ns)), 20)
+        self.assertEqual(counter.calls, ['get_many'])
+
+        with CallCounter() as counter:
+            client.delete_many(range(20), namespace=ns)
+        self.assertEqual(counter.calls, ['get_many', 'delete_many'])
+        self.assertEqual(client.get_many(range(20), namespace=ns), {})
+
+    def test_add_and_incr(self):
+        self.assertTrue(client.add('n', 1, namespace='client_incr'))
+        self.assertFalse(client.add('n', 5, namespace='client_incr'))
+        self.assertEqual(client.incr('n', 2, namespace='client_incr'), 3)
+        self.assertEqual(client.get('n', namespace='client_incr'), 3)
+        self.assertRaises(ValueError, client.incr, 'missing',
+                          namespace='client_incr')
+
+    def test_timedelta_timeout(self):
+        client.set('t', 1, timeout=timedelta(seconds=60), namespace='client_t')
+        self.assertEqual(client.get('t', namespace='client_t'), 1)
+
+    def test_request_cache(self):
+        with request_cache():
+            client.set('r', 1, namespace='client_rc')
+            self.assertEqual(client.get('r', namespace='client_rc'), 1)
+            client.incr('r', namespace='client_rc')
+            self.assertEqual(client.get('r', namespace='client_rc'), 2)
+            client.delete('r', namespace='client_rc')
+            self.assertEqual(client.get('r', namespace='client_rc'), None)
+
+
+class _PropertyModel(object):
+    computed = 0
+
+    def __init__(self, pk):
+        self.pk = pk
+
+    @cached_property
+    def plain(self):
+        _PropertyModel.computed += 1
+        return self.pk * 10
+
+    @cached_property(namespace=lambda self: ['prop_ns', self.pk % 2])
+    def namespaced(self):
+        _PropertyModel.computed += 1
+        return self.pk * 100
+
+
+class CachedPropertyTest(TestCase):
+    def setUp(self):
+        cache.cache.clear()
+        _PropertyModel.computed = 0
+
+    def test_memoized_per_instance(self):
+        obj = _PropertyModel(1)
+        self.assertEqual(obj.plain, 10)
+        with CallCounter() as counter:
+            self.assertEqual(obj.plain, 10)
+        self.assertEqual(counter.calls, [])
+
+        # Other instances with the same pk share the cached value.
+        with CallCounter() as counter:
+            self.assertEqual(_PropertyModel(1).plain, 10)
+        self.assertEqual(counter.calls, ['get'])
+        self.assertEqual(_PropertyModel.computed, 1)
+        self.assertEqual(_PropertyModel(2).plain, 20)
+        self.assertEqual(_PropertyModel.computed, 2)
+
+    def test_del_forgets_memo(self):
+        obj = _PropertyModel(1)
+        obj.plain
+        del obj.plain
+        self.assertEqual(obj.plain, 10)
+        self.assertEqual(_PropertyModel.computed, 1)
+
+    def test_delete_cache(self):
+        obj = _PropertyModel(1)
+        obj.plain
+        _PropertyModel.plain.delete_cache(obj)
+        self.assertFalse('plain' in obj.__dict__)
+        self.assertEqual(obj.plain, 10)
+        self.assertEqual(_PropertyModel.computed, 2)
+
+    def test_namespace(self):
+        objs = [_PropertyModel(pk) for pk in range(4)]
+        self.assertEqual([obj.namespaced for obj in objs], [0, 100, 200, 300])
+        invalidate_namespace(['prop_ns', 1])
+        fresh = [_PropertyModel(pk) for pk in range(4)]
+        self.assertEqual([obj.namespaced for obj in fresh], [0, 100, 200, 300])
+        self.assertEqual(_PropertyModel.computed, 6)
+
+    def test_preload(self):
+        # Both namespaces' versions are seen, and checked along with values.
+        _PropertyModel(0).namespaced
+        _PropertyModel(1).namespaced
+        objs = [_PropertyModel(pk) for pk in range(6)]
+        with CallCounter() as counter:
+            _PropertyModel.namespaced.preload(objs)
+        self.assertEqual(counter.calls, ['get_many', 'set_many'])
+        self.assertEqual(_PropertyModel.computed, 6)
+
+        with CallCounter() as counter:
+            self.assertEqual([obj.namespaced for obj in objs],
+                             [pk * 100 for pk in range(6)])
+            _PropertyModel.namespaced.preload(objs)
+        self.assertEqual(counter.calls, [])
+
+        fresh = [_PropertyModel(pk) for pk in range(6)]
+        with CallCounter() as counter:
+            _PropertyModel.namespaced.preload(fresh)
+        self.assertEqual(counter.calls, ['get_many'])
+        self.assertEqual(_PropertyModel.computed, 6)
+
+
+class SignalInvalidationTest(TestCase):
+    def setUp(self):
+        cache.cache.clear()
+        cachecow_cache._namespace_versions.clear()
+        bind_namespaces(Book, ['books', lambda book: ['book', book.pk]])
+        bind_namespaces(Author, [lambda author: ['author', author.pk]])
+
+    def tearDown(self):
+        unbind_namespaces(Book)
+        unbind_namespaces(Author)
+
+    def _version(self, namespace):
+        return cache.cache.get(make_key(namespace))
+
+    def _init(self, *namespaces):
+        for namespace in namespaces:
+            make_key('x', namespace=namespace)
+        return [self._version(namespace) for namespace in namespaces]
+
+    def test_save_and_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title='a')
+        before = self._init('books', ['book', book.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.title = 'b'
+            book.save()
+            # Nothing is invalidated until the transaction commits.
+            self.assertEqual(self._init('books', ['book', book.pk]), before)
+        after = [self._version('books'), self._version(['book', book.pk])]
+        self.assertNotEqual(after[0], before[0])
+        self.assertNotEqual(after[1], before[1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertNotEqual(self._version('books'), after[0])
+
+    def test_coalesced(self):
+        books = [Book.objects.create(title=str(i)) for i in range(5)]
+        self._init('books', *[['book', book.pk] for book in books])
+
+        with CallCounter() as counter:
+            with self.captureOnCommitCallbacks(execute=True):
+                for book in books:
+                    book.save()
+                    book.save()
+        # One for the shared namespace, and one for each book's own.
+        self.assertEqual(counter.calls, ['incr'] * 6)
+
+    def test_cached_function(self):
+        @cached_function(namespace=lambda pk: ['book', pk])
+        def title(pk):
+            return Book.objects.get(pk=pk).title
+
+        book = Book.objects.create(title='old')
+        self.assertEqual(title(book.pk), 'old')
+        with self.captureOnCommitCallbacks(execute=True):
+            book.title = 'new'
+            book.save()
+        self.assertEqual(title(book.pk), 'new')
+
+    def test_m2m(self):
+        book = Book.objects.create(title='a')
+        author = Author.objects.create(name='x')
+        versions = self._init(['book', book.pk], ['author', author.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.authors.add(author)
+        self.assertNotEqual(self._version(['book', book.pk]), versions[0])
+        self.assertNotEqual(self._version(['author', author.pk]), versions[1])
+
+        versions = self._init(['book', book.pk], ['author', author.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            author.books.clear()
+        self.assertNotEqual(self._version(['book', book.pk]), versions[0])
+        self.assertNotEqual(self._version(['author', author.pk]), versions[1])
+
+        versions = self._init(['book', book.pk], ['author', author.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            author.books.add(book)
+        self.assertNotEqual(self._version(['book', book.pk]), versions[0])
+        self.assertNotEqual(self._version(['author', author.pk]), versions[1])
+
+        versions = self._init(['author', author.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            book.authors.clear()
+        self.assertNotEqual(self._version(['author', author.pk]), versions[0])
+
+    def test_unbind(self):
+        unbind_namespaces(Book)
+        before = self._init('books')
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='a')
+        self.assertEqual(self._version('books'), before[0])
+
 
 #class CachedViewTest(TestCase):
     
@@ -0,0 +1,265 @@
+'''
+Write-behind caching: setting values from a background thread.
+
+Normally `cached_function` and `cached_view` set a value in the cache right
+after computing it, so the caller waits for it to be encoded and sent to the
+cache backend. With `write_behind=True`, the set is put on a bounded
+in-process queue instead, and a worker thread sends queued sets to the cache
+backend in batches with `set_many`. Writes to a key which is already queued
+replace the queued one, so only the latest is sent. Encoding (pickling,
+compression, chunking and so on) happens on the worker thread too.
+
+The catch is that a value isn't in the cache (and so isn't visible to other
+processes) until it's flushed, up to `CACHECOW_WRITE_BEHIND_FLUSH_INTERVAL`
+later. In particular, `single_flight` waiters may give up on reading the
+value and compute it themselves. Values kept in L1 are set right away.
+
+When the queue is full, new writes are dropped, and counted as `DROPPED` in
+the decorated function's metrics (see `cachecow.metrics`). Queued writes are
+flushed when the process exits, or call `shutdown` yourself. Deleting a key
+with `delete_cache` or `cachecow.client` drops any write queued for it in
+this process, so it can't be written back afterwards.
+
+The default queue is configured with these settings:
+
+    `CACHECOW_WRITE_BEHIND_QUEUE_SIZE`: how many keys may be waiting to be
+    set (1000 by default).
+
+    `CACHECOW_WRITE_BEHIND_BATCH_SIZE`: the most keys to set with a single
+    `set_many` (100 by default). The worker flushes as soon as this many are
+    waiting.
+
+    `CACHECOW_WRITE_BEHIND_FLUSH_INTERVAL`: the longest a write waits before
+    the worker flushes it, in seconds (0.05 by default).
+'''
+
+import atexit
+from collections import OrderedDict
+import logging
+import threading
+import weakref
+
+from django.conf import settings
+from django.core import cache
+
+from cachecow import metrics
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 0.05
+
+# What dropped writes are counted under when they don't belong to a function.
+DEFAULT_METRICS_NAME = 'cachecow.writebehind'
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+# Every WriteBehindQueue created in this process, so that deletions can be
+# applied to all of them.
+_instances = weakref.WeakSet()
+
+
+class WriteBehindQueue(object):
+    '''
+    A bounded queue of pending writes, keyed by cache key, with a worker
+    thread which flushes them. The thread is started on the first write.
+    '''
+    def __init__(self, max_size=DEFAULT_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # key -> (encode, metrics name)
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        # Held while writing, so that writes to a key are sent in order.
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._shutdown = False
+
+        _instances.add(self)
+
+    def submit(self, key, encode, name=None):
+        '''
+        Queues a write for `key`. `encode` is called on the worker thread,
+        and must return a tuple of a dict of the keys and values to set (such
+        as the value at `key` and any chunks of it) and their timeout.
+
+        Replaces any write already queued for `key`. Returns False if the
+        write was dropped, because the queue is full or has been shut down.
+        '''
+        with self._cond:
+            if self._shutdown:
+                dropped = True
+            elif key in self._pending:
+                del self._pending[key]
+                dropped = False
+            else:
+                dropped = len(self._pending) >= self.max_size
+            if not dropped:
+                self._pending[key] = (encode, name)
+                self._start_worker()
+                if len(self._pending) >= self.batch_size:
+                    self._cond.notify()
+
+        if dropped:
+            logger.debug(u'write-behind queue full, dropping %s', key)
+            _record_dropped(name)
+            return False
+        return True
+
+    def discard(self, key):
+        '''
+        Drops any write queued for `key`. If a flush is writing it right now,
+        waits for that to finish, so that a delete which follows isn't
+        overwritten by it.
+        '''
+        with self._flush_lock:
+            with self._cond:
+                self._pending.pop(key, None)
+
+    def flush(self):
+        '''
+        Writes everything queued so far, in the calling thread.
+        '''
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, OrderedDict()
+            if pending:
+                self._write(pending)
+
+    def shutdown(self, wait=True, timeout=None):
+        '''
+        Stops accepting writes and flushes the queued ones. If `wait` is
+        True, blocks until they're written, or until `timeout` seconds have
+        passed.
+        '''
+        with self._cond:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            thread = self._thread
+            self._cond.notify()
+
+        if wait and thread is not None:
+            thread.join(timeout)
+
+    def _start_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work,
+                                            name='cachecow-write-behind',
+                                            daemon=True)
+            self._thread.start()
+            # The thread is a daemon, so flush whatever's left at exit.
+            atexit.register(self.flush)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._shutdown)
+                # Give a batch the chance to fill up.
+                self._cond.wait_for(
+                    lambda: (len(self._pending) >= self.batch_size
+                             or self._shutdown),
+                    timeout=self.flush_interval)
+                shutdown = self._shutdown
+            self.flush()
+            if shutdown:
+                return
+
+    def _write(self, pending):
+        names = {}
+        by_timeout = {}
+        for (key, (encode, name)) in pending.items():
+            try:
+                data, timeout = encode()
+            except Exception:
+                logger.exception(u'error encoding write-behind value for %s',
+                                 key)
+                _record(name, metrics.ERRORS)
+                continue
+            by_timeout.setdefault(timeout, OrderedDict()).update(data)
+            names[key] = name
+
+        for (timeout, data) in by_timeout.items():
+            items = list(data.items())
+            for start in range(0, len(items), self.batch_size):
+                batch = OrderedDict(items[start:start + self.batch_size])
+                try:
+                    cache.cache.set_many(batch, timeout=timeout)
+                except Exception:
+                    logger.exception(u'error flushing %s write-behind values',
+                                     len(batch))
+                    for key in batch:
+                        if key in names:
+                            _record_dropped(names[key])
+
+
+def _record(name, metric):
+    sink = metrics.get_sink()
+    if sink is not None:
+        sink.incr(name or DEFAULT_METRICS_NAME, metric)
+
+
+def _record_dropped(name):
+    _record(name, metrics.DROPPED)
+
+
+def discard(key):
+    '''
+    Drops any write queued for `key` from every WriteBehindQueue in this
+    process.
+    '''
+    for write_queue in list(_instances):
+        write_queue.discard(key)
+
+
+def get_default_queue():
+    '''
+    Returns the process-wide WriteBehindQueue, creating it from settings on
+    first use.
+    '''
+    global _default_queue
+    if _default_queue is None:
+        with _default_queue_lock:
+            if _default_queue is None:
+                _default_queue = WriteBehindQueue(
+                    max_size=getattr(settings,
+                                     'CACHECOW_WRITE_BEHIND_QUEUE_SIZE',
+                                     DEFAULT_QUEUE_SIZE),
+                    batch_size=getattr(settings,
+                                       'CACHECOW_WRITE_BEHIND_BATCH_SIZE',
+                                       DEFAULT_BATCH_SIZE),
+                    flush_interval=getattr(
+                        settings, 'CACHECOW_WRITE_BEHIND_FLUSH_INTERVAL',
+                        DEFAULT_FLUSH_INTERVAL))
+    return _default_queue
+
+
+def resolve_write_behind(write_behind):
+    '''
+    Turns the `write_behind` argument accepted by the decorators into a
+    WriteBehindQueue, or None if it's disabled.
+    '''
+    if write_behind is True:
+        return get_default_queue()
+    if not write_behind:
+        return None
+    return write_behind
+
+
+def shutdown(wait=True, timeout=None):
+    '''
+    Shuts down the default queue, flushing queued writes. A new default
+    queue is created if one is needed again.
+    '''
+    global _default_queue
+    with _default_queue_lock:
+        write_queue, _default_queue = _default_queue, None
+    if write_queue is not None:
+        write_queue.shutdown(wait=wait, timeout=timeout)
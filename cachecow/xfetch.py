@@ -0,0 +1,41 @@
+'''
+Probabilistic early recomputation of cached values, as described in
+"Optimal Probabilistic Cache Stampede Prevention" by Vattani, Chierichetti and
+Lowenstein (the "XFetch" algorithm).
+
+Each read of a value recomputes it early with a probability that grows as its
+expiry approaches, scaled by how long the value took to compute. Expensive
+values thereby tend to be recomputed by a single caller shortly before they
+expire, without any locking. See the `xfetch_beta` argument of
+`cached_function`.
+
+`clock` and `random` are the sources of the current Unix time and of uniform
+random numbers in [0, 1). Replace them to make recomputation deterministic,
+e.g. in tests.
+'''
+
+import math
+import random as _random
+import time
+
+from cachecow.cache import CacheEntry
+
+
+clock = time.time
+random = _random.random
+
+
+def should_recompute(entry, beta=1.0):
+    '''
+    Returns True if the caller that read `entry` should recompute it now.
+
+    Only values stored as a `CacheEntry` with both an expiry and a compute
+    time can be recomputed early. A `beta` above 1 favours earlier
+    recomputation, and below 1 later.
+    '''
+    if (not isinstance(entry, CacheEntry)
+            or entry.expiry is None or entry.compute_time is None):
+        return False
+    # `1 - random()` is in (0, 1], so its log is finite and <= 0.
+    gap = -entry.compute_time * beta * math.log(1.0 - random())
+    return clock() + gap >= entry.expiry
@@ -26,7 +26,7 @@ setup(
     author_email='alex.ehlke@gmail.com',
     url='http://github.com/aehlke/django-cachecow',
     license='BSD',
-    packages=find_packages(exclude=['ez_setup']),
+    packages=find_packages(exclude=['ez_setup', 'benchmarks']),
     namespace_packages=[],
     include_package_data=True,
     zip_safe=False,